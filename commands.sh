@@ -6,8 +6,26 @@ export PYTHONPATH="$SUMO_HOME/tools:$PYTHONPATH"
 
 # Run the simulation
 # python -c 'import ./utils/helpers as uh; uh.run_simulation()'
+# Or simulate every scenario, a few at a time; rerunning resumes failed scenarios
+# python -m utils.sweep --workers 4
+# Add --backend libsumo to run SUMO in-process if libsumo is installed
+# Or make up the datasets of a scenario without SUMO, eg. for benchmarking; by
+# default into regular_summer_weekday, which the repository does not ship
+# python -m utils.synthetic --vehicles 3000 --seconds 3600
+# Warning: --overwrite replaces the datasets of an existing scenario, eg. with
+# --season autumn the shipped trip_results of the Kamppi scenario
+# python -m utils.synthetic --season autumn --overwrite
+
+# Convert the scenario datasets into parquet
+python -m utils.store
 
 # Run the visualization app
 python -m "new_app.py"
+# Or serve it in production, several processes sharing the preloaded datasets
+# python serve.py --workers 4 --threads 4
+
+# Measure the ingest, data access and figures on synthetic scenarios, and
+# compare them against the saved baseline; save one first with --save-baseline
+# python -m utils.benchmark --scales small medium
 
 # Finally, click on the link in the terminal output!
\ No newline at end of file
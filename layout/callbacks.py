@@ -1,6 +1,11 @@
+import json
+import concurrent.futures
+import plotly.utils
 from dash import Input, Output, State, dcc, html
+from dash.exceptions import PreventUpdate
 import utils.helpers as uh
 import utils.constants as uc
+import utils.frames as uf
 import layout.components as lc
 import pandas as pd
 import numpy as np
@@ -9,6 +14,780 @@ basic_style = {"paddingTop": "2vh", "paddingBottom": "2vh"}
 empty_style = {"display": "none"}
 
 
+def _heatmap_graph(network, variable, delivery=uc.HEATMAP_DELIVERY):
+    """Draws a heatmap with every frame, or with its first frame if delivered lazily."""
+    if delivery == "lazy":
+        figure, state = uh.create_lazy_heatmap(network=network, variable=variable)
+        return lc.lazy_heatmap(figure, state)
+    heatmap = uh.create_heatmap(network=network, variable=variable)
+    return dcc.Graph(figure=heatmap, responsive=True, style=lc.heatmap_style)
+
+
+# The components show_graphs fills, in output order
+GRAPH_OUTPUTS = [
+    "figure-one-div",
+    "figure-two-div",
+    "figure-three-div",
+    "figure-four-div",
+    "summary-text",
+]
+
+
+def _timeline(scenario, variable, timestep_range):
+    """
+    Returns the dataset of a variable with its Timestep column.
+
+    The dataset is read and binned once per view and shared by the callbacks
+    drawing the view's figures, which must not modify it.
+    """
+    key = (
+        "timeline",
+        *scenario.values(),
+        variable,
+        timestep_range,
+        uh.data_version(
+            scenario["area"],
+            scenario["demand"],
+            scenario["season"],
+            scenario["time"],
+            scenario["optimization"],
+        ),
+    )
+
+    def compute():
+        network = uh.get_data(**scenario, variable=variable)
+        return uh.new_timeline(network=network, timestep_range=timestep_range)
+
+    return uh.view_cache.get(key, compute)
+
+
+def _summary_figures(scenario):
+    """Returns the drawers of the Summary tab's figures by output position."""
+
+    def travel_networks():
+        # The Summary tab only reads the KPI sidecars, not the datasets
+        return [
+            uh.trip_kpis(uh.get_kpis(**{**scenario, "situation": situation}))
+            for situation in ["Baseline", "Optimized"]
+        ]
+
+    def summary_text():
+        return dcc.Markdown(
+            """Summary WIP!""",
+            style={
+                "paddingTop": "2vh",
+                "paddingBottom": "2vh",
+                "fontSize": "1.2em",
+            },
+        )
+
+    # Traffic KPI and mobility mode
+    def mobility_flow():
+        baseline_avg_travel_network, optimized_avg_travel_network = (
+            travel_networks()
+        )
+        mobility_flow_bar = uh.create_traffic_situation_bar_plot(
+            optimized_network=optimized_avg_travel_network,
+            baseline_network=baseline_avg_travel_network,
+            variable="Mobility flow",
+            xaxis_title=f"{uc.UNITS['Mobility flow']}",
+            title="Mobility mode distribution",
+        )
+        return dcc.Graph(
+            figure=mobility_flow_bar,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    def travel_time():
+        baseline_avg_travel_network, optimized_avg_travel_network = (
+            travel_networks()
+        )
+        travel_time_bar = uh.create_traffic_situation_bar_plot(
+            optimized_network=optimized_avg_travel_network,
+            baseline_network=baseline_avg_travel_network,
+            variable="Travel time",
+            xaxis_title=f"{uc.UNITS['Travel time']}",
+            title="Average travel time",
+        )
+        return dcc.Graph(
+            figure=travel_time_bar,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    # AQ KPI
+    def air_quality():
+        baseline_avg_AQ_network, optimized_avg_AQ_network = [
+            pd.DataFrame(
+                data={
+                    "Respirable particles": [
+                        uh.get_kpis(**{**scenario, "situation": situation})[
+                            "emissions"
+                        ].get("Respirable particles", 0.0)
+                    ]
+                }
+            )
+            for situation in ["Baseline", "Optimized"]
+        ]
+        aq_bar = uh.create_situation_bar_plot(
+            optimized_network=optimized_avg_AQ_network,
+            baseline_network=baseline_avg_AQ_network,
+            variable="Respirable particles",
+            xaxis_title=f"{uc.UNITS['Respirable particles']}",
+            title="Respirable particles",
+        )
+        return dcc.Graph(
+            figure=aq_bar,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    # Livability KPI
+    # baseline_livability_network = uh.get_data(
+    #     **{**scenario, "situation": situation},
+    #     variable="Relocation rate",
+    # )
+    # optimized_livability_network = uh.get_data(
+    #     **{**scenario, "situation": situation},
+    #     variable="Relocation rate",
+    # )
+    return {0: mobility_flow, 1: travel_time, 2: air_quality, 4: summary_text}
+
+
+def _livability_figures(scenario):
+    """Returns the drawers of the Livability tab's figures by output position."""
+
+    def summary_text():
+        return dcc.Markdown(
+            """Livability WIP!""",
+            style={
+                "paddingTop": "2vh",
+                "paddingBottom": "2vh",
+                "fontSize": "1.2em",
+            },
+        )
+
+    return {4: summary_text}
+
+
+def _trip_figures(scenario, variable):
+    """Returns the drawers of the travel and lost time figures by output position."""
+
+    def network():
+        key = (
+            "trips",
+            *scenario.values(),
+            variable,
+            uh.data_version(
+                scenario["area"],
+                scenario["demand"],
+                scenario["season"],
+                scenario["time"],
+                scenario["optimization"],
+            ),
+        )
+        return uh.view_cache.get(
+            key, lambda: uh.get_data(**scenario, variable=variable)
+        )
+
+    def histogram():
+        # Draw the histogram
+        histogram = uh.create_mobility_mode_histogram(
+            network=network(), variable=variable
+        )
+        return dcc.Graph(
+            figure=histogram,
+            responsive=True,
+            style={"height": "30vw"},
+        )
+
+    def bar():
+        # Calculate data
+        barplot_network = (
+            network()
+            .groupby(["Mobility mode"])
+            .agg({variable: "mean", "Mobility flow": "sum"})
+            .reset_index()
+        )
+        # Draw the bar plot
+        bar_plot = uh.create_mobility_mode_avg_bar_plot(
+            network=barplot_network, variable=variable
+        )
+        bar_plot.update_layout(xaxis_title=f"Average {variable.lower()} in seconds")
+        # Output the plot
+        return dcc.Graph(
+            figure=bar_plot,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    return {1: histogram, 2: bar}
+
+
+def _mobility_flow_figures(scenario, variable, timeline_type, timestep_range):
+    """Returns the drawers of the mobility flow figures by output position."""
+
+    def heatmap():
+        # network, current_location = uh.spatial_scope(
+        #     spatial_click_data, network
+        # )
+        cube = uh.get_cube(**scenario)
+        heatmap_network = uh.rollup_cube(
+            cube=cube,
+            timestep_range=timestep_range,
+            aggregations={variable: "sum"},
+        )
+        if timeline_type == "mean":
+            heatmap_network[variable] = heatmap_network[variable] / timestep_range
+        # Draw the heatmap
+        return _heatmap_graph(heatmap_network, variable)
+
+    def area():
+        # Calculate data
+        network = _timeline(scenario, variable, timestep_range)
+        if timeline_type == "mean":
+            area_network = uh.aggregate_groups(
+                network,
+                ["Mobility mode", "Simulation timestep", "Timestep"],
+                {"Vehicle": "nunique"},
+            ).reset_index()
+            area_network = (
+                area_network.groupby(["Mobility mode", "Timestep"], observed=False)
+                .agg({"Vehicle": timeline_type})
+                .reset_index()
+            )
+            area_network.fillna(value={"Vehicle": 0})
+
+        elif timeline_type == "sum":
+            area_network = uh.aggregate_groups(
+                network, ["Mobility mode", "Timestep"], {"Vehicle": "nunique"}
+            ).reset_index()
+            area_network = (
+                area_network.groupby(["Mobility mode", "Timestep"], observed=False)
+                .agg({"Vehicle": timeline_type})
+                .reset_index()
+            )
+            area_network.fillna(value={"Vehicle": 0})
+
+        # Draw the area chart
+        area_plot = uh.create_area_chart(network=area_network, variable="Vehicle")
+        return dcc.Graph(
+            figure=area_plot,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    return {0: heatmap, 2: area}
+
+
+def _noise_figures(scenario, variable, timeline_type, timestep_range):
+    """Returns the drawers of the noise figures by output position."""
+
+    def heatmap():
+        # Calculate the data
+        network = _timeline(scenario, variable, timestep_range)
+        # network, current_location = uh.spatial_scope(
+        #     spatial_click_data, network
+        # )
+        # helper_network = (
+        #     second_network.groupby(["Timestep", "Edge"], observed=False)
+        #     .agg(
+        #         {
+        #             "Mobility flow": "sum",
+        #         }
+        #     )
+        #     .reset_index()
+        # )
+        # network = network.merge(
+        #     helper_network[["Edge", "Mobility flow", "Timestep"]],
+        #     on=["Edge", "Timestep"],
+        #     how="left",
+        # )
+        # print(network.head())
+        heatmap_network = (
+            network.groupby(["Timestep", "Edge"], observed=False)
+            .agg(
+                {
+                    variable: "mean",
+                    "Longitude": "first",
+                    "Latitude": "first",
+                    "Name": "first",
+                    "Mobility flow": "sum",
+                }
+            )
+            .reset_index()
+        )
+        heatmap_network.fillna(value={variable: 0})
+        # Draw the heatmap
+        return html.Div(
+            [
+                _heatmap_graph(heatmap_network, variable),
+                lc.plots_location_text,
+                lc.plots_reset_button,
+            ]
+        )
+
+    def bar():
+        # Calculate the data
+        second_network = _timeline(scenario, "Noise2", timestep_range)
+        barplot_network = uh.aggregate_groups(
+            second_network,
+            ["Mobility mode"],
+            {variable: "mean", "Vehicle": "nunique"},
+        ).reset_index()
+        # barplot_network["Vehicle average"] = np.round(
+        #     barplot_network[variable] / barplot_network["Mobility flow"], 4
+        # )
+        # Draw the bar plot
+        bar_plot = uh.create_mobility_mode_avg_bar_plot(
+            network=barplot_network, variable=variable
+        )
+        # Output the plot
+        return dcc.Graph(
+            figure=bar_plot,
+            responsive=True,
+            style={"height": "30vw"},
+        )
+
+    def area():
+        # Calculate the data
+        second_network = _timeline(scenario, "Noise2", timestep_range)
+        area_network = uh.aggregate_groups(
+            second_network,
+            ["Mobility mode", "Timestep"],
+            {"Vehicle": "nunique", variable: "mean"},
+        ).reset_index()
+
+        # Draw the area chart
+        area_plot = uh.create_area_chart(network=area_network, variable=variable)
+        # area_plot.update_layout(
+        #     labels={"Vehicle": "Mobility flow"},
+        # )
+        return dcc.Graph(
+            figure=area_plot,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    return {0: heatmap, 1: bar, 2: area}
+
+
+def _speed_figures(scenario, variable, timeline_type, timestep_range):
+    """Returns the drawers of the speed figures by output position."""
+
+    def heatmap():
+        # network, current_location = uh.spatial_scope(
+        #     spatial_click_data, network
+        # )
+        cube = uh.get_cube(**scenario)
+        heatmap_network = uh.rollup_cube(
+            cube=cube,
+            timestep_range=timestep_range,
+            aggregations={variable: "mean", "Mobility flow": timeline_type},
+        )
+        # Draw the heatmap
+        return html.Div(
+            [
+                _heatmap_graph(heatmap_network, variable),
+                lc.plots_location_text,
+                lc.plots_reset_button,
+            ]
+        )
+
+    def bar():
+        # Calculate the data
+        network = _timeline(scenario, variable, timestep_range)
+        barplot_network = uh.aggregate_groups(
+            network, ["Mobility mode"], {variable: "mean", "Vehicle": "nunique"}
+        ).reset_index()
+        # barplot_network["Vehicle average"] = np.round(
+        #     barplot_network[variable] / barplot_network["Mobility flow"], 4
+        # )
+        # Draw the bar plot
+        bar_plot = uh.create_mobility_mode_avg_bar_plot(
+            network=barplot_network, variable=variable
+        )
+        # Output the plot
+        return dcc.Graph(
+            figure=bar_plot,
+            responsive=True,
+            style={"height": "30vw"},
+        )
+
+    def area():
+        # Calculate the data
+        network = _timeline(scenario, variable, timestep_range)
+        # area_network = (
+        #     network.groupby(["Timestep"], observed=False)
+        #     .agg(
+        #         {
+        #             variable: timeline_type,
+        #             "Mobility flow": timeline_type,
+        #             "Mobility mode": "first",
+        #         }
+        #     )
+        #     .reset_index()
+        # )
+        # if timeline_type == "mean":
+        #     area_network = (
+        #         network.groupby(["Mobility mode", "Timestep"], observed=False)
+        #         .agg({"Vehicle": pd.Series.nunique, variable: "mean"})
+        #         .reset_index()
+        #     )
+        # elif timeline_type == "sum":
+        area_network = uh.aggregate_groups(
+            network,
+            ["Mobility mode", "Timestep"],
+            {"Vehicle": "nunique", variable: "mean"},
+        ).reset_index()
+
+        # Draw the area chart
+        area_plot = uh.create_area_chart(network=area_network, variable=variable)
+        # area_plot.update_layout(
+        #     labels={"Vehicle": "Mobility flow"},
+        # )
+        return dcc.Graph(
+            figure=area_plot,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    return {0: heatmap, 1: bar, 2: area}
+
+
+def _air_quality_figures(scenario, variable, timeline_type, timestep_range):
+    """Returns the drawers of the air quality figures by output position."""
+
+    def heatmap():
+        # network, current_location = uh.spatial_scope(
+        #     spatial_click_data, network
+        # )
+        cube = uh.get_cube(**scenario)
+        heatmap_network = uh.rollup_cube(
+            cube=cube,
+            timestep_range=timestep_range,
+            aggregations={
+                variable: timeline_type,
+                "Mobility flow": timeline_type,
+            },
+        )
+        # Draw the heatmap
+        return html.Div(
+            [
+                _heatmap_graph(heatmap_network, variable),
+                lc.plots_location_text,
+                lc.plots_reset_button,
+            ]
+        )
+
+    def bar():
+        # Calculate the data
+        network = _timeline(scenario, variable, timestep_range)
+        barplot_network = (
+            network.groupby(["Mobility mode"], observed=False)
+            .agg({variable: "sum", "Mobility flow": "sum"})
+            .reset_index()
+        )
+        barplot_network["Vehicle average"] = np.round(
+            barplot_network[variable] / barplot_network["Mobility flow"], 4
+        )
+        # Draw the bar plot
+        bar_plot = uh.create_mobility_mode_avg_bar_plot(
+            network=barplot_network, variable=variable
+        )
+        # Output the plot
+        return dcc.Graph(
+            figure=bar_plot,
+            responsive=True,
+            style={"height": "30vw"},
+        )
+
+    def area():
+        # Calculate data
+        network = _timeline(scenario, variable, timestep_range)
+        if timeline_type == "mean":
+            area_network = uh.aggregate_groups(
+                network,
+                ["Mobility mode", "Simulation timestep", "Timestep"],
+                {"Vehicle": "nunique", variable: timeline_type},
+            ).reset_index()
+            area_network = (
+                area_network.groupby(["Mobility mode", "Timestep"], observed=False)
+                .agg({"Vehicle": timeline_type, variable: timeline_type})
+                .reset_index()
+            )
+        elif timeline_type == "sum":
+            area_network = uh.aggregate_groups(
+                network,
+                ["Mobility mode", "Timestep"],
+                {"Vehicle": "nunique", variable: timeline_type},
+            ).reset_index()
+
+        # Draw the area chart
+        area_plot = uh.create_area_chart(network=area_network, variable="Vehicle")
+        # Output the plot
+        return dcc.Graph(
+            figure=area_plot,
+            responsive=True,
+            style={
+                "height": "30vw",
+                "paddingBottom": "2vh",
+                "paddingTop": "2vh",
+            },
+        )
+
+    return {0: heatmap, 1: bar, 2: area}
+
+
+def _figures(
+    tab,
+    season,
+    time,
+    area,
+    demand,
+    traffic_priority,
+    situation,
+    variable,
+    timeline_type,
+    timestep_range,
+):
+    """Returns the drawers of a view's figures by output position."""
+    params = [
+        season,
+        time,
+        area,
+        demand,
+        traffic_priority,
+        situation,
+        variable,
+        timeline_type,
+        timestep_range,
+    ]
+    all_params_ready = all(param is not None for param in params)
+    scenario = {
+        "area": area,
+        "season": season,
+        "time": time,
+        "demand": demand,
+        "optimization": traffic_priority,
+        "situation": situation,
+    }
+    # current_location = """Location: Network"""
+    # Summary
+    if tab == lc.OBJECTIVES[0]:
+        return _summary_figures(scenario)
+    # Livability
+    elif tab == lc.OBJECTIVES[3] and situation is not None:
+        return _livability_figures(scenario)
+    elif tab == lc.OBJECTIVES[1] and variable in ["Travel time", "Lost time"]:
+        return _trip_figures(scenario, variable)
+    # Params required
+    elif all_params_ready:
+        # Mobility flow
+        # Heatmap + area chart
+        if tab == lc.OBJECTIVES[1] and variable == "Mobility flow":
+            return _mobility_flow_figures(
+                scenario, variable, timeline_type, timestep_range
+            )
+        # Noise
+        # Heatmap + bar plot + area chart
+        elif tab == lc.OBJECTIVES[1] and variable == "Noise":
+            return _noise_figures(scenario, variable, timeline_type, timestep_range)
+        elif tab == lc.OBJECTIVES[1] and variable == "Speed":
+            return _speed_figures(scenario, variable, timeline_type, timestep_range)
+        # AQ variables
+        elif tab == lc.OBJECTIVES[2]:
+            return _air_quality_figures(
+                scenario, variable, timeline_type, timestep_range
+            )
+    return {}
+
+
+def _heatmap_states(output):
+    """Yields the state of every lazy heatmap in a serialized output."""
+    if isinstance(output, dict):
+        props = output.get("props")
+        if isinstance(props, dict) and props.get("id") == "heatmap-frames":
+            yield props.get("data")
+        for value in output.values():
+            yield from _heatmap_states(value)
+    elif isinstance(output, list):
+        for value in output:
+            yield from _heatmap_states(value)
+
+
+def _frames_registered(value):
+    """
+    Returns whether the lazy heatmaps of a cached output can draw their frames.
+
+    The rows of a heatmap are removed from the disk once newer heatmaps take
+    their place, while the output can stay in the figure cache, so it is drawn
+    again, registering the rows again, rather than shown with frames that
+    cannot be drawn.
+    """
+    return all(
+        state is None or uf.registered(state["key"])
+        for state in _heatmap_states(json.loads(value))
+    )
+
+
+def show_figure(position, tab, season, time, area, demand, traffic_priority, *params):
+    """
+    Draws one output of show_graphs through the figure cache.
+
+    The figures are keyed by their position, every parameter, the heatmap
+    settings and the version of the scenario's datasets, so repeated views are
+    read from the disk instead of being drawn again.
+
+    Args:
+        position (int): The position of the output in GRAPH_OUTPUTS.
+        tab (str): The results tab.
+        season, time, area, demand, traffic_priority, *params: The parameters
+            of show_graphs after the tab.
+
+    Returns:
+        object: The output as a Dash component or its dictionary, an empty
+                list if the view has no such output.
+    """
+    figures = _figures(tab, season, time, area, demand, traffic_priority, *params)
+    draw = figures.get(position)
+    if draw is None:
+        return []
+    scenario = [season, time, area, demand, traffic_priority]
+    if any(param is None for param in scenario):
+        return draw()
+    key = (
+        uc.FIGURE_CACHE_VERSION,
+        position,
+        tab,
+        area,
+        season,
+        time,
+        demand,
+        traffic_priority,
+        *params,
+        uc.HEATMAP_RENDERING,
+        uc.HEATMAP_DELIVERY,
+        uh.data_version(area, demand, season, time, traffic_priority),
+    )
+
+    def render():
+        return json.dumps(draw(), cls=plotly.utils.PlotlyJSONEncoder)
+
+    valid = None
+    if uc.HEATMAP_DELIVERY == "lazy":
+        valid = _frames_registered
+    return json.loads(uh.figure_cache.get(key, render, valid=valid))
+
+
+def show_graphs(
+    # spatial_click_data,
+    n_clicks,
+    tab,
+    season,
+    time,
+    area,
+    demand,
+    traffic_priority,
+    situation,
+    variable,
+    timeline_type,
+    timestep_range,
+    workers=uc.GRAPH_WORKERS,
+):
+    """
+    Draws every output of a view at once, the figures in a thread pool.
+
+    The app draws the outputs in separate callbacks instead, so that every
+    figure is shown as soon as it is ready.
+
+    Returns:
+        list: The outputs in GRAPH_OUTPUTS order.
+    """
+    params = [
+        tab,
+        season,
+        time,
+        area,
+        demand,
+        traffic_priority,
+        situation,
+        variable,
+        timeline_type,
+        timestep_range,
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(
+                lambda position: show_figure(position, *params),
+                range(len(GRAPH_OUTPUTS)),
+            )
+        )
+
+
+def _graph_callback(position):
+    """Returns the callback drawing the output of show_graphs at a position."""
+
+    def show_graph(
+        n_clicks,
+        tab,
+        season,
+        time,
+        area,
+        demand,
+        traffic_priority,
+        situation,
+        variable,
+        timeline_type,
+        timestep_range,
+    ):
+        return show_figure(
+            position,
+            tab,
+            season,
+            time,
+            area,
+            demand,
+            traffic_priority,
+            situation,
+            variable,
+            timeline_type,
+            timestep_range,
+        )
+
+    show_graph.__name__ = f"show_graph_{position}"
+    return show_graph
+
+
 def register_callbacks(app):
     @app.callback(
         Output("project-info-collapse", "is_open"),
@@ -151,725 +930,70 @@ def register_callbacks(app):
         else:
             return basic_style, basic_style
 
+    graph_inputs = [
+        # Input("figure-one", "clickData"),
+        Input("visualize-button", "n_clicks"),
+        Input("results-tabs", "value"),
+        State("crossfilter-season", "value"),
+        State("crossfilter-time", "value"),
+        State("crossfilter-area", "value"),
+        State("crossfilter-demand", "value"),
+        State("traffic-priority", "value"),
+        State("crossfilter-situation", "value"),
+        State("crossfilter-variable", "value"),
+        State("crossfilter-timeline-type", "value"),
+        State("crossfilter-timestep", "value"),
+    ]
+    # Every output has its own callback, so the figures are drawn at the same
+    # time and each one is shown as soon as it is ready
+    for position, component_id in enumerate(GRAPH_OUTPUTS):
+        app.callback(Output(component_id, "children"), graph_inputs)(
+            _graph_callback(position)
+        )
+
     @app.callback(
         [
-            Output("figure-one-div", "children"),
-            Output("figure-two-div", "children"),
-            Output("figure-three-div", "children"),
-            Output("figure-four-div", "children"),
-            Output("summary-text", "children"),
-            # Output("location-text", "children"),
+            Output("heatmap-graph", "figure"),
+            Output("heatmap-frame-label", "children"),
         ],
+        Input("heatmap-frame-slider", "value"),
+        State("heatmap-frames", "data"),
+        prevent_initial_call=True,
+    )
+    def show_heatmap_frame(index, state):
+        if state is None or index is None:
+            raise PreventUpdate
+        frame = uh.heatmap_frame(state, index)
+        if frame is None:
+            raise PreventUpdate
+        return frame, f"Time (in minutes): {state['timesteps'][index]}"
+
+    @app.callback(
         [
-            # Input("figure-one", "clickData"),
-            Input("visualize-button", "n_clicks"),
-            Input("results-tabs", "value"),
-            State("crossfilter-season", "value"),
-            State("crossfilter-time", "value"),
-            State("crossfilter-area", "value"),
-            State("crossfilter-demand", "value"),
-            State("traffic-priority", "value"),
-            State("crossfilter-situation", "value"),
-            State("crossfilter-variable", "value"),
-            State("crossfilter-timeline-type", "value"),
-            State("crossfilter-timestep", "value"),
+            Output("heatmap-player", "disabled"),
+            Output("heatmap-play-button", "children"),
         ],
+        Input("heatmap-play-button", "n_clicks"),
+        State("heatmap-player", "disabled"),
+        prevent_initial_call=True,
     )
-    def show_graphs(
-        # spatial_click_data,
-        n_clicks,
-        tab,
-        season,
-        time,
-        area,
-        demand,
-        traffic_priority,
-        situation,
-        variable,
-        timeline_type,
-        timestep_range,
-    ):
-        params = [
-            season,
-            time,
-            area,
-            demand,
-            traffic_priority,
-            situation,
-            variable,
-            timeline_type,
-            timestep_range,
-        ]
-        all_params_ready = all(param is not None for param in params)
-        # Initialize outputs
-        first_plot = []
-        second_plot = []
-        third_plot = []
-        fourth_plot = []
-        summary_text = []
-        # current_location = """Location: Network"""
-        # Summary
-        if tab == lc.OBJECTIVES[0]:
-            summary_text = dcc.Markdown(
-                """Summary WIP!""",
-                style={
-                    "paddingTop": "2vh",
-                    "paddingBottom": "2vh",
-                    "fontSize": "1.2em",
-                },
-            )
+    def toggle_heatmap_player(n, disabled):
+        icon = "bi bi-pause-fill" if disabled else "bi bi-play-fill"
+        return not disabled, html.I(className=icon)
 
-            # Traffic KPI and mobility mode
-            baseline_traffic_network = uh.get_data(
-                area=area,
-                season=season,
-                time=time,
-                demand=demand,
-                optimization=traffic_priority,
-                situation="Baseline",
-                variable="Travel time",
-            )
-            baseline_avg_travel_network = (
-                baseline_traffic_network.groupby(["Mobility mode"], observed=False)
-                .agg({"Travel time": "mean", "Mobility flow": "sum"})
-                .reset_index()
-            )
-
-            optimized_traffic_network = uh.get_data(
-                area=area,
-                season=season,
-                time=time,
-                demand=demand,
-                optimization=traffic_priority,
-                situation="Optimized",
-                variable="Travel time",
-            )
-
-            optimized_avg_travel_network = (
-                optimized_traffic_network.groupby(["Mobility mode"], observed=False)
-                .agg({"Travel time": "mean", "Mobility flow": "sum"})
-                .reset_index()
-            )
-
-            mobility_flow_bar = uh.create_traffic_situation_bar_plot(
-                optimized_network=optimized_avg_travel_network,
-                baseline_network=baseline_avg_travel_network,
-                variable="Mobility flow",
-                xaxis_title=f"{uc.UNITS['Mobility flow']}",
-                title="Mobility mode distribution",
-            )
-            first_plot = dcc.Graph(
-                figure=mobility_flow_bar,
-                responsive=True,
-                style={
-                    "height": "30vw",
-                    "paddingBottom": "2vh",
-                    "paddingTop": "2vh",
-                },
-            )
-
-            travel_time_bar = uh.create_traffic_situation_bar_plot(
-                optimized_network=optimized_avg_travel_network,
-                baseline_network=baseline_avg_travel_network,
-                variable="Travel time",
-                xaxis_title=f"{uc.UNITS['Travel time']}",
-                title="Average travel time",
-            )
-            second_plot = dcc.Graph(
-                figure=travel_time_bar,
-                responsive=True,
-                style={
-                    "height": "30vw",
-                    "paddingBottom": "2vh",
-                    "paddingTop": "2vh",
-                },
-            )
-
-            # AQ KPI
-            baseline_AQ_network = uh.get_data(
-                area=area,
-                season=season,
-                time=time,
-                demand=demand,
-                optimization=traffic_priority,
-                situation="Baseline",
-                variable="Respirable particles",
-            )
-            baseline_avg_AQ_network = pd.DataFrame(
-                data={
-                    "Respirable particles": [
-                        baseline_AQ_network["Respirable particles"].sum()
-                    ]
-                }
-            )
-
-            optimized_AQ_network = uh.get_data(
-                area=area,
-                season=season,
-                time=time,
-                demand=demand,
-                optimization=traffic_priority,
-                situation="Optimized",
-                variable="Respirable particles",
-            )
-            optimized_avg_AQ_network = pd.DataFrame(
-                data={
-                    "Respirable particles": [
-                        optimized_AQ_network["Respirable particles"].sum()
-                    ]
-                }
-            )
-
-            aq_bar = uh.create_situation_bar_plot(
-                optimized_network=optimized_avg_AQ_network,
-                baseline_network=baseline_avg_AQ_network,
-                variable="Respirable particles",
-                xaxis_title=f"{uc.UNITS['Respirable particles']}",
-                title="Respirable particles",
-            )
-            third_plot = dcc.Graph(
-                figure=aq_bar,
-                responsive=True,
-                style={
-                    "height": "30vw",
-                    "paddingBottom": "2vh",
-                    "paddingTop": "2vh",
-                },
-            )
-
-            # Livability KPI
-            # baseline_livability_network = uh.get_data(
-            #     area=area,
-            #     season=season,
-            #     time=time,
-            #     demand=demand,
-            #     optimization=traffic_priority,
-            #     situation=situation,
-            #     variable="Relocation rate",
-            # )
-            # optimized_livability_network = uh.get_data(
-            #     area=area,
-            #     season=season,
-            #     time=time,
-            #     demand=demand,
-            #     optimization=traffic_priority,
-            #     situation=situation,
-            #     variable="Relocation rate",
-            # )
-        # Livability
-        elif tab == lc.OBJECTIVES[3] and situation is not None:
-            summary_text = dcc.Markdown(
-                """Livability WIP!""",
-                style={
-                    "paddingTop": "2vh",
-                    "paddingBottom": "2vh",
-                    "fontSize": "1.2em",
-                },
-            )
-        elif tab == lc.OBJECTIVES[1] and variable in ["Travel time", "Lost time"]:
-            network = uh.get_data(
-                area=area,
-                season=season,
-                time=time,
-                demand=demand,
-                optimization=traffic_priority,
-                situation=situation,
-                variable=variable,
-            )
-            # Draw the histogram
-            histogram = uh.create_mobility_mode_histogram(
-                network=network, variable=variable
-            )
-            second_plot = dcc.Graph(
-                figure=histogram,
-                responsive=True,
-                style={"height": "30vw"},
-            )
-
-            # Calculate data
-            barplot_network = (
-                network.groupby(["Mobility mode"])
-                .agg({variable: "mean", "Mobility flow": "sum"})
-                .reset_index()
-            )
-            # Draw the bar plot
-            bar_plot = uh.create_mobility_mode_avg_bar_plot(
-                network=barplot_network, variable=variable
-            )
-            bar_plot.update_layout(xaxis_title=f"Average {variable.lower()} in seconds")
-            # Output the plot
-            third_plot = dcc.Graph(
-                figure=bar_plot,
-                responsive=True,
-                style={
-                    "height": "30vw",
-                    "paddingBottom": "2vh",
-                    "paddingTop": "2vh",
-                },
-            )
-        # Params required
-        elif all_params_ready:
-            # Mobility flow
-            if tab == lc.OBJECTIVES[1] and variable == "Mobility flow":
-                # Calculate data
-                network = uh.get_data(
-                    area=area,
-                    season=season,
-                    time=time,
-                    demand=demand,
-                    optimization=traffic_priority,
-                    situation=situation,
-                    variable=variable,
-                )
-                network = uh.new_timeline(
-                    network=network, timestep_range=timestep_range
-                )
-                # network, current_location = uh.spatial_scope(
-                #     spatial_click_data, network
-                # )
-                heatmap_network = (
-                    network.groupby(["Timestep", "Edge"], observed=False)
-                    .agg(
-                        {
-                            variable: "sum",
-                            "Longitude": "first",
-                            "Latitude": "first",
-                            "Name": "first",
-                        }
-                    )
-                    .reset_index()
-                )
-                if timeline_type == "mean":
-                    heatmap_network[variable] = (
-                        heatmap_network[variable] / timestep_range
-                    )
-                # Draw the heatmap
-                heatmap = uh.create_heatmap(network=heatmap_network, variable=variable)
-                first_plot = dcc.Graph(
-                    figure=heatmap,
-                    responsive=True,
-                    style={
-                        "height": "50vw",
-                        "width": "55vw",
-                        "paddingBottom": "2vh",
-                    },
-                )
-
-                # Calculate data
-                if timeline_type == "mean":
-                    area_network = (
-                        network.groupby(
-                            ["Mobility mode", "Simulation timestep", "Timestep"],
-                            observed=False,
-                        )
-                        .agg({"Vehicle": lambda x: x.nunique()})
-                        .reset_index()
-                    )
-                    area_network = (
-                        area_network.groupby(
-                            ["Mobility mode", "Timestep"], observed=False
-                        )
-                        .agg({"Vehicle": timeline_type})
-                        .reset_index()
-                    )
-                    area_network.fillna(value={"Vehicle": 0})
-
-                elif timeline_type == "sum":
-                    area_network = (
-                        network.groupby(["Mobility mode", "Timestep"], observed=False)
-                        .agg({"Vehicle": lambda x: x.nunique()})
-                        .reset_index()
-                    )
-                    area_network = (
-                        area_network.groupby(
-                            ["Mobility mode", "Timestep"], observed=False
-                        )
-                        .agg({"Vehicle": timeline_type})
-                        .reset_index()
-                    )
-                    area_network.fillna(value={"Vehicle": 0})
-
-                # Draw the area chart
-                area_plot = uh.create_area_chart(
-                    network=area_network, variable="Vehicle"
-                )
-                third_plot = dcc.Graph(
-                    figure=area_plot,
-                    responsive=True,
-                    style={
-                        "height": "30vw",
-                        "paddingBottom": "2vh",
-                        "paddingTop": "2vh",
-                    },
-                )
-
-            elif tab == lc.OBJECTIVES[1] and variable == "Noise":
-                # Calculate the data
-                network = uh.get_data(
-                    area=area,
-                    season=season,
-                    time=time,
-                    demand=demand,
-                    optimization=traffic_priority,
-                    situation=situation,
-                    variable=variable,
-                )
-                network = uh.new_timeline(
-                    network=network, timestep_range=timestep_range
-                )
-                second_network = uh.get_data(
-                    area=area,
-                    season=season,
-                    time=time,
-                    demand=demand,
-                    optimization=traffic_priority,
-                    situation=situation,
-                    variable="Noise2",
-                )
-                second_network = uh.new_timeline(
-                    network=second_network, timestep_range=timestep_range
-                )
-                # network, current_location = uh.spatial_scope(
-                #     spatial_click_data, network
-                # )
-                # helper_network = (
-                #     second_network.groupby(["Timestep", "Edge"], observed=False)
-                #     .agg(
-                #         {
-                #             "Mobility flow": "sum",
-                #         }
-                #     )
-                #     .reset_index()
-                # )
-                # network = network.merge(
-                #     helper_network[["Edge", "Mobility flow", "Timestep"]],
-                #     on=["Edge", "Timestep"],
-                #     how="left",
-                # )
-                # print(network.head())
-                heatmap_network = (
-                    network.groupby(["Timestep", "Edge"], observed=False)
-                    .agg(
-                        {
-                            variable: "mean",
-                            "Longitude": "first",
-                            "Latitude": "first",
-                            "Name": "first",
-                            "Mobility flow": "sum",
-                        }
-                    )
-                    .reset_index()
-                )
-                heatmap_network.fillna(value={variable: 0})
-                # Draw the heatmap
-                heatmap = uh.create_heatmap(network=heatmap_network, variable=variable)
-                first_plot = html.Div(
-                    [
-                        dcc.Graph(
-                            figure=heatmap,
-                            responsive=True,
-                            style={
-                                "height": "50vw",
-                                "width": "55vw",
-                                "paddingBottom": "2vh",
-                            },
-                        ),
-                        lc.plots_location_text,
-                        lc.plots_reset_button,
-                    ]
-                )
-
-                # Calculate the data
-                barplot_network = (
-                    second_network.groupby(["Mobility mode"], observed=False)
-                    .agg({variable: "mean", "Vehicle": pd.Series.nunique})
-                    .reset_index()
-                )
-                # barplot_network["Vehicle average"] = np.round(
-                #     barplot_network[variable] / barplot_network["Mobility flow"], 4
-                # )
-                # Draw the bar plot
-                bar_plot = uh.create_mobility_mode_avg_bar_plot(
-                    network=barplot_network, variable=variable
-                )
-                # Output the plot
-                second_plot = dcc.Graph(
-                    figure=bar_plot,
-                    responsive=True,
-                    style={"height": "30vw"},
-                )
-
-                # Calculate the data
-                area_network = (
-                    second_network.groupby(
-                        ["Mobility mode", "Timestep"], observed=False
-                    )
-                    .agg({"Vehicle": pd.Series.nunique, variable: "mean"})
-                    .reset_index()
-                )
-
-                # Draw the area chart
-                area_plot = uh.create_area_chart(
-                    network=area_network, variable=variable
-                )
-                # area_plot.update_layout(
-                #     labels={"Vehicle": "Mobility flow"},
-                # )
-                third_plot = dcc.Graph(
-                    figure=area_plot,
-                    responsive=True,
-                    style={
-                        "height": "30vw",
-                        "paddingBottom": "2vh",
-                        "paddingTop": "2vh",
-                    },
-                )
-
-            # Noise
-            # Heatmap + bar plot + area chart
-            elif tab == lc.OBJECTIVES[1] and variable == "Speed":
-                # Calculate the data
-                network = uh.get_data(
-                    area=area,
-                    season=season,
-                    time=time,
-                    demand=demand,
-                    optimization=traffic_priority,
-                    situation=situation,
-                    variable=variable,
-                )
-                network = uh.new_timeline(
-                    network=network, timestep_range=timestep_range
-                )
-                # network, current_location = uh.spatial_scope(
-                #     spatial_click_data, network
-                # )
-                heatmap_network = (
-                    network.groupby(["Timestep", "Edge"], observed=False)
-                    .agg(
-                        {
-                            variable: "mean",
-                            "Longitude": "first",
-                            "Latitude": "first",
-                            "Name": "first",
-                            "Mobility flow": timeline_type,
-                        }
-                    )
-                    .reset_index()
-                )
-                # Draw the heatmap
-                heatmap = uh.create_heatmap(network=heatmap_network, variable=variable)
-                first_plot = html.Div(
-                    [
-                        dcc.Graph(
-                            figure=heatmap,
-                            responsive=True,
-                            style={
-                                "height": "50vw",
-                                "width": "55vw",
-                                "paddingBottom": "2vh",
-                            },
-                        ),
-                        lc.plots_location_text,
-                        lc.plots_reset_button,
-                    ]
-                )
-
-                # Calculate the data
-                barplot_network = (
-                    network.groupby(["Mobility mode"], observed=False)
-                    .agg({variable: "mean", "Vehicle": lambda x: x.nunique()})
-                    .reset_index()
-                )
-                # barplot_network["Vehicle average"] = np.round(
-                #     barplot_network[variable] / barplot_network["Mobility flow"], 4
-                # )
-                # Draw the bar plot
-                bar_plot = uh.create_mobility_mode_avg_bar_plot(
-                    network=barplot_network, variable=variable
-                )
-                # Output the plot
-                second_plot = dcc.Graph(
-                    figure=bar_plot,
-                    responsive=True,
-                    style={"height": "30vw"},
-                )
-
-                # Calculate the data
-                # area_network = (
-                #     network.groupby(["Timestep"], observed=False)
-                #     .agg(
-                #         {
-                #             variable: timeline_type,
-                #             "Mobility flow": timeline_type,
-                #             "Mobility mode": "first",
-                #         }
-                #     )
-                #     .reset_index()
-                # )
-                # # Draw the area chart
-                # area_plot = uh.create_area_chart(
-                #     network=area_network, variable=variable
-                # )
-                # Calculate data
-                # if timeline_type == "mean":
-                #     # area_network = (
-                #     #     network.groupby(
-                #     #         ["Mobility mode", "Simulation timestep", "Timestep"],
-                #     #         observed=False,
-                #     #     )
-                #     #     .agg({"Vehicle": pd.Series.nunique, variable: "median"})
-                #     #     .reset_index()
-                #     # )
-                #     area_network = (
-                #         network.groupby(
-                #             ["Mobility mode", "Timestep"], observed=False
-                #         )
-                #         .agg({"Vehicle": pd.Series.nunique, variable: "mean"})
-                #         .reset_index()
-                #     )
-                # elif timeline_type == "sum":
-                area_network = (
-                    network.groupby(["Mobility mode", "Timestep"], observed=False)
-                    .agg({"Vehicle": lambda x: x.nunique(), variable: "mean"})
-                    .reset_index()
-                )
-
-                # Draw the area chart
-                area_plot = uh.create_area_chart(
-                    network=area_network, variable=variable
-                )
-                # area_plot.update_layout(
-                #     labels={"Vehicle": "Mobility flow"},
-                # )
-                third_plot = dcc.Graph(
-                    figure=area_plot,
-                    responsive=True,
-                    style={
-                        "height": "30vw",
-                        "paddingBottom": "2vh",
-                        "paddingTop": "2vh",
-                    },
-                )
-            # AQ variables
-            elif tab == lc.OBJECTIVES[2]:
-                # Calculate the data
-                network = uh.get_data(
-                    area=area,
-                    season=season,
-                    time=time,
-                    demand=demand,
-                    optimization=traffic_priority,
-                    situation=situation,
-                    variable=variable,
-                )
-                network = uh.new_timeline(
-                    network=network, timestep_range=timestep_range
-                )
-                # network, current_location = uh.spatial_scope(
-                #     spatial_click_data, network
-                # )
-                heatmap_network = (
-                    network.groupby(["Timestep", "Edge"], observed=False)
-                    .agg(
-                        {
-                            variable: timeline_type,
-                            "Longitude": "first",
-                            "Latitude": "first",
-                            "Name": "first",
-                            "Mobility flow": timeline_type,
-                        }
-                    )
-                    .reset_index()
-                )
-                # Draw the heatmap
-                heatmap = uh.create_heatmap(network=heatmap_network, variable=variable)
-                first_plot = html.Div(
-                    [
-                        dcc.Graph(
-                            figure=heatmap,
-                            responsive=True,
-                            style={
-                                "height": "50vw",
-                                "width": "55vw",
-                                "paddingBottom": "2vh",
-                            },
-                        ),
-                        lc.plots_location_text,
-                        lc.plots_reset_button,
-                    ]
-                )
-
-                # Calculate the data
-                barplot_network = (
-                    network.groupby(["Mobility mode"], observed=False)
-                    .agg({variable: "sum", "Mobility flow": "sum"})
-                    .reset_index()
-                )
-                barplot_network["Vehicle average"] = np.round(
-                    barplot_network[variable] / barplot_network["Mobility flow"], 4
-                )
-                # Draw the bar plot
-                bar_plot = uh.create_mobility_mode_avg_bar_plot(
-                    network=barplot_network, variable=variable
-                )
-                # Output the plot
-                second_plot = dcc.Graph(
-                    figure=bar_plot,
-                    responsive=True,
-                    style={"height": "30vw"},
-                )
-
-                # Calculate data
-                if timeline_type == "mean":
-                    area_network = (
-                        network.groupby(
-                            ["Mobility mode", "Simulation timestep", "Timestep"],
-                            observed=False,
-                        )
-                        .agg(
-                            {"Vehicle": lambda x: x.nunique(), variable: timeline_type}
-                        )
-                        .reset_index()
-                    )
-                    area_network = (
-                        area_network.groupby(
-                            ["Mobility mode", "Timestep"], observed=False
-                        )
-                        .agg({"Vehicle": timeline_type, variable: timeline_type})
-                        .reset_index()
-                    )
-                elif timeline_type == "sum":
-                    area_network = (
-                        network.groupby(["Mobility mode", "Timestep"], observed=False)
-                        .agg(
-                            {"Vehicle": lambda x: x.nunique(), variable: timeline_type}
-                        )
-                        .reset_index()
-                    )
-
-                # Draw the area chart
-                area_plot = uh.create_area_chart(network=area_network, variable="Vehicle")
-                # Output the plot
-                third_plot = dcc.Graph(
-                    figure=area_plot,
-                    responsive=True,
-                    style={
-                        "height": "30vw",
-                        "paddingBottom": "2vh",
-                        "paddingTop": "2vh",
-                    },
-                )
-
-        # Return the figures, styles and location
-        return [
-            first_plot,
-            second_plot,
-            third_plot,
-            fourth_plot,
-            # current_location,
-            summary_text,
-        ]
+    @app.callback(
+        Output("heatmap-frame-slider", "value"),
+        Input("heatmap-player", "n_intervals"),
+        [
+            State("heatmap-frame-slider", "value"),
+            State("heatmap-frames", "data"),
+        ],
+        prevent_initial_call=True,
+    )
+    def advance_heatmap_frame(n, index, state):
+        if state is None or not state["timesteps"]:
+            raise PreventUpdate
+        return (index + 1) % len(state["timesteps"])
 
     # @app.callback(
     #     Output("figure-one", "clickData"),
@@ -11,6 +11,7 @@ from utils.constants import (
     SITUATIONS,
     TRAFFIC_VARIABLES,
     TIMESTEPS,
+    HEATMAP_FRAME_INTERVAL_MS,
 )
 
 basic_style = {"paddingTop": "2vh", "paddingBottom": "2vh"}
@@ -92,6 +93,77 @@ plots_reset_button = dbc.Button(
 )
 
 
+heatmap_style = {
+    "height": "50vw",
+    "width": "55vw",
+    "paddingBottom": "2vh",
+}
+
+
+def lazy_heatmap(figure, state):
+    """
+    Shows the first frame of a lazily delivered heatmap with its own slider and
+    play button, which fetch the other frames from the server when shown.
+
+    Args:
+        figure (dict): The first frame, from create_lazy_heatmap.
+        state (dict): The heatmap state, from create_lazy_heatmap.
+    """
+    timesteps = state["timesteps"]
+    # Label at most about a dozen frames so the marks stay readable
+    step = max(1, -(-len(timesteps) // 12))
+    return html.Div(
+        [
+            dcc.Graph(
+                figure=figure,
+                id="heatmap-graph",
+                responsive=True,
+                style=heatmap_style,
+            ),
+            html.Div(
+                f"Time (in minutes): {timesteps[0] if timesteps else ''}",
+                id="heatmap-frame-label",
+                style={"fontSize": "1.2em"},
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.Button(
+                            html.I(className="bi bi-play-fill"),
+                            id="heatmap-play-button",
+                            n_clicks=0,
+                            color="secondary",
+                        ),
+                        width="auto",
+                    ),
+                    dbc.Col(
+                        dcc.Slider(
+                            min=0,
+                            max=max(len(timesteps) - 1, 0),
+                            step=1,
+                            value=0,
+                            marks={
+                                i: label
+                                for i, label in enumerate(timesteps)
+                                if i % step == 0
+                            },
+                            id="heatmap-frame-slider",
+                        ),
+                    ),
+                ],
+                align="center",
+                style={"width": "55vw", "paddingBottom": "2vh"},
+            ),
+            dcc.Interval(
+                id="heatmap-player",
+                interval=HEATMAP_FRAME_INTERVAL_MS,
+                disabled=True,
+            ),
+            dcc.Store(id="heatmap-frames", data=state),
+        ]
+    )
+
+
 project_heading_col = dbc.Col(
     html.Div(
         [
@@ -0,0 +1,170 @@
+# %%
+# Imports
+import os
+import gc
+import sys
+import signal
+import socket
+import argparse
+import waitress
+import numpy as np
+import utils.constants as uc
+import utils.helpers as uh
+import utils.raster as uraster
+import layout.callbacks as cb
+from new_app import app
+
+
+def warm_up(scenarios=uc.SERVER_PRELOAD):
+    """
+    Prepares the server process before it accepts requests.
+
+    The datasets of the scenarios are loaded into the dataset cache, the
+    raster renderer is compiled if the heatmaps use it, and the first view of
+    every tab is drawn into the figure cache.
+
+    Args:
+        scenarios (list): The scenarios to load, as get_data arguments without
+                          the situation.
+    """
+    for scenario in scenarios:
+        for situation in ["baseline", "optimized"]:
+            loaded = uh.preload_scenario(**scenario, situation=situation)
+            print(f"Loaded {situation} {', '.join(loaded) or 'nothing'}")
+    if uc.HEATMAP_RENDERING == "raster":
+        # datashader compiles its kernels on the first render
+        uraster.render_frame(
+            np.zeros(1),
+            np.zeros(1),
+            np.ones(1),
+            (-1, 1),
+            (-1, 1),
+            (0, 1),
+            8,
+            8,
+            1,
+        )
+    views = [
+        (uc.OBJECTIVES[0], "Mobility flow"),
+        (uc.OBJECTIVES[1], "Mobility flow"),
+        (uc.OBJECTIVES[2], uc.AQ_VARIABLES[0]["value"]),
+    ]
+    for scenario in scenarios[:1]:
+        for tab, variable in views:
+            for position in range(len(cb.GRAPH_OUTPUTS)):
+                try:
+                    cb.show_figure(
+                        position,
+                        tab,
+                        scenario["season"],
+                        scenario["time"],
+                        scenario["area"],
+                        scenario["demand"],
+                        scenario["optimization"],
+                        "baseline",
+                        variable,
+                        uc.TIMELINE_FUNCTIONS[1]["value"],
+                        uc.TIMESTEPS[1]["value"],
+                    )
+                except FileNotFoundError as error:
+                    print(f"Skipped warming up the {tab} tab: {error}")
+                    break
+
+
+def _serve_worker(listener, threads):
+    """Serves requests from the shared socket until the process is stopped."""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        waitress.serve(app.server, sockets=[listener], threads=threads)
+    finally:
+        os._exit(0)
+
+
+def serve(
+    host=uc.SERVER_HOST,
+    port=uc.SERVER_PORT,
+    workers=uc.SERVER_WORKERS,
+    threads=uc.SERVER_THREADS,
+    warm=True,
+):
+    """
+    Runs the app in several server processes that share preloaded datasets.
+
+    The datasets are loaded and the app warmed up once, before the socket
+    starts listening, and the server processes are forked from this process
+    afterwards, so they share the loaded datasets copy-on-write. A process
+    that exits is replaced. Without os.fork, eg. on Windows, the app is served
+    by this process alone.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        workers (int): The number of server processes, None for one per core.
+        threads (int): The number of requests every process handles at once.
+        warm (bool): Whether to load the datasets and draw the first views
+                     before accepting requests.
+    """
+    if warm:
+        warm_up()
+    listener = socket.create_server((host, port), backlog=1024)
+    workers = workers or os.cpu_count()
+    print(f"Serving on http://{host}:{port} with {workers} x {threads} threads")
+    if workers == 1 or not hasattr(os, "fork"):
+        waitress.serve(app.server, sockets=[listener], threads=threads)
+        return
+    # Objects created so far are never freed, so the garbage collector does not
+    # touch, and copy, their memory pages in the server processes
+    gc.freeze()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _serve_worker(listener, threads)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Server process {pid} exited with status {status}, restarting")
+            spawn()
+    listener.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app in production.")
+    parser.add_argument("--host", default=uc.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=uc.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=uc.SERVER_WORKERS)
+    parser.add_argument("--threads", type=int, default=uc.SERVER_THREADS)
+    parser.add_argument("--no-warm-up", dest="warm", action="store_false")
+    args = parser.parse_args()
+    serve(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        threads=args.threads,
+        warm=args.warm,
+    )
+    sys.exit(0)
@@ -0,0 +1,895 @@
+import gzip
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+import plotly.utils
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import utils.constants as uc
+import utils.helpers as uh
+import utils.store as us
+import utils.cache as ucache
+
+EMISSIONS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<emission-export>
+    <timestep time="0.00">
+        <vehicle id="test_trip_0" eclass="HBEFA4/PC_petrol_ltECE" CO2="2624.72" CO="164.78" HC="0.81" NOx="1.20" PMx="0.07" fuel="0.84" electricity="0.00" noise="60.22" route="!test_trip_0" type="fuel" waiting="0.00" lane="e1_0" pos="5.10" speed="0.00" angle="90.00" x="1.00" y="2.00"/>
+    </timestep>
+    <timestep time="1.00">
+        <vehicle id="test_trip_0" eclass="HBEFA4/PC_petrol_ltECE" CO2="3624.72" CO="164.78" HC="0.81" NOx="1.20" PMx="0.09" fuel="0.84" electricity="0.00" noise="61.22" route="!test_trip_0" type="fuel" waiting="0.00" lane="e1_0" pos="6.10" speed="1.50" angle="90.00" x="1.00" y="2.00"/>
+        <vehicle id="test_trip_1" eclass="HBEFA4/PC_BEV" CO2="0.00" CO="0.00" HC="0.00" NOx="0.00" PMx="0.00" fuel="0.00" electricity="0.50" noise="55.00" route="!test_trip_1" type="electric" waiting="0.00" lane="e2_0" pos="1.10" speed="2.50" angle="90.00" x="1.00" y="2.00"/>
+    </timestep>
+    <timestep time="2.00">
+        <vehicle id="test_trip_1" eclass="HBEFA4/PC_BEV" CO2="0.00" CO="0.00" HC="0.00" NOx="0.00" PMx="0.00" fuel="0.00" electricity="0.60" noise="56.00" route="!test_trip_1" type="electric" waiting="0.00" lane="e2_0" pos="3.10" speed="3.50" angle="90.00" x="1.00" y="2.00"/>
+    </timestep>
+</emission-export>
+"""
+
+TRIPS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<tripinfos>
+    <tripinfo id="test_trip_0" depart="0.00" duration="45.00" timeLoss="9.78" vType="fuel">
+        <emissions CO_abs="5710.40" CO2_abs="102439.18" HC_abs="1286.20" PMx_abs="8.65" NOx_abs="820.43" fuel_abs="0.00" electricity_abs="0.00"/>
+    </tripinfo>
+    <tripinfo id="test_trip_1" depart="1.00" duration="48.00" timeLoss="10.15" vType="electric">
+        <emissions CO_abs="0.00" CO2_abs="0.00" HC_abs="0.00" PMx_abs="0.00" NOx_abs="0.00" fuel_abs="0.00" electricity_abs="12.00"/>
+    </tripinfo>
+</tripinfos>
+"""
+
+EDGE_NOISE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<meandata>
+    <interval begin="0.00" end="1.00" id="edge-noise">
+        <edge id="e1" noise="60.22"/>
+        <edge id="e2" noise="55.00"/>
+    </interval>
+    <interval begin="1.00" end="2.00" id="edge-noise">
+        <edge id="e1" noise="61.22"/>
+    </interval>
+</meandata>
+"""
+
+
+@pytest.fixture
+def net_df():
+    return pd.DataFrame(
+        {
+            "Edge": ["e1", "e2"],
+            "Name": ["Mannerheimintie", "Unnamed road"],
+            "Longitude": [24.93, 24.94],
+            "Latitude": [60.16, 60.17],
+            "Lane": ["e1_0", "e2_0"],
+        }
+    )
+
+
+def _write(path, content, compress=False):
+    if compress:
+        with gzip.open(path, "wt") as f:
+            f.write(content)
+    else:
+        path.write_text(content)
+    return str(path)
+
+
+@pytest.fixture
+def ingest_scenario(tmp_path, net_df, monkeypatch):
+    """Ingests outputs as the Kamppi baseline and runs the test in tmp_path."""
+
+    def ingest(outputs):
+        monkeypatch.setattr(uh, "_parse_net_xml", lambda net_path: net_df)
+        folder = tmp_path / us.scenario_folder(area="kamppi", season="autumn")
+        folder.mkdir(parents=True)
+        for filename, content in outputs.items():
+            _write(folder / filename, content)
+        uh.aggregate_outputs(net_path=None, full_output_folder=str(folder))
+        monkeypatch.chdir(tmp_path)
+        return str(folder)
+
+    return ingest
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_002_emissions_batches(tmp_path, net_df, batch_size):
+    file_path = _write(tmp_path / "emission_results.xml", EMISSIONS_XML)
+    batches = list(uh._iter_emissions_xml(file_path, net_df, batch_size=batch_size))
+    assert all(len(batch) <= batch_size for batch in batches)
+    emissions = uh._parse_emissions_xml(file_path, net_df, batch_size=batch_size)
+    assert len(emissions) == 4
+    assert list(emissions["Simulation timestep"]) == [0.0, 1.0, 1.0, 2.0]
+    assert list(emissions["Vehicle"]) == [
+        "test_trip_0",
+        "test_trip_0",
+        "test_trip_1",
+        "test_trip_1",
+    ]
+    assert list(emissions["Edge"]) == ["e1", "e1", "e2", "e2"]
+    assert emissions["Speed"].sum() == pytest.approx(7.5)
+
+
+def test_003_trips_and_noise_from_gzip(tmp_path, net_df):
+    trips = uh._parse_trip_output_xml(
+        _write(tmp_path / "trip_results.xml.gz", TRIPS_XML, compress=True),
+        batch_size=1,
+    )
+    assert list(trips["Trip"]) == ["test_trip_0", "test_trip_1"]
+    assert list(trips["Travel time"]) == [45.0, 48.0]
+    assert trips["Carbon dioxide"].iloc[0] == pytest.approx(102439.18)
+
+    noise = uh._parse_edge_noise_xml(
+        _write(tmp_path / "edge_noise_results.xml", EDGE_NOISE_XML), net_df
+    )
+    assert list(noise["Simulation timestep"]) == [1.0, 1.0, 2.0]
+    assert list(noise["Name"]) == ["Mannerheimintie", "Unnamed road", "Mannerheimintie"]
+
+
+@pytest.mark.parametrize("dataset_format", ["parquet", "csv"])
+def test_004_aggregate_outputs(tmp_path, net_df, monkeypatch, dataset_format):
+    monkeypatch.setattr(uh, "_parse_net_xml", lambda net_path: net_df)
+    monkeypatch.setattr(uh.uc, "DATASET_FORMAT", dataset_format)
+    _write(tmp_path / "emission_results.xml", EMISSIONS_XML)
+    _write(tmp_path / "trip_results.xml", TRIPS_XML)
+    _write(tmp_path / "edge_noise_results.xml", EDGE_NOISE_XML)
+    uh.aggregate_outputs(net_path=None, full_output_folder=str(tmp_path), batch_size=3)
+    assert not list(tmp_path.glob("*.xml"))
+    emissions = us.read_dataset(us.dataset_path(tmp_path, "emission_results"))
+    assert emissions["Mobility flow"].sum() == 4
+    assert list(emissions["Mobility mode"].cat.categories) == ["electric", "fuel"]
+    trips = us.read_dataset(us.dataset_path(tmp_path, "trip_results"))
+    assert len(trips) == 2
+    noise = us.read_dataset(
+        us.dataset_path(tmp_path, "edge_noise_results"), columns=["Noise", "Edge"]
+    )
+    assert list(noise.columns) == ["Noise", "Edge"]
+    assert len(noise) == 3
+
+
+def test_005_columnar_batch():
+    batch = uh._ColumnarBatch(
+        {"Vehicle": ("id", str), "Speed": ("speed", float), "Count": ("n", int)},
+        extra_columns={"Simulation timestep": float},
+        constants={"Mobility flow": 1},
+    )
+    batch.append(ET.fromstring('<vehicle id="a" speed="1.5" n="2"/>'), 0.0)
+    batch.append(ET.fromstring('<vehicle id="b" speed="oops"/>'), 1.0)
+    batch.append(None, 2.0)
+    first = uh._flush(batch)
+    assert len(batch) == 0
+    assert list(first["Vehicle"].cat.codes) == [0, 1, -1]
+    assert first["Speed"].isna().tolist() == [False, True, True]
+    assert list(first["Mobility flow"]) == [1, 1, 1]
+
+    # Codes are shared by the following batches
+    batch.append(ET.fromstring('<vehicle id="b" speed="2" n="3"/>'), 3.0)
+    batch.append(ET.fromstring('<vehicle id="c" speed="3" n="4"/>'), 3.0)
+    record_batch = batch.to_record_batch()
+    assert record_batch.column(0).indices.to_pylist() == [1, 2]
+    second = uh._flush(batch)
+    assert second["Count"].dtype == "int64"
+    combined = uh._concat_batches([first, second])
+    assert combined["Vehicle"].dtype == "category"
+    assert combined["Vehicle"].tolist()[3:] == ["b", "c"]
+
+
+def test_006_get_data_and_migration(net_df, monkeypatch, ingest_scenario):
+    net_df.loc[len(net_df)] = ["e3", "Fredrikinkatu", 24.95, 60.18, "e3_0"]
+    monkeypatch.setattr(uh.uc, "DATASET_FORMAT", "csv")
+    # A vehicle passes e3 before its noise is measured
+    e3_vehicle = (
+        EMISSIONS_XML.split("\n")[3]
+        .replace("test_trip_0", "test_trip_2")
+        .replace("e1_0", "e3_0")
+    )
+    ingest_scenario(
+        {
+            "emission_results.xml": EMISSIONS_XML.replace(
+                "</timestep>", e3_vehicle + "\n    </timestep>", 1
+            ),
+            "edge_noise_results.xml": EDGE_NOISE_XML.replace(
+                '<edge id="e1" noise="61.22"/>',
+                '<edge id="e1" noise="61.22"/>\n        <edge id="e3" noise="40.00"/>',
+            ),
+        }
+    )
+
+    kwargs = dict(area="Kamppi", demand="regular", season="autumn", time="Weekday")
+    from_csv = uh.get_data(variable="Speed", **kwargs)
+    assert list(from_csv.columns) == uh.uc.FROM_VAR_TO_DATA_COLS["Speed"][1]
+    written = us.migrate_scenarios(root="simulation/scenarios")
+    assert len(written) == 3
+    assert us.migrate_scenarios(root="simulation/scenarios") == []
+    from_parquet = uh.get_data(variable="Speed", **kwargs)
+    pd.testing.assert_frame_equal(
+        from_csv, from_parquet, check_dtype=False, check_categorical=False
+    )
+    noise = uh.get_data(variable="Noise", **kwargs)
+    assert list(noise["Mobility flow"]) == [1, 1]
+    # e3 has no vehicles when its noise is measured, so it is merged away
+    assert list(noise["Edge"].cat.categories) == ["e1", "e2"]
+
+
+def test_007_dataset_cache(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"dataset_{i}.csv"
+        pd.DataFrame({"Speed": [float(i)] * 100}).to_csv(path)
+        paths.append(str(path))
+    entry_bytes = ucache._nbytes(us.read_dataset(paths[0]))
+    cache = ucache.DatasetCache(max_bytes=2 * entry_bytes)
+
+    cache.get("a", paths[0], us.read_dataset)
+    cache.get("a", paths[0], us.read_dataset)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    # The least recently used entry is evicted by size
+    cache.get("b", paths[1], us.read_dataset)
+    cache.get("a", paths[0], us.read_dataset)
+    cache.get("c", paths[2], us.read_dataset)
+    assert len(cache) == 2
+    cache.get("b", paths[1], us.read_dataset)
+    assert cache.stats()["misses"] == 4
+
+    # Changed files are reloaded
+    os.utime(paths[2], (0, 0))
+    assert cache.get("c", paths[2], us.read_dataset)["Speed"].iloc[0] == 2.0
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 5,
+        "entries": 2,
+        "bytes": 2 * entry_bytes,
+        "max_bytes": 2 * entry_bytes,
+    }
+
+
+@pytest.fixture
+def emissions():
+    rng = np.random.default_rng(0)
+    rows = 5000
+    edges = np.array(["e1", "e2", "e3"])
+    edge_codes = rng.integers(0, 3, rows)
+    return pd.DataFrame(
+        {
+            "Vehicle": [f"test_trip_{i}" for i in rng.integers(0, 400, rows)],
+            "Mobility mode": pd.Categorical(
+                rng.choice(["fuel", "electric"], rows), ordered=True
+            ),
+            "Simulation timestep": rng.integers(0, 3600, rows).astype(float),
+            "Edge": edges[edge_codes],
+            "Name": np.array(["Mannerheimintie", "Unnamed road", "Fredrikinkatu"])[
+                edge_codes
+            ],
+            "Longitude": np.array([24.93, 24.94, 24.95])[edge_codes],
+            "Latitude": np.array([60.16, 60.17, 60.18])[edge_codes],
+            "Speed": rng.uniform(0, 15, rows),
+            "Carbon dioxide": rng.uniform(0, 5000, rows),
+            "Mobility flow": np.ones(rows, dtype=int),
+        }
+    )
+
+
+@pytest.mark.parametrize("timestep_range", [1, 15, 60])
+@pytest.mark.parametrize("how", ["sum", "mean"])
+def test_008_rollup_cube(emissions, timestep_range, how):
+    # Rows on internal junction lanes have no edge
+    emissions.loc[::11, ["Edge", "Name", "Longitude", "Latitude"]] = np.nan
+    parts = [uh._cube_part(emissions.iloc[:2000]), uh._cube_part(emissions.iloc[2000:])]
+    cube = uh._merge_cube_parts(parts)
+    assert cube["Rows"].sum() == len(emissions)
+    assert cube["Carbon dioxide"].sum() == pytest.approx(
+        emissions["Carbon dioxide"].sum()
+    )
+
+    aggregations = {"Carbon dioxide": how, "Speed": "mean", "Mobility flow": how}
+    rolled = uh.rollup_cube(cube, timestep_range, aggregations)
+    network = uh.new_timeline(emissions.copy(), timestep_range)
+    expected = (
+        network.groupby(["Timestep", "Edge"], observed=False)
+        .agg({**aggregations, "Longitude": "first", "Name": "first"})
+        .reset_index()
+    )
+    pd.testing.assert_frame_equal(
+        rolled[expected.columns], expected, check_dtype=False
+    )
+
+
+@pytest.mark.parametrize(
+    "by",
+    [
+        ["Mobility mode"],
+        ["Mobility mode", "Timestep"],
+        ["Mobility mode", "Simulation timestep", "Timestep"],
+    ],
+)
+def test_009_aggregate_groups_nunique(emissions, by):
+    network = uh.new_timeline(emissions.copy(), 15)
+    network.loc[::7, "Vehicle"] = np.nan
+    aggregations = {"Vehicle": "nunique", "Speed": "mean"}
+    grouped = uh.aggregate_groups(network, by, aggregations).reset_index()
+    expected = (
+        network.groupby(by, observed=False)
+        .agg({"Vehicle": lambda x: x.nunique(), "Speed": "mean"})
+        .reset_index()
+    )
+    pd.testing.assert_frame_equal(grouped, expected, check_dtype=False)
+
+
+def test_010_shared_dictionaries(tmp_path, net_df, monkeypatch):
+    monkeypatch.setattr(uh, "_parse_net_xml", lambda net_path: net_df)
+    monkeypatch.setattr(uh.uc, "DATASET_FORMAT", "parquet")
+    _write(tmp_path / "emission_results.xml", EMISSIONS_XML)
+    _write(tmp_path / "trip_results.xml", TRIPS_XML)
+    uh.aggregate_outputs(net_path=None, full_output_folder=str(tmp_path), batch_size=2)
+
+    dictionaries = us.read_dictionaries(tmp_path)
+    assert list(dictionaries["Vehicle"]) == ["test_trip_0", "test_trip_1"]
+    # Vehicles and trips are stored as codes of the same dictionary
+    vehicle_codes = pq.read_table(tmp_path / "emission_results.parquet")["Vehicle"]
+    trip_codes = pq.read_table(tmp_path / "trip_results.parquet")["Trip"]
+    assert vehicle_codes.type == trip_codes.type == pa.int32()
+    assert vehicle_codes.to_pylist() == [0, 0, 1, 1]
+    assert trip_codes.to_pylist() == [0, 1]
+
+    trips = us.read_dataset(tmp_path / "trip_results.parquet")
+    assert list(trips["Trip"]) == ["test_trip_0", "test_trip_1"]
+    emissions = us.read_dataset(
+        tmp_path / "emission_results.parquet", columns=["Edge", "Name"]
+    )
+    assert list(emissions["Name"].cat.categories) == [
+        "Mannerheimintie",
+        "Unnamed road",
+    ]
+
+
+def test_011_join_net(net_df):
+    batch = pd.DataFrame(
+        {"Lane": pd.Categorical(["e2_0", "x_0", "e1_0", None]), "Noise": range(4)}
+    )
+    for net in [net_df, net_df.astype({"Edge": "category", "Name": "category"})]:
+        joined = uh._join_net(batch, net, "Lane")
+        expected = batch.merge(net, on="Lane", how="left")
+        pd.testing.assert_frame_equal(
+            joined, expected, check_dtype=False, check_categorical=False
+        )
+
+
+def test_012_split_emissions_xml(tmp_path, net_df):
+    file_path = _write(tmp_path / "emission_results.xml", EMISSIONS_XML)
+    byte_ranges = uh._split_xml(file_path, "timestep", 10, min_bytes=1)
+    assert len(byte_ranges) == 3
+    parts = [
+        uh._concat_batches(
+            uh._iter_emissions_xml(file_path, net_df, byte_range=byte_range)
+        )
+        for byte_range in byte_ranges
+    ]
+    assert [len(part) for part in parts] == [1, 2, 1]
+    pd.testing.assert_frame_equal(
+        uh._concat_batches(parts),
+        uh._parse_emissions_xml(file_path, net_df),
+        check_categorical=False,
+    )
+    assert uh._split_xml(file_path, "timestep", 3) == [None]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_013_parallel_aggregate_outputs(tmp_path, net_df, monkeypatch, workers):
+    monkeypatch.setattr(uh, "_parse_net_xml", lambda net_path: net_df)
+    monkeypatch.setattr(uh.uc, "DATASET_FORMAT", "parquet")
+    monkeypatch.setattr(uh.uc, "XML_SPLIT_MIN_BYTES", 1)
+    _write(tmp_path / "emission_results.xml", EMISSIONS_XML)
+    _write(tmp_path / "edge_noise_results.xml", EDGE_NOISE_XML)
+    uh.aggregate_outputs(
+        net_path=None, full_output_folder=str(tmp_path), workers=workers
+    )
+    assert not list(tmp_path.glob("*.xml")) and not list(tmp_path.glob("*.part*"))
+    emissions = us.read_dataset(tmp_path / "emission_results.parquet")
+    assert list(emissions["Vehicle"]) == [
+        "test_trip_0",
+        "test_trip_0",
+        "test_trip_1",
+        "test_trip_1",
+    ]
+    assert list(emissions["Simulation timestep"]) == [0.0, 1.0, 1.0, 2.0]
+    cube = us.read_dataset(tmp_path / "emission_cube.parquet")
+    assert cube["Rows"].sum() == 4
+
+
+def test_014_scenario_sweep(tmp_path, monkeypatch):
+    import utils.sweep as usweep
+
+    def run_scenario(**kwargs):
+        if kwargs["demand"] == "low" and not (tmp_path / "fixed").exists():
+            raise RuntimeError("SUMO crashed")
+
+    monkeypatch.setattr(uh, "run_scenario", run_scenario)
+    scenarios_csv = tmp_path / "all_scenarios.csv"
+    scenarios_csv.write_text(
+        "Area,Demand,Season,Time,Situation,Optimization\n"
+        "Kamppi,Low,Autumn,Weekday,Baseline,\n"
+        "Kamppi,Regular,Autumn,Weekday,Optimized,Traffic1\n"
+    )
+    scenarios = usweep.read_scenarios(scenarios_csv)
+    assert scenarios[1]["optimization"] == 1
+    log_path = tmp_path / "sweep_log.csv"
+    kwargs = dict(scenarios=scenarios, workers=2, log_path=log_path, progress=None)
+
+    log = usweep.run_sweep(**kwargs)
+    assert sorted(log["Status"]) == ["done", "failed"]
+    # Resuming only reruns the failed scenario
+    (tmp_path / "fixed").touch()
+    log = usweep.run_sweep(**kwargs)
+    assert list(log["Demand"]) == ["low"] and list(log["Status"]) == ["done"]
+    assert usweep.run_sweep(**kwargs).empty
+
+
+class _FakeSimulation:
+    def __init__(self):
+        self.time = 0.0
+        self.simulation = self
+
+    def getDeltaT(self):
+        return 1.0
+
+    def getTime(self):
+        return self.time
+
+    def simulationStep(self, time=0.0):
+        self.time = max(time, self.time + 1.0)
+
+
+def test_015_step_simulation(monkeypatch):
+    import utils.backends as ub
+
+    stats = ub.step_simulation(_FakeSimulation(), end=3600, step_batch=60)
+    assert stats["calls"] == 60 and stats["steps"] == 3600
+
+    actions = []
+
+    def controller(connection):
+        actions.append(connection.getTime())
+        return connection.getTime() + 90 if len(actions) < 3 else None
+
+    stats = ub.step_simulation(
+        _FakeSimulation(), end=600, step_batch=60, controller=controller
+    )
+    assert actions == [0.0, 90.0, 180.0]
+    assert stats["simulated_seconds"] == 600
+
+    monkeypatch.setitem(sys.modules, "libsumo", None)
+    assert ub._import_backend("libsumo")[1] == "traci"
+
+
+def test_016_sample_od_pairs():
+    import scipy.sparse as sp
+    import utils.network as un
+
+    # 0 <-> 1 <-> 2 form a loop, 3 only leads into it and 4 is a dead end
+    rows, cols = [0, 1, 1, 2, 3, 2], [1, 0, 2, 1, 0, 4]
+    adjacency = sp.csr_matrix((np.ones(6), (rows, cols)), shape=(5, 5))
+    origins, destinations = un.sample_od_pairs(
+        adjacency, 1000, rng=np.random.RandomState(0)
+    )
+    assert set(origins) == {0, 1, 2} and set(destinations) == {0, 1, 2}
+
+
+def test_017_generate_trips(tmp_path):
+    import utils.demand as ud
+    import utils.network as un
+
+    net = un.load_network(
+        "simulation/scenarios/kamppi/baseline_net.xml", str(tmp_path / "cache")
+    )
+    weekday = ud.generate_trips(net, "regular", "summer", "weekday", seed=1)
+    assert weekday["Depart"].is_monotonic_increasing
+    assert weekday["Depart"].between(0, 3199).all()
+    assert abs(len(weekday) - 3000) < 50
+    assert round((weekday["Type"] == "electric").mean(), 2) == 0.2
+    low = ud.generate_trips(net, "low", "winter", "weekend", seed=1)
+    assert len(low) < len(weekday)
+    pd.testing.assert_frame_equal(
+        weekday, ud.generate_trips(net, "regular", "summer", "weekday", seed=1)
+    )
+    # The departures follow the hourly rates at any scale
+    rates = np.full(24, 3600 * 100.0)
+    departures = ud.departure_times(rates, np.random.RandomState(0), end=3600)
+    assert len(departures) == 360000
+    route_file = str(tmp_path / "rou.xml.gz")
+    ud.write_route_file(weekday, route_file, ['\t<vType id="fuel"/>\n'])
+    with gzip.open(route_file) as f:
+        trips = ET.parse(f).getroot().findall("trip")
+    assert len(trips) == len(weekday)
+    assert trips[0].get("from") == weekday["From"].iloc[0]
+
+
+def test_018_route_trips(tmp_path):
+    import sumolib
+    import utils.demand as ud
+    import utils.network as un
+    import utils.routing as ur
+
+    net_path = "simulation/scenarios/kamppi/baseline_net.xml"
+    network = un.load_network(net_path, str(tmp_path))
+    trips = ud.generate_trips(network, "low", "summer", "weekend", seed=2)
+    routed = ur.route_trips(network, trips, workers=1)
+    net = sumolib.net.readNet(net_path)
+    assert routed["Route"].notna().all()
+    for route, origin, destination in zip(routed["Route"], trips["From"], trips["To"]):
+        edges = route.split(" ")
+        assert edges[0] == origin and edges[-1] == destination
+        for edge, next_edge in zip(edges, edges[1:]):
+            assert net.getEdge(next_edge) in net.getEdge(edge).getOutgoing()
+    in_pool = ur.route_trips(network, trips, workers=2, origins_per_task=8)
+    pd.testing.assert_frame_equal(routed, in_pool)
+
+
+def test_019_load_network(tmp_path):
+    import sumolib
+    import utils.network as un
+
+    net_path = "simulation/scenarios/kamppi/baseline_net.xml"
+    network = un.load_network(net_path, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    # The second load maps the compiled arrays instead of parsing again
+    assert isinstance(un.load_network(net_path, str(tmp_path))["edge_lon"], np.memmap)
+    net = sumolib.net.readNet(net_path)
+    shape = net.getEdge(network["edge_id"][0]).getRawShape()
+    lon, lat = net.convertXY2LonLat(*shape[len(shape) // 2][:2])
+    assert np.isclose(network["edge_lon"][0], lon)
+    assert np.isclose(network["edge_lat"][0], lat)
+    net_df = uh._parse_net_xml(net_path)
+    assert set(net_df["Lane"]) == {
+        lane.getID() for edge in net.getEdges() for lane in edge.getLanes()
+    }
+
+
+def test_020_dimension_tables(tmp_path):
+    emissions = pd.DataFrame(
+        {
+            "Vehicle": pd.Categorical(["v1", "v2", "v1"]),
+            "Lane": pd.Categorical(["a_0", "b_0", "b_1"]),
+            "Mobility mode": pd.Categorical(["Electric car", "Car", "Electric car"]),
+            "Speed": [1.0, 2.0, 3.0],
+            "Edge": pd.Categorical(["a", "b", "b"]),
+            "Name": pd.Categorical(["Street", "Unnamed road", "Unnamed road"]),
+            "Longitude": [24.9, np.nan, np.nan],
+        }
+    )
+    dictionaries, dimensions = {}, {}
+    path = tmp_path / "emission_results.parquet"
+    us.write_parquet_batches([emissions], path, dictionaries, dimensions)
+    us.write_dictionaries(dictionaries, tmp_path)
+    us.write_dimensions(dimensions, tmp_path)
+    # Only the keys and measures stay in the rows
+    assert pq.read_schema(path).names == ["Vehicle", "Lane", "Speed"]
+    pd.testing.assert_frame_equal(
+        us.read_dataset(path).drop(columns="Mobility mode"),
+        emissions.drop(columns="Mobility mode"),
+    )
+    # Name is joined through Lane -> Edge -> Name
+    assert list(us.read_dataset(path, columns=["Speed", "Name"])["Name"]) == [
+        "Street",
+        "Unnamed road",
+        "Unnamed road",
+    ]
+    conflicting = emissions.assign(Name=pd.Categorical(["Other", "", ""]))
+    with pytest.raises(ValueError):
+        us.write_parquet_batches(
+            [conflicting], tmp_path / "other.parquet", dictionaries, dimensions
+        )
+
+
+def test_021_timestep_bins():
+    timesteps = np.array([0.0, 59.0, 60.0, 899.5, np.nan, 3599.0])
+    bins = uh.timestep_bins(timesteps, [1, 15])
+    codes, labels = bins[1]
+    assert codes.dtype == np.int32
+    assert list(codes) == [0, 0, 1, 14, -1, 59] and labels[-1] == 60
+    codes, labels = bins[15]
+    assert list(codes) == [0, 0, 0, 0, -1, 3] and list(labels) == [15, 30, 45, 60]
+    # Same buckets as the pd.cut based timeline
+    network = pd.DataFrame({"Simulation timestep": timesteps})
+    edges = np.arange(0, 3599, 15 * 60)
+    expected = pd.cut(
+        network["Simulation timestep"],
+        bins=np.append(edges, np.inf),
+        labels=edges // 60 + 15,
+        right=False,
+    )
+    timeline = uh.new_timeline(network, 15)
+    pd.testing.assert_series_equal(timeline["Timestep"], expected, check_names=False)
+    # Data of a single timestep is one bucket
+    codes, labels = uh.timestep_bins(np.array([600.0, 600.0]), [15])[15]
+    assert list(codes) == [0, 0] and list(labels) == [25]
+
+
+def test_022_raster_heatmap():
+    import struct
+    import base64
+    import utils.raster as uraster
+
+    network = pd.DataFrame(
+        {
+            "Timestep": pd.Categorical([1, 1, 2, 3], categories=[1, 2, 3]),
+            "Edge": ["a", "b", "a", "b"],
+            "Name": ["A", "B", "A", "B"],
+            "Longitude": [24.93, 24.94, 24.93, 24.94],
+            "Latitude": [60.16, 60.17, 60.16, 60.17],
+            "Mobility flow": [1.0, 2.0, 3.0, 0.0],
+        }
+    )
+    uraster.frame_cache.clear()
+    heatmap = uh.create_heatmap(network, "Mobility flow", rendering="raster")
+    assert [frame.name for frame in heatmap.frames] == ["1", "2", "3"]
+    source = heatmap.frames[0].layout.map.layers[0].source
+    image = base64.b64decode(source.split(",")[1])
+    # The image size comes from the settings, not from the number of rows
+    assert struct.unpack(">II", image[16:24]) == (
+        uc.HEATMAP_RASTER_WIDTH,
+        uc.HEATMAP_RASTER_HEIGHT,
+    )
+    uh.create_heatmap(network, "Mobility flow", rendering="raster")
+    assert uraster.frame_cache.hits == 3 and uraster.frame_cache.misses == 3
+
+
+def test_023_lazy_heatmap(tmp_path, monkeypatch):
+    import base64
+    import utils.frames as uf
+
+    def values(figure):
+        z = figure["data"][0]["z"]
+        return np.frombuffer(base64.b64decode(z["bdata"]), dtype=z["dtype"]).tolist()
+
+    monkeypatch.setattr(uf.register, "__kwdefaults__", {"folder": str(tmp_path)})
+    monkeypatch.setattr(uf.load, "__defaults__", (str(tmp_path),))
+    monkeypatch.setattr(uf.registered, "__defaults__", (str(tmp_path),))
+    network = pd.DataFrame(
+        {
+            "Timestep": pd.Categorical([1, 1, 2, 3], categories=[1, 2, 3]),
+            "Edge": ["a", "b", "a", "b"],
+            "Name": ["A", "B", "A", "B"],
+            "Longitude": [24.93, 24.94, 24.93, 24.94],
+            "Latitude": [60.16, 60.17, 60.16, 60.17],
+            "Mobility flow": [1.0, 2.0, 3.0, 0.0],
+        }
+    )
+    uf.frame_cache.clear()
+    figure, state = uh.create_lazy_heatmap(network, "Mobility flow")
+    assert state["timesteps"] == ["1", "2", "3"]
+    # Only the first frame is sent, without the animation frames
+    assert "frames" not in figure or not figure["frames"]
+    assert values(figure) == [1.0, 2.0]
+    # The second frame was rendered ahead while the first was shown
+    uf._prefetcher.submit(lambda: None).result()
+    hits = uf.frame_cache.hits
+    second = uh.heatmap_frame(state, 1)
+    assert uf.frame_cache.hits == hits + 1
+    assert values(second) == [3.0]
+    assert second["layout"]["coloraxis"]["cmax"] == figure["layout"]["coloraxis"]["cmax"]
+    # Frames can be drawn from the disk by another process
+    uf._networks.clear()
+    uf.frame_cache.clear()
+    assert values(uh.heatmap_frame(state, 2)) == [0.0]
+    assert uh.heatmap_frame(state, 3) is None
+    # A cached output whose rows have been removed is drawn again
+    import layout.callbacks as cb
+    import layout.components as lc
+
+    output = json.dumps(
+        lc.lazy_heatmap(figure, state), cls=plotly.utils.PlotlyJSONEncoder
+    )
+    assert cb._frames_registered(output)
+    os.remove(os.path.join(str(tmp_path), f"{state['key']}.parquet"))
+    assert not cb._frames_registered(output)
+    cache = ucache.FigureCache(folder=str(tmp_path / "figures"))
+    cache.get(("heatmap",), lambda: output)
+    drawn = []
+
+    def render():
+        drawn.append(uh.create_lazy_heatmap(network, "Mobility flow"))
+        return output
+
+    cache.get(("heatmap",), render, valid=cb._frames_registered)
+    assert len(drawn) == 1 and uf.registered(state["key"])
+    cache.get(("heatmap",), render, valid=cb._frames_registered)
+    assert len(drawn) == 1
+
+
+def test_024_figure_cache(tmp_path):
+    folder = str(tmp_path / "figures")
+    cache = ucache.FigureCache(folder=folder, max_bytes=20)
+    assert cache.get(("a",), lambda: '"first"') == '"first"'
+    # A new cache over the same folder, like a restarted server, reads it back
+    restarted = ucache.FigureCache(folder=folder, max_bytes=20)
+    assert restarted.get(("a",), lambda: '"drawn again"') == '"first"'
+    assert restarted.hits == 1 and restarted.misses == 0
+    os.utime(restarted._path(("a",)), (0, 0))
+    # The least recently read figure is removed once the folder is too big
+    restarted.get(("b",), lambda: '"second"')
+    restarted.get(("c",), lambda: '"third"')
+    assert not os.path.exists(restarted._path(("a",)))
+    assert os.path.exists(restarted._path(("c",)))
+    # Rewriting a dataset changes the data version of its scenario
+    scenario = tmp_path / "kamppi" / "regular_summer_weekday" / "baseline"
+    scenario.mkdir(parents=True)
+    (scenario / "trip_results.csv.gz").write_bytes(b"1")
+    version = us.folder_version(str(scenario))
+    assert us.folder_version(str(scenario)) == version
+    (scenario / "trip_results.csv.gz").write_bytes(b"22")
+    assert us.folder_version(str(scenario)) != version
+
+
+def test_025_shared_view_results():
+    import threading
+    import concurrent.futures
+
+    cache = ucache.ResultCache(max_entries=2)
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.wait(1)
+        return pd.DataFrame({"Vehicle": [1, 2]})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(cache.get, ("view",), compute) for _ in range(4)]
+        started.set()
+        results = [future.result() for future in futures]
+    # Computed once for all the callbacks asking at the same time
+    assert len(calls) == 1 and cache.misses == 1 and cache.hits == 3
+    # Every caller gets its own DataFrame over the same columns
+    results[0]["Situation"] = "Baseline"
+    assert "Situation" not in results[1]
+    assert "Situation" not in cache.get(("view",), compute)
+
+
+def test_026_kpi_sidecar(ingest_scenario):
+    # The last row is on an internal junction lane, which has no edge
+    internal_lane = EMISSIONS_XML.replace(
+        'PMx="0.00" fuel="0.00" electricity="0.60"',
+        'PMx="5.00" fuel="0.00" electricity="0.60"',
+    ).replace('lane="e2_0" pos="3.10"', 'lane=":j1_0_0" pos="3.10"')
+    folder = ingest_scenario(
+        {"emission_results.xml": internal_lane, "trip_results.xml": TRIPS_XML}
+    )
+
+    kwargs = dict(area="Kamppi", demand="regular", season="autumn", time="Weekday")
+    kpis = uh.get_kpis(**kwargs)
+    trips = uh.trip_kpis(kpis).set_index("Mobility mode")
+    assert trips.loc["fuel", "Trips"] == 1 and trips.loc["electric", "Trips"] == 1
+    assert trips.loc["electric", "Travel time"] == pytest.approx(48.0)
+    assert trips.loc["fuel", "Lost time"] == pytest.approx(9.78)
+    emissions = uh.get_data(variable="Respirable particles", **kwargs)
+    assert emissions["Edge"].isna().sum() == 1
+    assert kpis["emissions"]["Respirable particles"] == pytest.approx(
+        emissions["Respirable particles"].sum()
+    )
+    assert kpis["emissions"]["Respirable particles"] == pytest.approx(5.16)
+    # Scenarios without a sidecar get the same KPIs from their datasets
+    os.remove(us.kpis_path(folder))
+    recomputed = uh.get_kpis(**kwargs)
+    assert recomputed["trips"] == kpis["trips"]
+    assert recomputed["emissions"] == pytest.approx(kpis["emissions"])
+    written = us.migrate_scenarios(root="simulation/scenarios")
+    assert [os.path.basename(path) for path in written] == ["kpis.json"]
+
+
+def test_027_preload_scenario(monkeypatch, ingest_scenario):
+    monkeypatch.setattr(uh, "dataset_cache", ucache.DatasetCache())
+    ingest_scenario(
+        {"emission_results.xml": EMISSIONS_XML, "trip_results.xml": TRIPS_XML}
+    )
+
+    kwargs = dict(area="Kamppi", demand="regular", season="autumn", time="Weekday")
+    loaded = uh.preload_scenario(**kwargs)
+    # The scenario has no noise results, which are skipped
+    assert sorted(loaded) == sorted(
+        ["emission_results", "trip_results", uc.CUBE_DATASET]
+    )
+    preloaded = len(uh.dataset_cache)
+    uh.get_data(variable="Carbon dioxide", **kwargs)
+    uh.get_data(variable="Travel time", **kwargs)
+    assert len(uh.dataset_cache) == preloaded
+
+
+def test_028_memory_mapped_datasets(tmp_path, monkeypatch, ingest_scenario):
+    folder = ingest_scenario({"emission_results.xml": EMISSIONS_XML})
+
+    path = us.dataset_path(folder, "emission_results")
+    decoded = us.read_dataset(path)
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        return us.read_dataset(path)
+
+    mapped_folder = str(tmp_path / "mapped")
+    us.map_dataset(path, "emission_results", load, folder=mapped_folder)
+    second = us.map_dataset(path, "emission_results", load, folder=mapped_folder)
+    assert len(loads) == 1
+    pd.testing.assert_frame_equal(second, decoded)
+    # The columns are views of the mapped file, not copies
+    assert not second["Carbon dioxide"].to_numpy().flags.writeable
+    assert second["Mobility mode"].cat.ordered
+    # A rewritten dataset is decoded again
+    os.utime(path, ns=(0, 0))
+    us.map_dataset(path, "emission_results", load, folder=mapped_folder)
+    assert len(loads) == 2
+
+    kwargs = dict(area="Kamppi", demand="regular", season="autumn", time="Weekday")
+    monkeypatch.setattr(uh, "dataset_cache", ucache.DatasetCache())
+    mapped = uh.get_data(variable="Carbon dioxide", **kwargs)
+    monkeypatch.setattr(uc, "DATASET_MEMORY_MAP", False)
+    monkeypatch.setattr(uh, "dataset_cache", ucache.DatasetCache())
+    decoded = uh.get_data(variable="Carbon dioxide", **kwargs)
+    pd.testing.assert_frame_equal(mapped, decoded)
+    # Missing categories, eg. the edges of internal lanes, stay missing
+    missing = pd.DataFrame({"Edge": pd.Categorical(["e1", None, "e2"])})
+    us.write_mapped(missing, str(tmp_path / "missing.arrow"))
+    pd.testing.assert_frame_equal(
+        us.read_mapped(str(tmp_path / "missing.arrow")), missing
+    )
+
+
+def test_029_synthetic_scenario(tmp_path, monkeypatch):
+    import utils.synthetic as usyn
+
+    net_path = os.path.abspath("simulation/scenarios/kamppi/baseline_net.xml")
+    monkeypatch.chdir(tmp_path)
+    scale = dict(vehicles=40, seconds=600, edges=150, net_path=net_path, workers=1)
+    folder = usyn.synthesize_scenario(**scale)
+    # Not the shipped autumn scenario
+    assert folder == us.scenario_folder(area="kamppi", season="summer")
+
+    kwargs = dict(area="Kamppi", demand="regular", season="summer", time="Weekday")
+    emissions = uh.get_data(variable="Carbon dioxide", **kwargs)
+    assert emissions["Simulation timestep"].between(0, 599).all()
+    assert emissions["Vehicle"].nunique() <= 40
+    assert emissions["Edge"].nunique() <= 150
+    assert emissions["Longitude"].notna().all()
+    trips = us.read_dataset(us.dataset_path(folder, "trip_results"))
+    assert set(trips["Mobility mode"]) <= {"fuel", "electric"}
+    assert (trips["Travel time"] >= trips["Lost time"]).all()
+    electric = trips["Mobility mode"] == "electric"
+    assert (trips.loc[electric, "Carbon dioxide"] == 0).all()
+    assert (trips.loc[~electric, "Carbon dioxide"] > 0).all()
+    assert len(uh.get_data(variable="Noise", **kwargs))
+    # Existing datasets are only replaced on request
+    with pytest.raises(FileExistsError):
+        usyn.synthesize_scenario(**scale)
+    usyn.synthesize_scenario(**scale, seed=1, overwrite=True)
+
+
+def test_030_benchmarks(tmp_path, monkeypatch):
+    import utils.benchmark as ubench
+
+    tiny = {"vehicles": 20, "seconds": 300, "edges": 100}
+    monkeypatch.setattr(uc, "BENCHMARK_SCALES", dict(uc.BENCHMARK_SCALES, tiny=tiny))
+    results = ubench.run_benchmarks(
+        scales=["tiny"],
+        repeats=1,
+        stages=["aggregate_outputs", "get_data[Travel time]", "show_graphs[Summary]"],
+        workers=1,
+    )
+    stages = results["results"]["tiny"]
+    assert list(stages) == [
+        "aggregate_outputs",
+        "get_data[Travel time]",
+        "show_graphs[Summary]",
+    ]
+    assert all(metrics["seconds"] > 0 for metrics in stages.values())
+    assert stages["show_graphs[Summary]"]["payload_bytes"] > 0
+    path = str(tmp_path / "results.json")
+    ubench.write_results(results, path)
+    baseline = ubench.read_results(path)
+    assert ubench.compare_results(results, baseline) == []
+    # A stage that got slower, and one that got much slower than the threshold
+    slower = json.loads(json.dumps(results))
+    slower["results"]["tiny"]["get_data[Travel time]"]["seconds"] = (
+        baseline["results"]["tiny"]["get_data[Travel time]"]["seconds"] * 1.1
+    )
+    slower["results"]["tiny"]["aggregate_outputs"]["seconds"] += 10
+    regressions = ubench.compare_results(slower, baseline, threshold=0.25)
+    assert len(regressions) == 1 and "aggregate_outputs seconds" in regressions[0]
@@ -0,0 +1,134 @@
+# utils/backends.py
+import time
+import traci
+import utils.constants as uc
+
+
+def _import_backend(backend):
+    """
+    Returns the module that drives SUMO for a backend.
+
+    libsumo runs SUMO inside the Python process and needs the libsumo package.
+    TraCI talks to a SUMO process over a socket and is the fallback.
+
+    Args:
+        backend (str): libsumo or traci.
+
+    Returns:
+        tuple: The module and the name of the backend actually used.
+    """
+    if backend == "libsumo":
+        try:
+            import libsumo
+
+            return libsumo, "libsumo"
+        except ImportError:
+            pass
+    return traci, "traci"
+
+
+def start_simulation(cmd, backend=uc.SIMULATION_BACKEND, label="default"):
+    """
+    Starts SUMO with a backend.
+
+    libsumo can run a single simulation per process, so the label only applies
+    to TraCI connections.
+
+    Args:
+        cmd (list): The SUMO command line, eg. ["sumo", "-c", config_file].
+        backend (str): libsumo or traci.
+        label (str): The label of the TraCI connection.
+
+    Returns:
+        tuple: An object with the TraCI API of the running simulation, and the
+               name of the backend used.
+    """
+    module, backend = _import_backend(backend)
+    if backend == "libsumo":
+        module.start(cmd)
+        return module, backend
+    traci.start(cmd, label=label)
+    return traci.getConnection(label), backend
+
+
+def step_simulation(
+    connection,
+    end=uc.SIMULATION_END,
+    step_batch=uc.SIMULATION_STEP_BATCH,
+    controller=None,
+):
+    """
+    Advances a simulation until the end time, several seconds per call.
+
+    SUMO still simulates every step in between, only the calls from Python are
+    batched. A controller is called at the start and then at the times it asks
+    for: it can act on the simulation and returns the simulation time it next
+    needs to act at, or None once it does not need to act again.
+
+    Args:
+        connection: The simulation, from start_simulation.
+        end (float): The simulation time to stop at, in seconds.
+        step_batch (float): The most simulated seconds advanced per call.
+        controller (callable): Called with the connection, returns the next
+                               time it needs to act at or None.
+
+    Returns:
+        dict: The number of calls, simulated steps and seconds, wall time and
+              simulated steps per wall second.
+    """
+    delta = connection.simulation.getDeltaT()
+    begin = now = connection.simulation.getTime()
+    next_action = begin if controller is not None else None
+    calls = 0
+    start = time.perf_counter()
+    while now < end:
+        if next_action is not None and next_action <= now:
+            next_action = controller(connection)
+        target = min(now + max(step_batch, delta), end)
+        if next_action is not None:
+            target = min(target, max(next_action, now + delta))
+        connection.simulationStep(target)
+        calls += 1
+        now = connection.simulation.getTime()
+    wall_seconds = time.perf_counter() - start
+    steps = round((now - begin) / delta)
+    return {
+        "calls": calls,
+        "steps": steps,
+        "simulated_seconds": now - begin,
+        "wall_seconds": wall_seconds,
+        "steps_per_second": steps / max(wall_seconds, 1e-9),
+    }
+
+
+def measure_step_throughput(
+    config_file,
+    backends=("traci", "libsumo"),
+    end=uc.SIMULATION_END,
+    step_batch=uc.SIMULATION_STEP_BATCH,
+):
+    """
+    Runs a simulation once per backend and measures its step throughput.
+
+    Args:
+        config_file (str): The SUMO configuration to run. Its outputs are written
+                           on every run.
+        backends (tuple): The backends to measure.
+        end (float): The simulation time to stop at, in seconds.
+        step_batch (float): The most simulated seconds advanced per call.
+
+    Returns:
+        dict: The statistics of step_simulation per backend actually used.
+    """
+    results = {}
+    for backend in backends:
+        connection, used = start_simulation(
+            [uc.SUMO_BINARY, "-c", config_file, "--no-step-log"],
+            backend=backend,
+            label=f"throughput_{backend}",
+        )
+        try:
+            results[used] = step_simulation(connection, end=end, step_batch=step_batch)
+        finally:
+            connection.close()
+    return results
@@ -0,0 +1,382 @@
+# utils/benchmark.py
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import tracemalloc
+import plotly.utils
+import utils.constants as uc
+import utils.helpers as uh
+import utils.store as us
+import utils.synthetic as usyn
+import layout.callbacks as cb
+
+# The scenario every stage is measured on, as get_data arguments
+_SCENARIO = {
+    "area": "kamppi",
+    "demand": "regular",
+    "season": "autumn",
+    "time": "Weekday",
+}
+# One variable of every dataset get_data loads
+_DATASET_VARIABLES = ["Carbon dioxide", "Noise", "Travel time"]
+_TIMESTEP_RANGES = [1, 15, 60]
+# Every branch of show_graphs as (tab, variable)
+_VIEWS = (
+    [(uc.OBJECTIVES[0], None), (uc.OBJECTIVES[3], None)]
+    + [(uc.OBJECTIVES[1], variable["value"]) for variable in uc.TRAFFIC_VARIABLES]
+    + [
+        (uc.OBJECTIVES[2], variable["value"])
+        for variable in uc.AQ_VARIABLES
+        if not variable.get("disabled")
+    ]
+)
+
+
+def measure(run, setup=None, repeats=uc.BENCHMARK_REPEATS):
+    """
+    Measures the wall time and peak memory of a stage.
+
+    The stage is timed repeatedly and the fastest run is kept. It is then run
+    once more under tracemalloc, which slows it down, for the peak memory this
+    process allocates while it runs.
+
+    Args:
+        run (callable): Runs the stage, called without arguments.
+        setup (callable): Runs untimed before every run of the stage.
+        repeats (int): The number of timed runs.
+
+    Returns:
+        tuple: The seconds and peak_bytes of the stage as a dict, and the
+               result of its last run.
+    """
+    seconds = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        result = run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak_bytes}, result
+
+
+def payload_bytes(outputs):
+    """Returns the size of show_graphs outputs as sent to the browser."""
+    return len(json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def _clear_caches():
+    """Forgets every loaded dataset and drawn figure of this process."""
+    uh.dataset_cache.clear()
+    uh.view_cache.clear()
+    uh.figure_cache.clear()
+    shutil.rmtree(uc.MAPPED_DATASETS, ignore_errors=True)
+
+
+def _clear_views():
+    uh.view_cache.clear()
+    uh.figure_cache.clear()
+
+
+def _show_graphs(tab, variable):
+    return cb.show_graphs(
+        1,
+        tab,
+        _SCENARIO["season"],
+        _SCENARIO["time"],
+        _SCENARIO["area"],
+        _SCENARIO["demand"],
+        0,
+        "baseline",
+        variable,
+        uc.TIMELINE_FUNCTIONS[1]["value"],
+        uc.TIMESTEPS[1]["value"],
+    )
+
+
+def benchmark_scale(
+    scale,
+    net_path,
+    repeats=uc.BENCHMARK_REPEATS,
+    stages=None,
+    workers=uc.INGEST_WORKERS,
+):
+    """
+    Measures every stage on a synthetic scenario in the working directory.
+
+    The scenario's baseline outputs are converted by aggregate_outputs, its
+    datasets loaded by get_data and their timesteps binned by new_timeline,
+    and every tab and variable of show_graphs is drawn. The datasets are read
+    from the disk in every run of the get_data stages, and the figures drawn
+    in every run of the show_graphs stages.
+
+    Args:
+        scale (dict): The vehicles, seconds and edges of the scenario, see
+                      synthetic.write_synthetic_outputs.
+        net_path (str): Path to the SUMO network XML file.
+        repeats (int): The number of timed runs of every stage.
+        stages (list): Only measure the stages whose name contains one of
+                       these, every stage if None.
+        workers (int): The processes aggregate_outputs parses with.
+
+    Returns:
+        dict: The seconds, peak_bytes and, for show_graphs, payload_bytes of
+              every stage by name.
+    """
+    results = {}
+
+    def record(name, run, setup=None):
+        if stages and not any(stage in name for stage in stages):
+            return False
+        metrics, result = measure(run, setup=setup, repeats=repeats)
+        if name.startswith("show_graphs"):
+            metrics["payload_bytes"] = payload_bytes(result)
+        results[name] = metrics
+        line = (
+            f"{name:<45} {metrics['seconds']:9.3f} s "
+            f"{metrics['peak_bytes'] / 1024**2:9.1f} MiB"
+        )
+        if "payload_bytes" in metrics:
+            line += f" {metrics['payload_bytes'] / 1024:9.1f} KiB sent"
+        print(line)
+        return True
+
+    outputs = os.path.join("synthetic_outputs", "baseline")
+    situations = {}
+    for i, situation in enumerate(["baseline", "optimized"]):
+        situations[situation] = us.scenario_folder(**_SCENARIO, situation=situation)
+        usyn.write_synthetic_outputs(
+            net_path,
+            outputs if situation == "baseline" else situations[situation],
+            **scale,
+            demand=_SCENARIO["demand"],
+            season=_SCENARIO["season"],
+            time=_SCENARIO["time"],
+            seed=123 + i,
+        )
+    # The Traffic tab compares the baseline against the optimized situation
+    uh.aggregate_outputs(
+        net_path=net_path,
+        full_output_folder=situations["optimized"],
+        workers=workers,
+    )
+
+    def restore_outputs():
+        folder = situations["baseline"]
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.copytree(outputs, folder)
+
+    def ingest():
+        uh.aggregate_outputs(
+            net_path=net_path,
+            full_output_folder=situations["baseline"],
+            workers=workers,
+        )
+
+    # The last run of the stage leaves the datasets converted
+    if not record("aggregate_outputs", ingest, restore_outputs):
+        restore_outputs()
+        ingest()
+
+    for variable in _DATASET_VARIABLES:
+        record(
+            f"get_data[{variable}]",
+            lambda variable=variable: uh.get_data(**_SCENARIO, variable=variable),
+            _clear_caches,
+        )
+    record("get_cube", lambda: uh.get_cube(**_SCENARIO), _clear_caches)
+
+    emissions = uh.get_data(**_SCENARIO, variable="Carbon dioxide")
+    for timestep_range in _TIMESTEP_RANGES:
+        record(
+            f"new_timeline[{timestep_range}]",
+            lambda timestep_range=timestep_range: uh.new_timeline(
+                network=emissions.copy(deep=False), timestep_range=timestep_range
+            ),
+        )
+
+    for situation in situations:
+        uh.preload_scenario(**_SCENARIO, situation=situation)
+    # plotly sets up its templates and validators with the first figure
+    _show_graphs(*_VIEWS[0])
+    for tab, variable in _VIEWS:
+        name = f"show_graphs[{tab}]"
+        if variable is not None:
+            name = f"show_graphs[{tab}/{variable}]"
+        record(
+            name,
+            lambda tab=tab, variable=variable: _show_graphs(tab, variable),
+            _clear_views,
+        )
+    _clear_caches()
+    return results
+
+
+def run_benchmarks(
+    scales=("small", "medium"),
+    repeats=uc.BENCHMARK_REPEATS,
+    stages=None,
+    net_path=None,
+    workers=uc.INGEST_WORKERS,
+):
+    """
+    Measures every stage at several scales, each in its own temporary folder.
+
+    Args:
+        scales (list): Names of BENCHMARK_SCALES.
+        repeats (int): The number of timed runs of every stage.
+        stages (list): Only measure the stages whose name contains one of
+                       these, every stage if None.
+        net_path (str): Path to the SUMO network XML file, the Kamppi
+                        baseline_net.xml under SCENARIO_ROOT by default.
+        workers (int): The processes aggregate_outputs parses with.
+
+    Returns:
+        dict: The results, with the environment they were measured in, and
+              the stages of every scale under results, see benchmark_scale.
+    """
+    if net_path is None:
+        net_path = os.path.join(uc.SCENARIO_ROOT, "kamppi", "baseline_net.xml")
+    net_path = os.path.abspath(net_path)
+    results = {}
+    directory = os.getcwd()
+    for scale in scales:
+        print(f"Scale {scale}: {uc.BENCHMARK_SCALES[scale]}")
+        workdir = tempfile.mkdtemp(prefix=f"benchmark_{scale}_")
+        # The scenario tree and caches are relative to the working directory
+        os.chdir(workdir)
+        try:
+            results[scale] = benchmark_scale(
+                uc.BENCHMARK_SCALES[scale],
+                net_path,
+                repeats=repeats,
+                stages=stages,
+                workers=workers,
+            )
+        finally:
+            os.chdir(directory)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeats": repeats,
+        "scales": {scale: uc.BENCHMARK_SCALES[scale] for scale in scales},
+        "results": results,
+    }
+
+
+def read_results(path):
+    """Reads benchmark results, None if the file does not exist."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_results(results, path):
+    """Writes benchmark results as JSON."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+
+
+def compare_results(
+    results,
+    baseline,
+    threshold=uc.BENCHMARK_THRESHOLD,
+    min_seconds=uc.BENCHMARK_MIN_SECONDS,
+):
+    """
+    Compares benchmark results against a baseline.
+
+    Only the stages measured at the same scale in both are compared.
+
+    Args:
+        results (dict): The results from run_benchmarks.
+        baseline (dict): Earlier results from run_benchmarks.
+        threshold (float): The share a measure may grow by.
+        min_seconds (float): Wall time differences below this are ignored.
+
+    Returns:
+        list: A description of every regression, empty if there are none.
+    """
+    regressions = []
+    for scale, stages in results["results"].items():
+        for stage, metrics in stages.items():
+            before = baseline["results"].get(scale, {}).get(stage)
+            if before is None:
+                continue
+            for measure_name, value in metrics.items():
+                previous = before.get(measure_name)
+                if previous is None or value <= previous * (1 + threshold):
+                    continue
+                if measure_name == "seconds" and value - previous < min_seconds:
+                    continue
+                growth = f"+{value / previous - 1:.0%}" if previous else "new"
+                regressions.append(
+                    f"{scale} {stage} {measure_name}: {previous:.6g} -> {value:.6g} "
+                    f"({growth})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the ingest, data access and figures."
+    )
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        default=["small", "medium"],
+        choices=list(uc.BENCHMARK_SCALES),
+    )
+    parser.add_argument("--repeats", type=int, default=uc.BENCHMARK_REPEATS)
+    parser.add_argument("--stages", nargs="+", default=None)
+    parser.add_argument("--workers", type=int, default=uc.INGEST_WORKERS)
+    parser.add_argument("--output", default=uc.BENCHMARK_RESULTS)
+    parser.add_argument("--baseline", default=uc.BENCHMARK_BASELINE)
+    parser.add_argument("--threshold", type=float, default=uc.BENCHMARK_THRESHOLD)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing them.",
+    )
+    args = parser.parse_args()
+    results = run_benchmarks(
+        scales=args.scales,
+        repeats=args.repeats,
+        stages=args.stages,
+        workers=args.workers,
+    )
+    write_results(results, args.output)
+    print(f"Wrote {args.output}")
+    if args.save_baseline:
+        write_results(results, args.baseline)
+        print(f"Wrote {args.baseline}")
+        sys.exit(0)
+    baseline = read_results(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, save one with --save-baseline")
+        sys.exit(0)
+    regressions = compare_results(results, baseline, threshold=args.threshold)
+    for regression in regressions:
+        print(f"Regressed: {regression}")
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    sys.exit(1 if regressions else 0)
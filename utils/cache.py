@@ -0,0 +1,340 @@
+# utils/cache.py
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import pandas as pd
+import utils.constants as uc
+
+
+def _nbytes(value):
+    """Returns the in-memory size of a cached DataFrame in bytes."""
+    return int(value.memory_usage(index=True, deep=True).sum())
+
+
+class DatasetCache:
+    """
+    A memory-bounded least recently used cache for datasets read from the disk.
+
+    Every entry remembers the file it was loaded from and its modification time,
+    and is reloaded once either changes. Entries are evicted, least recently
+    used first, when their total size exceeds max_bytes.
+
+    Args:
+        max_bytes (int): The maximum total size of the cached datasets in bytes.
+    """
+
+    def __init__(self, max_bytes=uc.DATASET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, nbytes, dataset)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def get(self, key, path, load):
+        """
+        Returns the cached dataset for a key, loading it on a miss.
+
+        Args:
+            key (tuple): The cache key.
+            path (str): The file the dataset is loaded from.
+            load (callable): Loads the dataset given the path.
+
+        Returns:
+            pd.DataFrame: The cached dataset. Callers must not modify it in place.
+        """
+        version = (str(path), os.path.getmtime(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[2]
+            if entry is not None:
+                # The file has changed since it was cached
+                self._remove(key)
+            self.misses += 1
+
+        dataset = load(path)
+        nbytes = _nbytes(dataset)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes <= self.max_bytes:
+                self._entries[key] = (version, nbytes, dataset)
+                self._nbytes += nbytes
+                while self._nbytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return dataset
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: hits, misses, number of entries, cached bytes and the byte limit.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class RenderCache:
+    """
+    A memory-bounded least recently used cache for rendered bytes.
+
+    Entries are keyed by a fingerprint of everything they were rendered from,
+    so they never go stale and are only evicted, least recently used first,
+    when their total size exceeds max_bytes.
+
+    Args:
+        max_bytes (int): The maximum total size of the cached values in bytes.
+    """
+
+    def __init__(self, max_bytes=uc.HEATMAP_RASTER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> value
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, render):
+        """
+        Returns the cached value for a key, rendering it on a miss.
+
+        Args:
+            key (str): The fingerprint of the value.
+            render (callable): Renders the value, called without arguments.
+
+        Returns:
+            bytes: The cached value.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            self.misses += 1
+
+        value = render()
+        with self._lock:
+            if key not in self._entries and len(value) <= self.max_bytes:
+                self._entries[key] = value
+                self._nbytes += len(value)
+                while self._nbytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._nbytes -= len(evicted)
+        return value
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class FigureCache:
+    """
+    A size-bounded least recently used cache of serialized figures on the disk.
+
+    Every entry is a JSON file named after a digest of its key, so entries
+    survive server restarts and are shared by all server processes. Reading an
+    entry refreshes its modification time, and the entries read least recently
+    are removed when their total size exceeds max_bytes.
+
+    Args:
+        folder (str): The folder of the cached figures.
+        max_bytes (int): The maximum total size of the cached figures in bytes.
+    """
+
+    def __init__(self, folder=uc.FIGURE_CACHE, max_bytes=uc.FIGURE_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.folder, f"{digest}.json")
+
+    def get(self, key, render, valid=None):
+        """
+        Returns the cached figures for a key, rendering them on a miss.
+
+        Args:
+            key (tuple): The parameters and data version the figures are drawn from.
+            render (callable): Returns the figures serialized as JSON, called
+                               without arguments.
+            valid (callable): Returns whether cached figures can still be
+                              shown, given them serialized. Figures that cannot
+                              are rendered again.
+
+        Returns:
+            str: The serialized figures.
+        """
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            value = None
+        if value is not None and valid is not None and not valid(value):
+            value = None
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = render()
+        if len(value) <= self.max_bytes:
+            os.makedirs(self.folder, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+            with os.fdopen(handle, "w", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(temporary, path)
+            self._evict()
+        return value
+
+    def _evict(self):
+        """Removes the least recently read entries until they fit in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process removed it first
+                pass
+            nbytes -= size
+
+    def clear(self):
+        """Removes every cached figure and resets the counters."""
+        with self._lock:
+            if os.path.isdir(self.folder):
+                for entry in os.scandir(self.folder):
+                    if entry.name.endswith(".json"):
+                        os.remove(entry.path)
+            self.hits = 0
+            self.misses = 0
+
+
+def _shallow_copy(result):
+    """
+    Returns a copy of a result's DataFrames that shares their columns.
+
+    pandas fills some internal caches of a DataFrame lazily, which is not safe
+    while other threads read the same DataFrame, so every caller gets its own.
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy(deep=False)
+    if isinstance(result, (list, tuple)):
+        return type(result)(_shallow_copy(part) for part in result)
+    return result
+
+
+class ResultCache:
+    """
+    A least recently used cache of intermediate results shared by callbacks.
+
+    A result is computed once even when several callbacks ask for it at the
+    same time: the first one computes it and the others wait for it. Every
+    caller gets its own shallow copy of the result's DataFrames.
+
+    Args:
+        max_entries (int): The maximum number of cached results.
+    """
+
+    def __init__(self, max_entries=uc.VIEW_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> result
+        self._computing = {}  # key -> lock held while the result is computed
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """
+        Returns the cached result for a key, computing it on a miss.
+
+        Args:
+            key (tuple): The parameters the result is computed from.
+            compute (callable): Computes the result, called without arguments.
+
+        Returns:
+            object: The cached result. Callers must not modify it in place.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return _shallow_copy(self._entries[key])
+            computing = self._computing.setdefault(key, threading.Lock())
+        with computing:
+            with self._lock:
+                if key in self._entries:
+                    # Computed by another callback while this one waited
+                    self.hits += 1
+                    return _shallow_copy(self._entries[key])
+                self.misses += 1
+            try:
+                result = compute()
+                with self._lock:
+                    self._entries[key] = result
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    result = _shallow_copy(result)
+            finally:
+                with self._lock:
+                    self._computing.pop(key, None)
+        return result
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -1,4 +1,5 @@
 # Imports
+import os
 import numpy as np
 
 # Interface text variables
@@ -251,3 +252,198 @@ FROM_VAR_TO_DATA_COLS = {
 }
 # Labels to variables, if updates are needed
 LABELS = {"Vehicle": "Mobility flow"}
+
+# Data processing parameters
+# Number of parsed XML elements held in memory before a batch is flushed
+XML_BATCH_SIZE = 100_000
+# Root folder of the scenario datasets, partitioned by area, demand_season_time and situation
+SCENARIO_ROOT = "simulation/scenarios"
+# Storage format of the aggregated scenario datasets: "parquet" or "csv"
+DATASET_FORMAT = "parquet"
+PARQUET_COMPRESSION = "zstd"
+# Maximum total size of the scenario datasets kept in memory by get_data
+DATASET_CACHE_MAX_BYTES = 1024**3
+# Decoded datasets are kept as uncompressed Arrow IPC (Feather v2) files and
+# memory-mapped, so every server process reads the same pages
+DATASET_MEMORY_MAP = True
+MAPPED_DATASETS = os.path.join(SCENARIO_ROOT, "mapped_datasets")
+# Figures drawn by show_graphs, kept on the disk across server restarts
+FIGURE_CACHE = os.path.join(SCENARIO_ROOT, "figure_cache")
+FIGURE_CACHE_MAX_BYTES = 1024**3
+# Part of every figure cache key, change it when the figures are drawn differently
+FIGURE_CACHE_VERSION = 1
+# Number of views whose timelines are kept in memory for all of their figures
+VIEW_CACHE_MAX_ENTRIES = 8
+# Threads drawing the figures of a view at once in show_graphs
+GRAPH_WORKERS = 4
+# Compiled road networks, one folder per net file content hash
+NETWORK_CACHE = os.path.join(SCENARIO_ROOT, "network_cache")
+# The vehicle class the compiled edge graph is built for
+NETWORK_VCLASS = "passenger"
+# Largest (group, value) bitmap used to count distinct values per group
+DISTINCT_BITMAP_MAX_BITS = 2**28
+# Emission cube pre-aggregated at ingest time per second, edge and mobility mode
+CUBE_DATASET = "emission_cube"
+CUBE_KEYS = ["Simulation timestep", "Edge", "Mobility mode"]
+CUBE_MEASURES = [
+    "Mobility flow",
+    "Speed",
+    "Carbon dioxide",
+    "Carbon monoxide",
+    "Hydrocarbon",
+    "Nitrogen oxides",
+    "Respirable particles",
+    "Noise",
+    "Fuel",
+    "Electricity",
+]
+# String columns stored as integer codes of the scenario's shared dictionaries
+# Column -> dictionary, vehicles and trips share their ids
+DICTIONARY_COLUMNS = {
+    "Vehicle": "Vehicle",
+    "Trip": "Vehicle",
+    "Route": "Route",
+    "Edge": "Edge",
+    "Lane": "Lane",
+    "Name": "Name",
+    "Mobility mode": "Mobility mode",
+    "Class": "Class",
+}
+DICTIONARIES_DATASET = "dictionaries"
+# Small per-scenario summary written at ingest time for the Summary tab
+KPI_DATASET = "kpis"
+KPI_TRIP_DATASET = "trip_results"
+KPI_POLLUTANTS = [
+    "Carbon dioxide",
+    "Carbon monoxide",
+    "Hydrocarbon",
+    "Nitrogen oxides",
+    "Respirable particles",
+]
+# Dimension tables of a scenario folder: the key column and the attributes that
+# are stored once per key instead of on every row of the datasets
+DIMENSIONS = {
+    "edges": ("Edge", ["Name", "Longitude", "Latitude"]),
+    "lanes": ("Lane", ["Edge"]),
+    "vehicles": ("Vehicle", ["Mobility mode", "Class"]),
+}
+DIMENSION_DATASET_PREFIX = "dimension_"
+# Number of processes aggregate_outputs parses the outputs with, None for one per core
+INGEST_WORKERS = None
+# Smallest part an emission output is split into for parallel parsing
+XML_SPLIT_MIN_BYTES = 64 * 1024**2
+
+# Simulation parameters
+SUMO_BINARY = "sumo"
+# Runs SUMO over a socket with "traci", or in-process with "libsumo" when it is
+# installed, falling back to "traci" otherwise
+SIMULATION_BACKEND = "traci"
+# Most simulated seconds advanced per call when no controller needs to act
+SIMULATION_STEP_BATCH = 60
+# Simulated seconds per scenario
+SIMULATION_END = 3600
+# Route file of every scenario, gzip-compressed if it ends with .gz
+ROUTE_FILE = "rou.xml"
+
+# Demand parameters
+# Trips starting in the peak hour at each demand level, regular summer weekday
+# demand keeps the 3000 trips of the first simulations
+DEMAND_TRIPS_PER_HOUR = {"low": 1700, "regular": 3400, "high": 5100}
+SEASON_DEMAND_FACTORS = {"spring": 1.05, "summer": 1.0, "autumn": 1.05, "winter": 1.1}
+# Share of the peak hour's trips starting in each hour of the day, 0 to 23
+HOURLY_DEMAND_PROFILES = {
+    "weekday": [
+        0.05, 0.03, 0.02, 0.02, 0.04, 0.15, 0.55, 1.0, 0.9, 0.6, 0.5, 0.55,
+        0.6, 0.55, 0.6, 0.75, 0.95, 0.9, 0.7, 0.5, 0.35, 0.25, 0.15, 0.1,
+    ],
+    "weekend": [
+        0.15, 0.1, 0.08, 0.05, 0.04, 0.05, 0.1, 0.2, 0.35, 0.5, 0.6, 0.7,
+        0.75, 0.75, 0.7, 0.7, 0.65, 0.6, 0.55, 0.45, 0.4, 0.35, 0.25, 0.2,
+    ],
+}
+# Hour of the day the simulation starts at
+DEMAND_START_HOUR = 7
+# Second of the simulation after which no more trips start
+TRIP_INSERTION_END = 3200
+ELECTRIC_SHARE = 0.2
+# Whether routes are computed before the simulation instead of by SUMO
+PRE_ROUTE = True
+# Routing processes, None for one per core
+ROUTING_WORKERS = None
+ROUTING_ORIGINS_PER_TASK = 64
+
+# Synthetic scenario parameters, see utils/synthetic.py
+# Vehicles and simulated seconds of a synthetic scenario
+SYNTHETIC_VEHICLES = 3000
+SYNTHETIC_SECONDS = SIMULATION_END
+# Share of the edges a vehicle stops at, and the range of a stop in seconds
+SYNTHETIC_STOP_SHARE = 0.2
+SYNTHETIC_STOP_SECONDS = (5, 40)
+# Range of the share of the free-flow speed vehicles drive at between stops
+SYNTHETIC_SPEED_SHARE = (0.7, 1.0)
+
+# Benchmark parameters, see utils/benchmark.py
+# Synthetic scenario sizes the stages are measured at
+BENCHMARK_SCALES = {
+    "small": {"vehicles": 300, "seconds": 900, "edges": 300},
+    "medium": {"vehicles": 3000, "seconds": 3600, "edges": None},
+    "large": {"vehicles": 10000, "seconds": 3600, "edges": None},
+}
+BENCHMARK_RESULTS = "benchmarks/results.json"
+BENCHMARK_BASELINE = "benchmarks/baseline.json"
+# Runs per stage, the fastest one is reported
+BENCHMARK_REPEATS = 3
+# A stage regresses when its wall time, peak memory or payload grows by more
+# than this share of the baseline
+BENCHMARK_THRESHOLD = 0.25
+# Wall time differences below this many seconds are not regressions
+BENCHMARK_MIN_SECONDS = 0.05
+# Every scenario combination simulated by the sweep
+ALL_SCENARIOS = "simulation/scenarios/all_scenarios.csv"
+# Number of scenarios the sweep simulates at once, None for one per core
+SWEEP_WORKERS = None
+# Sweep journal of finished and failed scenarios, used to resume a sweep
+SWEEP_LOG = "simulation/scenarios/sweep_log.csv"
+
+# Heatmap parameters
+# "density" draws the heatmaps in the browser, "raster" renders them on the server
+HEATMAP_RENDERING = "density"
+# Size of the rendered heatmap images in pixels
+HEATMAP_RASTER_WIDTH = 800
+HEATMAP_RASTER_HEIGHT = 600
+# Radius every edge is spread over in the rendered images, in pixels
+HEATMAP_RASTER_SPREAD = 8
+# Maximum total size of the rendered heatmap frames kept in memory
+HEATMAP_RASTER_CACHE_MAX_BYTES = 256 * 1024**2
+# "embedded" sends every heatmap frame at once, "lazy" sends a frame when shown
+HEATMAP_DELIVERY = "embedded"
+# Heatmap rows of the lazily delivered heatmaps, shared by the server processes
+HEATMAP_FRAME_DIR = os.path.join(SCENARIO_ROOT, "heatmap_frames")
+# Number of heatmaps whose rows are kept on the disk and in memory
+HEATMAP_FRAME_MAX_FILES = 64
+HEATMAP_FRAME_MAX_MEMORY = 8
+# Maximum total size of the serialized heatmap frames kept in memory
+HEATMAP_FRAME_CACHE_MAX_BYTES = 256 * 1024**2
+# Number of frames on either side of the shown one rendered ahead
+HEATMAP_FRAME_PREFETCH = 1
+# Time between frames when a lazily delivered heatmap plays, in milliseconds
+HEATMAP_FRAME_INTERVAL_MS = 1000
+
+# Server parameters
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8050
+# Server processes, None for one per core
+SERVER_WORKERS = None
+# Requests every server process handles at once
+SERVER_THREADS = 4
+# Scenarios whose datasets are loaded before the server processes start, so
+# the processes share them; both situations of every scenario are loaded
+SERVER_PRELOAD = [
+    {
+        "area": "kamppi",
+        "demand": "regular",
+        "season": "autumn",
+        "time": "Weekday",
+        "optimization": 0,
+    },
+]
@@ -0,0 +1,150 @@
+# utils/demand.py
+import gzip
+import numpy as np
+import pandas as pd
+import utils.constants as uc
+import utils.network as un
+
+
+def demand_profile(demand="regular", season="summer", day="weekday"):
+    """
+    Returns the hourly trip rates of a scenario over a whole day.
+
+    Args:
+        demand (str): the amount of mobility, low, regular or high.
+        season (str): the season.
+        day (str): the time of week, weekday or weekend.
+
+    Returns:
+        np.ndarray: The number of trips starting in each hour of the day, 0 to 23.
+    """
+    weights = np.asarray(uc.HOURLY_DEMAND_PROFILES[day.lower()], dtype=np.float64)
+    return (
+        uc.DEMAND_TRIPS_PER_HOUR[demand.lower()]
+        * uc.SEASON_DEMAND_FACTORS[season.lower()]
+        * weights
+    )
+
+
+def departure_times(profile, rng, begin=0, end=uc.TRIP_INSERTION_END, trips=None):
+    """
+    Draws the departure times of a simulation from an hourly profile.
+
+    The simulation starts at DEMAND_START_HOUR. Every simulated second gets the
+    rate of its hour, the number of trips is the expected count over the
+    simulated seconds unless given, and the seconds are drawn in one call.
+
+    Args:
+        profile (np.ndarray): Trips per hour of the day, from demand_profile.
+        rng (np.random.RandomState): The random state.
+        begin (int): The first departure second.
+        end (int): The second departures stop at.
+        trips (int): The number of departures, the profile's if None.
+
+    Returns:
+        np.ndarray: The sorted departure seconds.
+    """
+    seconds = np.arange(begin, end)
+    hours = (uc.DEMAND_START_HOUR + seconds // 3600) % 24
+    rates = profile[hours] / 3600
+    if trips is None:
+        trips = int(round(rates.sum()))
+    departures = rng.choice(seconds, size=trips, p=rates / rates.sum())
+    return np.sort(departures)
+
+
+def generate_trips(
+    network,
+    demand="regular",
+    season="summer",
+    day="weekday",
+    seed=123,
+    begin=0,
+    end=uc.TRIP_INSERTION_END,
+    electrify=uc.ELECTRIC_SHARE,
+    trips=None,
+):
+    """
+    Generates the trips of a scenario as arrays, without a loop per trip.
+
+    Args:
+        network (dict): The compiled road network, from load_network.
+        demand (str): the amount of mobility, low, regular or high.
+        season (str): the season.
+        day (str): the time of week, weekday or weekend.
+        seed (int): the seed of the random state.
+        begin (int): The first departure second.
+        end (int): The second departures stop at.
+        electrify (float): The share of electric cars.
+        trips (int): The number of trips, the demand profile's if None.
+
+    Returns:
+        pd.DataFrame: The departure, vehicle type, origin and destination edge
+                      of every trip, in departure order.
+    """
+    rng = np.random.RandomState(seed)
+    departures = departure_times(
+        demand_profile(demand, season, day), rng, begin=begin, end=end, trips=trips
+    )
+    trips = len(departures)
+    electric = np.zeros(trips, dtype=bool)
+    electric[: round(trips * electrify)] = True
+    rng.shuffle(electric)
+    edge_ids, adjacency, _ = un.network_graph(network)
+    origins, destinations = un.sample_od_pairs(adjacency, trips, rng=rng)
+    return pd.DataFrame(
+        {
+            "Depart": departures,
+            "Type": np.where(electric, "electric", "fuel"),
+            "From": edge_ids[origins],
+            "To": edge_ids[destinations],
+        }
+    )
+
+
+def write_route_file(trips, rou_file_path, vehicle_types):
+    """
+    Writes trips into a SUMO route file in one go.
+
+    Trips with a Route are written as vehicles with their route, so SUMO does
+    not route them at insertion, the others as trips between their edges.
+
+    Args:
+        trips (pd.DataFrame): Trips from generate_trips, optionally with the
+                              Route column of route_trips.
+        rou_file_path (str): The route file path, gzip-compressed if it ends
+                             with .gz.
+        vehicle_types (list): The vType elements to write before the trips.
+    """
+    routes = trips["Route"].tolist() if "Route" in trips else [None] * len(trips)
+    lines = [
+        (
+            f'\t<vehicle id="test_trip_{i}" type="{vtype}" depart="{depart}">'
+            f'<route edges="{route}"/></vehicle>\n'
+            if route is not None
+            else f'\t<trip id="test_trip_{i}" type="{vtype}" depart="{depart}" '
+            f'from="{origin}" to="{destination}"/>\n'
+        )
+        for i, (depart, vtype, origin, destination, route) in enumerate(
+            zip(
+                trips["Depart"].tolist(),
+                trips["Type"].tolist(),
+                trips["From"].tolist(),
+                trips["To"].tolist(),
+                routes,
+            )
+        )
+    ]
+    content = "".join(
+        ['<?xml version="1.0" encoding="UTF-8"?>\n<routes>\n']
+        + vehicle_types
+        + lines
+        + ["</routes>"]
+    )
+    if str(rou_file_path).endswith(".gz"):
+        with gzip.open(rou_file_path, "wt", encoding="UTF-8") as f:
+            f.write(content)
+    else:
+        with open(rou_file_path, "w", encoding="UTF-8") as f:
+            f.write(content)
+
@@ -0,0 +1,148 @@
+# utils/frames.py
+import os
+import glob
+import hashlib
+import tempfile
+import threading
+import concurrent.futures
+from collections import OrderedDict
+import pandas as pd
+import utils.constants as uc
+import utils.cache as ucache
+
+# Serialized heatmap frames, shared by all callbacks of the process
+frame_cache = ucache.RenderCache(max_bytes=uc.HEATMAP_FRAME_CACHE_MAX_BYTES)
+
+# The rows of the most recently used heatmaps by key
+_networks = OrderedDict()
+_lock = threading.Lock()
+# Renders prefetched frames while the callback returns the shown one
+_prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+_pending = set()
+
+
+def network_key(network, *parameters):
+    """Returns a hex digest of a heatmap's rows and drawing parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pd.util.hash_pandas_object(network, index=False).to_numpy().tobytes())
+    digest.update(repr((list(network.columns), parameters)).encode())
+    return digest.hexdigest()
+
+
+def _path(key, folder):
+    return os.path.join(folder, f"{key}.parquet")
+
+
+def _remember(key, network):
+    with _lock:
+        _networks[key] = network
+        _networks.move_to_end(key)
+        while len(_networks) > uc.HEATMAP_FRAME_MAX_MEMORY:
+            _networks.popitem(last=False)
+
+
+def register(network, *parameters, folder=uc.HEATMAP_FRAME_DIR):
+    """
+    Keeps the rows of a lazily delivered heatmap until its frames are asked for.
+
+    The rows are written to the disk, so the frames can be served by any
+    server process, and the oldest files are removed once there are more than
+    HEATMAP_FRAME_MAX_FILES.
+
+    Args:
+        network (pd.DataFrame): The heatmap rows.
+        parameters: Everything else the frames are drawn from.
+        folder (str): The folder of the heatmap rows.
+
+    Returns:
+        str: The key of the heatmap.
+    """
+    key = network_key(network, *parameters)
+    path = _path(key, folder)
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        os.close(handle)
+        network.to_parquet(temporary, index=False)
+        os.replace(temporary, path)
+        files = sorted(
+            glob.glob(os.path.join(folder, "*.parquet")), key=os.path.getmtime
+        )
+        for old in files[: max(0, len(files) - uc.HEATMAP_FRAME_MAX_FILES)]:
+            try:
+                os.remove(old)
+            except OSError:
+                # Another process removed it first
+                pass
+    _remember(key, network)
+    return key
+
+
+def registered(key, folder=uc.HEATMAP_FRAME_DIR):
+    """
+    Returns whether the rows of a heatmap are still on the disk.
+
+    Every server process loads the rows from the disk, so a heatmap whose file
+    has been removed must be registered again. The file of a heatmap that is
+    still there is marked as recently used.
+
+    Args:
+        key (str): The key from register.
+        folder (str): The folder of the heatmap rows.
+
+    Returns:
+        bool: Whether the frames of the heatmap can be drawn.
+    """
+    try:
+        os.utime(_path(key, folder))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def load(key, folder=uc.HEATMAP_FRAME_DIR):
+    """
+    Returns the rows of a registered heatmap.
+
+    Args:
+        key (str): The key from register.
+        folder (str): The folder of the heatmap rows.
+
+    Returns:
+        pd.DataFrame: The heatmap rows, None if they have been removed.
+    """
+    with _lock:
+        network = _networks.get(key)
+        if network is not None:
+            _networks.move_to_end(key)
+            return network
+    path = _path(key, folder)
+    try:
+        network = pd.read_parquet(path)
+    except (FileNotFoundError, OSError):
+        return None
+    _remember(key, network)
+    return network
+
+
+def prefetch(key, render):
+    """
+    Renders a frame into frame_cache in the background.
+
+    Args:
+        key (str): The fingerprint of the frame.
+        render (callable): Renders the frame, called without arguments.
+    """
+    with _lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+
+    def task():
+        try:
+            frame_cache.get(key, render)
+        finally:
+            with _lock:
+                _pending.discard(key)
+
+    _prefetcher.submit(task)
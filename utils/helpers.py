@@ -2,43 +2,204 @@
 import numpy as np
 import pandas as pd
 import os
+import io
+import json
+import re
 import glob
+import concurrent.futures
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+import threading
 import utils.constants as uc
+import utils.store as us
+import utils.cache as ucache
+import utils.backends as ub
+import utils.demand as ud
+import utils.network as un
+import utils.routing as ur
+import utils.raster as uraster
+import utils.frames as uf
+import pyarrow.parquet as pq
 import sys
-import sumolib
-import random
 import xml.etree.ElementTree as ET
 import gzip
-import traci
-import shutil
 
 # Hover layout
 hover_layout = dict(bgcolor="white", font_size=16)
+# Guards the default plotly template while it is copied
+_template_lock = threading.Lock()
+
+# Datasets read by get_data, shared by all callbacks of the process
+dataset_cache = ucache.DatasetCache()
+# Figures drawn by show_graphs, shared by all server processes
+figure_cache = ucache.FigureCache()
+# Timelines of a view, shared by the callbacks drawing its figures
+view_cache = ucache.ResultCache()
+
+
+def _template():
+    """
+    Returns a copy of the default plotly template for one figure.
+
+    plotly resolves the properties of a shared template lazily, which fails
+    when figures are drawn in several threads at once, so every figure gets
+    its own copy.
+    """
+    with _template_lock:
+        return go.layout.Template(pio.templates[pio.templates.default])
+
+
+def timestep_bins(timesteps, timestep_ranges):
+    """
+    Bins simulation seconds into minute buckets of several lengths in one pass.
+
+    The seconds are converted to int32 offsets from the first timestep once,
+    and every bucket length is then a single integer division. The buckets
+    match new_timeline: they start at the first timestep, and the last one
+    also holds everything after it.
+
+    Args:
+        timesteps (array-like): The simulation timestep of every row, in seconds.
+        timestep_ranges (list): The bucket lengths, in minutes.
+
+    Returns:
+        dict: Per bucket length, the int32 bucket code of every row (-1 for a
+              missing timestep) and the label of every bucket, the minute it
+              ends at.
+    """
+    values = np.asarray(timesteps)
+    missing = np.isnan(values) if values.dtype.kind == "f" else None
+    if missing is not None and missing.any():
+        values = np.where(missing, 0, values)
+    else:
+        missing = None
+    # Simulation seconds are never negative, so truncating floors them
+    seconds = values.astype(np.int32)
+    valid = seconds if missing is None else seconds[~missing]
+    first, last = (valid.min(), valid.max()) if len(valid) else (0, 0)
+    offsets = seconds - first
+    bins = {}
+    for timestep_range in timestep_ranges:
+        # Data of a single timestep still gets one bucket
+        starts = np.arange(first, max(last, first + 1), timestep_range * 60, dtype=int)
+        codes = offsets // np.int32(timestep_range * 60)
+        np.minimum(codes, len(starts) - 1, out=codes)
+        if missing is not None:
+            codes[missing] = -1
+        bins[timestep_range] = (codes, starts // 60 + timestep_range)
+    return bins
 
 
 def new_timeline(network, timestep_range):
     """
     Re-indexes timesteps from simulation seconds to minutes.
+
+    Adds the minute bucket of every row as the categorical Timestep column of
+    the given frame, see timestep_bins.
     """
-    timesteps = np.arange(
-        network["Simulation timestep"].min(),
-        network["Simulation timestep"].max(),
-        timestep_range * 60,
-        dtype=int,
-    )
-    timestep_labels = timesteps // 60 + timestep_range
-    timesteps = np.append(timesteps, np.inf)
-    network["Timestep"] = pd.cut(
-        network["Simulation timestep"],
-        bins=timesteps,
-        labels=timestep_labels,
-        right=False,
-        include_lowest=True,
+    codes, labels = timestep_bins(network["Simulation timestep"], [timestep_range])[
+        timestep_range
+    ]
+    network["Timestep"] = pd.Categorical.from_codes(
+        codes, categories=labels, ordered=True
     )
     return network
 
 
+def _codes(column):
+    """Returns the integer codes and sorted levels of a column, -1 for missing values."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy().astype(np.int64), column.cat.categories
+    codes, levels = pd.factorize(column, sort=True)
+    return codes.astype(np.int64), levels
+
+
+def _group_codes(network, by):
+    """
+    Integer-codes the groups of a groupby over the given columns.
+
+    Returns:
+        tuple: The flat group code of every row (-1 if a key is missing) and the
+               MultiIndex of every key combination, in groupby order.
+    """
+    codes, levels = zip(*(_codes(network[col_name]) for col_name in by))
+    shape = tuple(len(level) for level in levels)
+    valid = np.logical_and.reduce([code >= 0 for code in codes])
+    group_codes = np.full(len(network), -1, dtype=np.int64)
+    if valid.any():
+        group_codes[valid] = np.ravel_multi_index(
+            [code[valid] for code in codes], shape
+        )
+    index = pd.MultiIndex.from_product(levels, names=by)
+    return group_codes, index
+
+
+def count_distinct(network, by, column="Vehicle"):
+    """
+    Counts the distinct values of a column per group without a Python call per group.
+
+    Both the groups and the values are integer-coded. The distinct (group, value)
+    pairs are marked in a bitmap when it is small enough, otherwise found with
+    np.unique, and then counted per group.
+
+    Args:
+        network (pd.DataFrame): The data to group.
+        by (list): The columns to group by.
+        column (str): The column whose distinct values are counted.
+
+    Returns:
+        tuple: The number of distinct non-missing values and the number of rows
+               of every key combination, as two Series on the same MultiIndex.
+    """
+    group_codes, index = _group_codes(network, by)
+    value_codes, values = _codes(network[column])
+    rows = np.bincount(group_codes[group_codes >= 0], minlength=len(index))
+    valid = (group_codes >= 0) & (value_codes >= 0)
+    pairs = group_codes[valid] * len(values) + value_codes[valid]
+    if len(index) * len(values) <= uc.DISTINCT_BITMAP_MAX_BITS:
+        # Mark the seen pairs in a (group, value) bitmap instead of sorting them
+        seen = np.zeros(len(index) * len(values), dtype=bool)
+        seen[pairs] = True
+        distinct = seen.reshape(len(index), len(values)).sum(axis=1)
+    else:
+        pairs = np.unique(pairs)
+        distinct = np.bincount(pairs // len(values), minlength=len(index))
+    return (
+        pd.Series(distinct, index=index, name=column),
+        pd.Series(rows, index=index, name=column),
+    )
+
+
+def aggregate_groups(network, by, aggregations):
+    """
+    Groups the data and aggregates it like groupby(by, observed=False).agg(aggregations).
+
+    Columns aggregated with "nunique" are counted by count_distinct instead of
+    per group. Like groupby, groups without any rows get NaN instead of 0.
+
+    Args:
+        network (pd.DataFrame): The data to group.
+        by (list): The columns to group by.
+        aggregations (dict): Columns mapped to their aggregation functions.
+
+    Returns:
+        pd.DataFrame: The aggregated columns indexed by the groups.
+    """
+    others = {col: how for col, how in aggregations.items() if how != "nunique"}
+    if others:
+        grouped = network.groupby(by, observed=False).agg(others)
+    else:
+        grouped = network[by].groupby(by, observed=False).size().to_frame()
+    for col, how in aggregations.items():
+        if how != "nunique":
+            continue
+        # Both cover every key combination in groupby order
+        distinct, rows = count_distinct(network, by, column=col)
+        grouped[col] = np.where(rows.to_numpy() > 0, distinct.to_numpy(), np.nan)
+    return grouped[list(aggregations)]
+
+
 def map_bounds(network):
     """
     Calculates the bounds for a heatmap.
@@ -86,11 +247,194 @@ def normalize_range(array, x, y):
 
 # Helper function to read data
 def read_data(path):
-    data = pd.read_csv(f"{path}", index_col=0)
-    data = data.infer_objects()
-    if "Mobility mode" in data.columns:
-        data["Mobility mode"] = pd.Categorical(data["Mobility mode"], ordered=True)
-    return data
+    return us.read_dataset(path)
+
+
+def _dataset_columns(dataset_name):
+    """
+    Returns every column any variable reads from a dataset.
+
+    The dataset is cached with these columns only, so that all variables of the
+    dataset share one cache entry. Returns None for datasets that are always
+    read in full.
+    """
+    columns = []
+    for name, cols in uc.FROM_VAR_TO_DATA_COLS.values():
+        if name == dataset_name:
+            columns.extend(col for col in cols if col not in columns)
+    return columns or None
+
+
+def _cached_dataset(
+    area, demand, season, time, situation, optimization, dataset_name, columns=None
+):
+    """
+    Returns the requested columns of a scenario dataset through the dataset cache.
+
+    Scenarios aggregated before the emission cube existed get their cube built
+    from the emission dataset, and the built cube is cached in its place. With
+    DATASET_MEMORY_MAP, the decoded datasets are memory-mapped from the copies
+    store.map_dataset keeps, and the columns are not copied.
+    """
+    folder = us.scenario_folder(
+        area=area,
+        demand=demand,
+        season=season,
+        time=time,
+        situation=situation,
+        optimization=optimization,
+    )
+    key = (
+        area.lower(),
+        demand.lower(),
+        season.lower(),
+        time.lower(),
+        situation.lower(),
+        optimization,
+        dataset_name,
+    )
+    path = us.dataset_path(folder, dataset_name)
+
+    def load(path):
+        return us.read_dataset(path, columns=_dataset_columns(dataset_name))
+
+    if dataset_name == uc.CUBE_DATASET and not os.path.isfile(path):
+        emission_dataset_name, _ = uc.FROM_VAR_TO_DATA_COLS["Carbon dioxide"]
+        path = us.dataset_path(folder, emission_dataset_name)
+
+        def load(path):
+            emissions = us.read_dataset(
+                path, columns=_dataset_columns(emission_dataset_name)
+            )
+            return _merge_cube_parts([_cube_part(emissions)])
+
+    if uc.DATASET_MEMORY_MAP:
+        decode = load
+
+        def load(path):
+            return us.map_dataset(path, dataset_name, decode)
+
+    dataset = dataset_cache.get(key, path, load)
+    # Callers get their own frame sharing the cached columns, so adding or
+    # replacing columns never changes the cached dataset
+    dataset = dataset.copy(deep=False)
+    if columns is None:
+        return dataset
+    return pd.DataFrame(
+        {col: dataset[col] for col in columns if col in dataset.columns},
+        index=dataset.index,
+        copy=False,
+    )
+
+
+def _cube_part(emissions):
+    """
+    Aggregates emission rows per second, edge and mobility mode.
+
+    Rows on internal junction lanes, which have no edge, are kept in groups of
+    their own, so the measures of the cube add up to those of the rows.
+
+    Args:
+        emissions (pd.DataFrame): Emission rows, or a batch of them.
+
+    Returns:
+        pd.DataFrame: The sums of the measures, the number of rows and of distinct
+                      vehicles, and the edge coordinates and name per group.
+    """
+    aggregations = {
+        col: (col, "sum") for col in uc.CUBE_MEASURES if col in emissions.columns
+    }
+    aggregations["Rows"] = ("Simulation timestep", "size")
+    aggregations["Vehicles"] = ("Vehicle", "nunique")
+    for col in ["Longitude", "Latitude", "Name"]:
+        aggregations[col] = (col, "first")
+    return (
+        emissions.groupby(uc.CUBE_KEYS, observed=True, dropna=False)
+        .agg(**aggregations)
+        .reset_index()
+    )
+
+
+def _merge_cube_parts(parts):
+    """
+    Combines cube parts aggregated from consecutive batches into one cube.
+
+    A vehicle is reported at most once per second, so the distinct vehicle
+    counts of parts split within a second add up.
+
+    Args:
+        parts (list): DataFrames from _cube_part.
+
+    Returns:
+        pd.DataFrame: The emission cube.
+    """
+    cube = _concat_batches(parts)
+    if len(parts) == 1:
+        return cube
+    aggregations = {
+        col: "first" if col in ["Longitude", "Latitude", "Name"] else "sum"
+        for col in cube.columns
+        if col not in uc.CUBE_KEYS
+    }
+    return (
+        cube.groupby(uc.CUBE_KEYS, observed=True, dropna=False)
+        .agg(aggregations)
+        .reset_index()
+    )
+
+
+def _with_cube_parts(batches, parts):
+    """Passes the emission batches through, collecting their cube parts."""
+    for batch in batches:
+        parts.append(_cube_part(batch))
+        yield batch
+
+
+def get_cube(
+    area="kamppi",
+    demand="regular",
+    season="summer",
+    time="weekday",
+    situation="baseline",
+    optimization=0,
+):
+    """
+    Returns the emission cube of a scenario, aggregated per second, edge and mobility mode.
+    """
+    return _cached_dataset(
+        area, demand, season, time, situation, optimization, uc.CUBE_DATASET
+    )
+
+
+def rollup_cube(cube, timestep_range, aggregations):
+    """
+    Rolls the emission cube up to timesteps of the given range per edge.
+
+    Gives the same result as grouping the emission rows by timestep and edge,
+    at a fraction of the rows.
+
+    Args:
+        cube (pd.DataFrame): The emission cube from get_cube.
+        timestep_range (int): The timestep range in minutes.
+        aggregations (dict): Measures mapped to "sum" or "mean".
+
+    Returns:
+        pd.DataFrame: The aggregated measures with the edge coordinates and name per timestep and edge.
+    """
+    cube = new_timeline(network=cube, timestep_range=timestep_range)
+    # The map only shows edges, so the rows of internal lanes are left out
+    cube = cube[cube["Edge"].notna()]
+    sums = {col: "sum" for col in aggregations}
+    sums["Rows"] = "sum"
+    sums.update({"Longitude": "first", "Latitude": "first", "Name": "first"})
+    rolled = (
+        cube.groupby(["Timestep", "Edge"], observed=False).agg(sums).reset_index()
+    )
+    rows = rolled["Rows"].where(rolled["Rows"] > 0)
+    for col, how in aggregations.items():
+        if how == "mean":
+            rolled[col] = rolled[col] / rows
+    return rolled.drop(columns="Rows")
 
 
 # Datasets and column types
@@ -105,70 +449,159 @@ def get_data(
 ):
     """
     Slices the required data from the dataset written on the disk.
+
+    Only the columns the variables of the dataset need are read, and the
+    datasets are kept in dataset_cache until their files change.
     """
     dataset_name, dataset_cols = uc.FROM_VAR_TO_DATA_COLS[variable]
-    if situation.lower() == "optimized":
-        output_path = os.path.join(
-            # ".",
-            "simulation",
-            "scenarios",
-            f"{area.lower()}",
-            f"{demand.lower()}_{season.lower()}_{time.lower()}",
-            f"{situation.lower()}_{uc.OPTIMIZATION_SLIDER_VALUES[optimization]}",
-            f"{dataset_name}.csv.gz",
-        )
-    else:
-        output_path = os.path.join(
-            # ".",
-            "simulation",
-            "scenarios",
-            f"{area.lower()}",
-            f"{demand.lower()}_{season.lower()}_{time.lower()}",
-            f"{situation.lower()}",
-            f"{dataset_name}.csv.gz",
-        )
-    dataset = read_data(output_path)[dataset_cols]
+    scenario = (area, demand, season, time, situation, optimization)
+    dataset = _cached_dataset(*scenario, dataset_name, dataset_cols)
     # print(dataset.head())
     if "noise" in dataset_name:
-        helper_dataset_name, _ = uc.FROM_VAR_TO_DATA_COLS["Carbon dioxide"]
-        if situation == "optimized":
-            helper_output_path = os.path.join(
-                # ".",
-                "simulation",
-                "scenarios",
-                f"{area.lower()}",
-                f"{demand.lower()}_{season.lower()}_{time.lower()}",
-                f"{situation.lower()}_{uc.OPTIMIZATION_SLIDER_VALUES[optimization]}",
-                f"{helper_dataset_name}.csv.gz",
-            )
-        else:
-            helper_output_path = os.path.join(
-                # ".",
-                "simulation",
-                "scenarios",
-                f"{area.lower()}",
-                f"{demand.lower()}_{season.lower()}_{time.lower()}",
-                f"{situation.lower()}",
-                f"{helper_dataset_name}.csv.gz",
-            )
-        helper_dataset = read_data(helper_output_path)
-        helper_dataset = helper_dataset[
-            ["Simulation timestep", "Edge", "Mobility flow"]
-        ]
+        helper_dataset = _cached_dataset(
+            *scenario,
+            uc.CUBE_DATASET,
+            ["Simulation timestep", "Edge", "Mobility flow"],
+        )
         helper_dataset = (
-            helper_dataset.groupby(["Simulation timestep", "Edge"])
+            helper_dataset.groupby(["Simulation timestep", "Edge"], observed=True)
             .agg({"Mobility flow": "sum"})
             .reset_index()
         )
         dataset = dataset.merge(
             right=helper_dataset, on=["Simulation timestep", "Edge"]
         )
+        # Edges without vehicles are merged away, and must not come back as
+        # empty groups of the categorical Edge
+        if isinstance(dataset["Edge"].dtype, pd.CategoricalDtype):
+            dataset["Edge"] = dataset["Edge"].cat.remove_unused_categories()
     return dataset
 
 
-def create_heatmap(network, variable):
-    """Creates an animated heatmap for with a capability to drilldown on a specific point."""
-    legend_max = 1.75 * network[network[variable] != 0][variable].median()
+def get_kpis(
+    area="kamppi",
+    demand="regular",
+    season="summer",
+    time="weekday",
+    situation="baseline",
+    optimization=0,
+):
+    """
+    Returns the KPIs of a scenario from its sidecar.
+
+    The KPIs of scenarios aggregated before the sidecars existed are computed
+    from their datasets instead, see store.migrate_scenarios to write them.
+
+    Returns:
+        dict: The KPIs from store.scenario_kpis.
+    """
+    folder = us.scenario_folder(
+        area=area,
+        demand=demand,
+        season=season,
+        time=time,
+        situation=situation,
+        optimization=optimization,
+    )
+    kpis = us.read_kpis(folder)
+    if kpis is None:
+        kpis = us.scenario_kpis(folder)
+    return kpis
+
+
+def trip_kpis(kpis):
+    """Returns the trip KPIs of a scenario per mobility mode as a DataFrame."""
+    network = pd.DataFrame(
+        kpis["trips"],
+        columns=["Mobility mode", "Trips", "Mobility flow", "Travel time", "Lost time"],
+    )
+    network["Travel time"] = network["Travel time"].astype(np.float64)
+    network["Lost time"] = network["Lost time"].astype(np.float64)
+    return network
+
+
+def data_version(area, demand, season, time, optimization):
+    """
+    Returns the version of a scenario's baseline and optimized datasets.
+
+    The version changes whenever the datasets of either situation are written
+    again, see store.folder_version.
+    """
+    return us.folder_version(
+        *(
+            us.scenario_folder(
+                area=area,
+                demand=demand,
+                season=season,
+                time=time,
+                situation=situation,
+                optimization=optimization,
+            )
+            for situation in ["baseline", "optimized"]
+        )
+    )
+
+
+def preload_scenario(
+    area="kamppi",
+    demand="regular",
+    season="summer",
+    time="weekday",
+    situation="baseline",
+    optimization=0,
+):
+    """
+    Loads every dataset of a scenario into dataset_cache ahead of the requests.
+
+    Returns:
+        list: The names of the loaded datasets, datasets the scenario does not
+              have are skipped.
+    """
+    dataset_names = dict.fromkeys(
+        [dataset_name for dataset_name, _ in uc.FROM_VAR_TO_DATA_COLS.values()]
+        + [uc.CUBE_DATASET]
+    )
+    loaded = []
+    for dataset_name in dataset_names:
+        try:
+            _cached_dataset(
+                area, demand, season, time, situation, optimization, dataset_name, []
+            )
+        except FileNotFoundError:
+            continue
+        loaded.append(dataset_name)
+    return loaded
+
+
+def create_heatmap(
+    network,
+    variable,
+    rendering=uc.HEATMAP_RENDERING,
+    legend_max=None,
+    bounds=None,
+    animated=True,
+):
+    """
+    Creates an animated heatmap for with a capability to drilldown on a specific point.
+
+    With the raster rendering, the frames are rendered into images on the
+    server instead of being drawn by the browser from every row. Without
+    animation, the heatmap shows the rows as one frame, see create_lazy_heatmap.
+
+    Args:
+        network (pd.DataFrame): The heatmap rows per Timestep and Edge.
+        variable (str): The variable to draw.
+        rendering (str): density or raster.
+        legend_max (float): The value of the last colour, from the rows by default.
+        bounds (dict): The map bounds, from the rows by default.
+        animated (bool): Whether to animate the Timestep frames with a slider.
+    """
+    if legend_max is None:
+        legend_max = 1.75 * network[network[variable] != 0][variable].median()
+    if bounds is None:
+        bounds = map_bounds(network=network)
+    if rendering == "raster":
+        return _create_raster_heatmap(network, variable, legend_max, bounds, animated)
     heatmap = px.density_map(
         data_frame=network,
         lat="Latitude",
@@ -185,8 +618,9 @@ def create_heatmap(network, variable):
             "Latitude": False,
             variable: True,
         },
-        animation_frame="Timestep",
+        animation_frame="Timestep" if animated else None,
         title=f"{variable.capitalize()} heatmap",
+        template=_template(),
     )
     # Customize the sliders with a larger font size and prefix
     sliders = [
@@ -199,14 +633,198 @@ def create_heatmap(network, variable):
     # Update points' opacity on click
     heatmap.update_layout(
         clickmode="event+select",
-        sliders=sliders,
-        map_bounds=map_bounds(network=network),
+        map_bounds=bounds,
         title_x=0.5,
     )
+    if animated:
+        heatmap.update_layout(sliders=sliders)
     heatmap.update_coloraxes(colorbar_title_text = f"{uc.UNITS[variable]}")
     return heatmap
 
 
+def _create_raster_heatmap(network, variable, legend_max, bounds, animated=True):
+    """Creates an animated heatmap of images rendered on the server."""
+    frames, coordinates = uraster.rasterize_frames(
+        network, variable, bounds, span=(0, legend_max)
+    )
+
+    def layers(source):
+        return [
+            dict(
+                sourcetype="image",
+                source=source,
+                coordinates=coordinates,
+                below="traces",
+                opacity=0.8,
+            )
+        ]
+
+    # Invisible edge markers keep the hovers, drilldown clicks and colour bar
+    edges = network.drop_duplicates("Edge")
+    heatmap = go.Figure(
+        go.Scattermap(
+            lat=edges["Latitude"],
+            lon=edges["Longitude"],
+            mode="markers",
+            customdata=edges[["Name", "Edge"]],
+            hovertemplate="%{customdata[0]}<extra></extra>",
+            marker=dict(
+                size=12,
+                opacity=0,
+                color=np.zeros(len(edges)),
+                cmin=0,
+                cmax=legend_max,
+                colorscale="Plasma",
+                showscale=True,
+                colorbar=dict(title=dict(text=f"{uc.UNITS[variable]}")),
+            ),
+        ),
+        layout=dict(template=_template()),
+    )
+    heatmap.update_layout(
+        clickmode="event+select",
+        map=dict(
+            style="open-street-map",
+            bounds=bounds,
+            layers=layers(frames[0][1]) if frames else [],
+        ),
+        title=f"{variable.capitalize()} heatmap",
+        title_x=0.5,
+    )
+    if not animated:
+        return heatmap
+    heatmap.frames = [
+        go.Frame(name=str(timestep), layout=dict(map=dict(layers=layers(source))))
+        for timestep, source in frames
+    ]
+    animation = {"frame": {"duration": 500, "redraw": True}, "mode": "immediate"}
+    sliders = [
+        dict(
+            currentvalue={"prefix": "Time (in minutes): "},
+            font={"size": 14},
+            pad={"t": 50},
+            steps=[
+                dict(
+                    label=str(timestep),
+                    method="animate",
+                    args=[[str(timestep)], animation],
+                )
+                for timestep, _ in frames
+            ],
+        )
+    ]
+    heatmap.update_layout(
+        sliders=sliders,
+        updatemenus=[
+            dict(
+                type="buttons",
+                direction="left",
+                x=0.1,
+                y=0,
+                pad={"r": 10, "t": 70},
+                buttons=[
+                    dict(label="&#9654;", method="animate", args=[None, animation]),
+                    dict(
+                        label="&#9724;",
+                        method="animate",
+                        args=[[None], {**animation, "frame": {"duration": 0}}],
+                    ),
+                ],
+            )
+        ],
+    )
+    return heatmap
+
+
+def _timestep_codes(network):
+    """Returns the Timestep code of every row and the Timestep categories."""
+    timesteps = network["Timestep"]
+    if not isinstance(timesteps.dtype, pd.CategoricalDtype):
+        timesteps = timesteps.astype("category")
+    return timesteps.cat.codes.to_numpy(), timesteps.cat.categories
+
+
+def create_lazy_heatmap(network, variable, rendering=uc.HEATMAP_RENDERING):
+    """
+    Creates the first frame of a heatmap whose other frames are sent when shown.
+
+    The rows are registered in utils.frames so any server process can draw the
+    other frames with heatmap_frame. The colours and bounds come from all
+    frames, so they stay the same when the frame changes.
+
+    Args:
+        network (pd.DataFrame): The heatmap rows per Timestep and Edge.
+        variable (str): The variable to draw.
+        rendering (str): density or raster.
+
+    Returns:
+        tuple: The first frame as a figure dictionary and the heatmap state for
+               heatmap_frame, with the label of every frame under timesteps.
+    """
+    codes, categories = _timestep_codes(network)
+    present = np.unique(codes[codes >= 0])
+    state = {
+        "key": uf.register(network, variable, rendering),
+        "variable": variable,
+        "rendering": rendering,
+        "legend_max": float(
+            1.75 * network[network[variable] != 0][variable].median()
+        ),
+        "bounds": {
+            side: float(bound) for side, bound in map_bounds(network=network).items()
+        },
+        "codes": present.tolist(),
+        "timesteps": [str(category) for category in categories[present]],
+    }
+    return heatmap_frame(state, 0) or {}, state
+
+
+def heatmap_frame(state, index, prefetch=uc.HEATMAP_FRAME_PREFETCH):
+    """
+    Returns one frame of a lazily delivered heatmap.
+
+    Frames are kept serialized in utils.frames.frame_cache, and the frames on
+    either side of the shown one are rendered in the background.
+
+    Args:
+        state (dict): The heatmap state from create_lazy_heatmap.
+        index (int): The position of the frame.
+        prefetch (int): The number of frames on either side rendered ahead.
+
+    Returns:
+        dict: The frame as a figure dictionary, None if there is no such frame
+              or the heatmap rows have been removed.
+    """
+    if not 0 <= index < len(state["codes"]):
+        return None
+    network = uf.load(state["key"])
+    if network is None:
+        return None
+    codes, _ = _timestep_codes(network)
+
+    def render(position):
+        def draw():
+            heatmap = create_heatmap(
+                network[codes == state["codes"][position]],
+                state["variable"],
+                rendering=state["rendering"],
+                legend_max=state["legend_max"],
+                bounds=state["bounds"],
+                animated=False,
+            )
+            # Keep the zoom and selections of the map when the frame changes
+            heatmap.update_layout(uirevision=state["key"])
+            return heatmap.to_json()
+
+        return draw
+
+    frame = uf.frame_cache.get(f"{state['key']}-{index}", render(index))
+    for position in range(index - prefetch, index + prefetch + 1):
+        if position != index and 0 <= position < len(state["codes"]):
+            uf.prefetch(f"{state['key']}-{position}", render(position))
+    return json.loads(frame)
+
+
 def create_mobility_mode_avg_bar_plot(network, variable):
     """Creates a horizontal mobility mode -specific bar plot of averages."""
     bar_plot = px.bar(
@@ -214,6 +832,7 @@ def create_mobility_mode_avg_bar_plot(network, variable):
         x=variable,
         y="Mobility mode",
         title=f"Average {variable.lower()} per mobility mode",
+        template=_template(),
     )
     # Customize the hovers, title, axis labels and legend
     bar_plot.update_layout(
@@ -245,6 +864,7 @@ def create_traffic_situation_bar_plot(
         color="Situation",
         title=title,
         barmode="group",
+        template=_template(),
     )
     # Customize the hovers, title, axis labels and legend
     bar_plot.update_layout(
@@ -275,6 +895,7 @@ def create_situation_bar_plot(
         y="Situation",
         title=title,
         barmode="group",
+        template=_template(),
     )
     # Customize the hovers, title, axis labels and legend
     bar_plot.update_layout(
@@ -296,7 +917,8 @@ def create_area_chart(network, variable):
         y=variable,
         color="Mobility mode",
         title="Mobility mode time series",
-        labels={"Vehicle": "Mobility flow"}
+        labels={"Vehicle": "Mobility flow"},
+        template=_template(),
     )
     # Customize the title and yaxis
     area_plot.update_layout(
@@ -310,7 +932,11 @@ def create_area_chart(network, variable):
 def create_mobility_mode_histogram(network, variable):
     """Creates a mobility mode -specific histogram."""
     histogram = px.histogram(
-        data_frame=network, x=variable, color="Mobility mode", barmode="overlay"
+        data_frame=network,
+        x=variable,
+        color="Mobility mode",
+        barmode="overlay",
+        template=_template(),
     )
     # Update the axis labels and the bars' gap
     histogram.update_layout(
@@ -335,68 +961,6 @@ def _vehicle(
     return f"""\t<vType id="{type}" accel="{accel}" decel="{decel}" sigma="{sigma}" length="{length}" maxSpeed="{maxSpeed}" emissionClass="{emissionClass}"/>\n"""
 
 
-def _trip(
-    id,
-    departureTime,
-    origin,
-    destination,
-    type="fuel",
-):
-    return f"""\t<trip id="test_trip_{id}" type="{type}" depart="{departureTime}" from="{origin}" to="{destination}"/>\n"""
-
-
-def _random_trips(
-    f,
-    net,
-    cars=3000,
-    trip_start=0,
-    trip_end=3200,
-    electrify=0.2,
-):
-    edges = net.getEdges()
-    numberOfEdges = len(edges)
-    f.write(_vehicle())
-    if electrify > 0:
-        f.write(_vehicle(type="electric", emissionClass="HBEFA4/PC_BEV"))
-    departures = random.sample(range(trip_start, trip_end), cars)
-    fuel = np.full(round(cars * (1.0 - electrify)), False, dtype=bool)
-    electric = np.full(cars - len(fuel), True, dtype=bool)
-    electric_generator = np.concatenate((fuel, electric))
-    np.random.shuffle(electric_generator)
-    departures = np.sort(departures)
-    i = 0
-    for departure in departures:
-        path = None
-        # Keep trying until there exists a path between the random origin and destination
-        while path is None:
-            originEdgeStruct = edges[random.randint(0, numberOfEdges - 1)]
-            destinationEdgeStruct = edges[random.randint(0, numberOfEdges - 1)]
-            path = net.getShortestPath(originEdgeStruct, destinationEdgeStruct)[0]
-        originEdge = originEdgeStruct._id
-        destinationEdge = destinationEdgeStruct._id
-        strIndex = str(i)
-        if electric_generator[i]:
-            f.write(
-                _trip(
-                    id=strIndex,
-                    departureTime=departure,
-                    origin=originEdge,
-                    destination=destinationEdge,
-                    type="electric",
-                )
-            )
-        else:
-            f.write(
-                _trip(
-                    id=strIndex,
-                    departureTime=departure,
-                    origin=originEdge,
-                    destination=destinationEdge,
-                )
-            )
-        i += 1
-
-
 def _write_route_file(
     net_file_path,
     rou_file_path,
@@ -404,41 +968,417 @@ def _write_route_file(
     season,
     day,
     seed,
+    routing_workers=uc.ROUTING_WORKERS,
 ):
-    net = sumolib.net.readNet(net_file_path)
-    random.seed(seed)
-    np.random.seed(seed)
+    """
+    Writes the random trips of a scenario into a route file.
 
-    with open(rou_file_path, "w") as f:
-        f.write("""<?xml version="1.0" encoding="UTF-8"?>\n<routes>\n""")
-        _random_trips(f=f, net=net, seed=seed, season=season, demand=demand, day=day)
-        f.write("""</routes>""")
+    The number and departure times of the trips follow the hourly demand
+    profile of the demand level, season and time of week. With PRE_ROUTE the
+    trips are written as vehicles with their routes.
+
+    Args:
+        net_file_path (str): the net file path.
+        rou_file_path (str): the route file path, gzip-compressed if it ends
+                             with .gz.
+        demand (str): the amount of mobility that is simulated.
+        season (str): the season that is simulated.
+        day (str): the time of week that is simulated, weekday or weekend.
+        seed (int): the seed of the random demand.
+        routing_workers (int): the processes that compute the routes.
+    """
+    network = un.load_network(net_file_path)
+    trips = ud.generate_trips(
+        network, demand=demand, season=season, day=day, seed=seed
+    )
+    if uc.PRE_ROUTE:
+        trips = ur.route_trips(network, trips, workers=routing_workers)
+    vehicle_types = [
+        _vehicle(),
+        _vehicle(type="electric", emissionClass="HBEFA4/PC_BEV"),
+    ]
+    ud.write_route_file(trips, rou_file_path, vehicle_types)
 
 
-# Helper function to safely get attributes and convert types
-def _get_attributes(element, attributes_map):
+class _ColumnarBatch:
     """
-    Extracts attributes from an XML element and converts them to specified types.
+    Accumulates parsed XML elements column by column instead of row by row.
+
+    Raw attribute values are buffered per column and converted in one vectorized
+    pass per batch: numeric attributes into float64 arrays and string attributes
+    into int32 codes of per-column dictionaries. The dictionaries persist across
+    clear(), so consecutive batches of the same file share codes. Passing the
+    scenario's shared dictionaries makes the columns of DICTIONARY_COLUMNS share
+    codes across files too.
 
     Args:
-        element (xml.etree.ElementTree.Element): The XML element to process.
         attributes_map (dict): A dictionary where keys are desired DataFrame column
                                names and values are tuples of (xml_attribute_name, type_constructor).
+        extra_columns (dict): Columns whose values are passed to append() in order,
+                              mapped to their type constructors.
+        constants (dict): Columns that hold the same value on every row.
+        dictionaries (dict): Shared dictionary names mapped to {value: code} dicts.
+    """
+
+    def __init__(
+        self, attributes_map, extra_columns=None, constants=None, dictionaries=None
+    ):
+        self.attributes_map = attributes_map
+        self.extra_columns = extra_columns or {}
+        self.constants = constants or {}
+        self.types = {
+            col_name: type_func for col_name, (_, type_func) in attributes_map.items()
+        }
+        self.types.update(self.extra_columns)
+        shared = dictionaries if dictionaries is not None else {}
+        self.dictionaries = {
+            col_name: shared.setdefault(uc.DICTIONARY_COLUMNS[col_name], {})
+            if col_name in uc.DICTIONARY_COLUMNS
+            else {}
+            for col_name, type_func in self.types.items()
+            if type_func is str
+        }
+        self._values = {col_name: [] for col_name in self.types}
+        self._attribute_columns = [
+            (xml_attr, self._values[col_name].append)
+            for col_name, (xml_attr, _) in attributes_map.items()
+        ]
+        self._extra_columns = [
+            self._values[col_name].append for col_name in self.extra_columns
+        ]
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def clear(self):
+        """Drops the accumulated rows but keeps the string dictionaries."""
+        for values in self._values.values():
+            del values[:]
+        self._length = 0
+
+    def append(self, element, *extras):
+        """
+        Appends the attributes of one XML element and the given extra values.
+
+        Args:
+            element (xml.etree.ElementTree.Element): The XML element to process,
+                                                     or None for an all-missing row.
+            *extras: Values of extra_columns, in order.
+        """
+        if element is None:
+            for _, append_value in self._attribute_columns:
+                append_value(None)  # Element not present
+        else:
+            get = element.get
+            for xml_attr, append_value in self._attribute_columns:
+                append_value(get(xml_attr))
+        for append_value, value in zip(self._extra_columns, extras):
+            append_value(value)
+        self._length += 1
+
+    def categories(self, col_name):
+        """Returns the dictionary values of a string column in code order."""
+        return list(self.dictionaries[col_name])
+
+    def codes(self, col_name):
+        """
+        Encodes the buffered values of a string column against its dictionary.
+
+        Returns:
+            np.ndarray: int32 codes, -1 where the attribute was not present.
+        """
+        dictionary = self.dictionaries[col_name]
+        codes, uniques = pd.factorize(
+            pd.Series(self._values[col_name], dtype=object), use_na_sentinel=True
+        )
+        # Map the batch-local codes onto the persistent dictionary
+        lookup = np.array(
+            [dictionary.setdefault(value, len(dictionary)) for value in uniques]
+            + [-1],
+            dtype=np.int32,
+        )
+        return lookup[codes]
+
+    def numbers(self, col_name):
+        """
+        Converts the buffered values of a numeric column.
+
+        Returns:
+            np.ndarray: float64 values, NaN where the attribute was missing or
+                        could not be converted. int columns without missing
+                        values are returned as int64.
+        """
+        try:
+            values = np.array(self._values[col_name], dtype=np.float64)
+        except (ValueError, TypeError):
+            # Missing attributes or conversion errors, convert value by value
+            values = pd.to_numeric(
+                pd.Series(self._values[col_name], dtype=object), errors="coerce"
+            ).to_numpy(dtype=np.float64, na_value=np.nan)
+        if self.types[col_name] is int and not np.isnan(values).any():
+            return values.astype(np.int64)
+        return values
+
+    def to_frame(self):
+        """
+        Returns the accumulated rows as a DataFrame.
+
+        Returns:
+            pd.DataFrame: Numeric columns as float64 and string columns as categoricals.
+        """
+        data = {}
+        for col_name in self.types:
+            if col_name in self.dictionaries:
+                data[col_name] = pd.Categorical.from_codes(
+                    self.codes(col_name), categories=self.categories(col_name)
+                )
+            else:
+                data[col_name] = self.numbers(col_name)
+        for col_name, value in self.constants.items():
+            data[col_name] = np.full(self._length, value)
+        return pd.DataFrame(data, index=pd.RangeIndex(self._length))
+
+    def to_record_batch(self):
+        """
+        Returns the accumulated rows as an Arrow record batch.
+
+        Returns:
+            pyarrow.RecordBatch: Numeric columns as float64 and string columns dictionary-encoded.
+        """
+        import pyarrow as pa
+
+        arrays = []
+        for col_name in self.types:
+            if col_name in self.dictionaries:
+                codes = self.codes(col_name)
+                arrays.append(
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(codes, mask=codes < 0),
+                        pa.array(self.categories(col_name), type=pa.string()),
+                    )
+                )
+            else:
+                arrays.append(pa.array(self.numbers(col_name)))
+        for value in self.constants.values():
+            arrays.append(pa.array(np.full(self._length, value)))
+        return pa.RecordBatch.from_arrays(
+            arrays, names=list(self.types) + list(self.constants)
+        )
+
+
+def _flush(batch):
+    """Returns the batch as a DataFrame and empties it."""
+    batch_df = batch.to_frame()
+    batch.clear()
+    return batch_df
+
+
+class _XmlRange(io.RawIOBase):
+    """
+    Reads a range of whole records of an uncompressed XML file as a document.
+
+    The file header (XML declaration and root start tag) is read first, then the
+    records of the range, then a closing root tag unless the range runs to the
+    end of the file and so holds the real one.
+
+    Args:
+        file_path (str): Path to the .xml file.
+        byte_range (tuple): (header_end, start, end) byte offsets, see _split_xml.
+    """
+
+    def __init__(self, file_path, byte_range):
+        self._file = open(file_path, "rb")
+        header_end, start, end = byte_range
+        header = self._file.read(header_end)
+        suffix = b""
+        if end < os.path.getsize(file_path):
+            parser = ET.XMLPullParser(events=("start",))
+            parser.feed(header)
+            _, root = next(parser.read_events())
+            suffix = f"</{root.tag}>".encode()
+        self._file.seek(start)
+        self._pending = header
+        self._remaining = end - start
+        self._suffix = suffix
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            if self._remaining > 0:
+                self._pending = self._file.read(min(len(buffer), self._remaining))
+                self._remaining -= len(self._pending)
+            else:
+                self._pending, self._suffix = self._suffix, b""
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _open_xml(file_path, byte_range=None):
+    """
+    Opens a raw or gzipped SUMO XML output file for binary reading.
+
+    Args:
+        file_path (str): Path to the .xml or .xml.gz file.
+        byte_range (tuple): Only read this range of records of an uncompressed
+                            file, see _split_xml.
 
     Returns:
-        dict: A dictionary of extracted and converted attribute values.
-    """
-    data = {}
-    for col_name, (xml_attr, type_func) in attributes_map.items():
-        value = element.get(xml_attr)
-        if value is not None:
-            try:
-                data[col_name] = type_func(value)
-            except (ValueError, TypeError):
-                data[col_name] = None  # Handle conversion errors
+        file object: A binary file object positioned at the start of the document.
+    """
+    if byte_range is not None:
+        return io.BufferedReader(_XmlRange(file_path, byte_range))
+    if str(file_path).endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def _split_xml(file_path, tag, parts, min_bytes=uc.XML_SPLIT_MIN_BYTES):
+    """
+    Splits an uncompressed XML file into byte ranges of whole records.
+
+    Every range starts at a <tag> start tag, so that each range can be parsed on
+    its own with _open_xml. Gzipped files and files smaller than min_bytes are
+    not split.
+
+    Args:
+        file_path (str): Path to the .xml file.
+        tag (str): The record element, a direct child of the root, eg. timestep.
+        parts (int): The number of ranges to aim for.
+        min_bytes (int): The smallest size of a range.
+
+    Returns:
+        list: (header_end, start, end) byte offsets per range in file order, or
+              [None] if the file is not split.
+    """
+    size = os.path.getsize(file_path)
+    parts = min(parts, size // max(min_bytes, 1))
+    if str(file_path).endswith(".gz") or parts < 2:
+        return [None]
+    # The character after the tag name tells <tag> from <tagname>
+    pattern = re.compile(rb"<" + re.escape(tag.encode()) + rb"[\s/>]")
+    starts = []
+    with open(file_path, "rb") as source:
+        for part in range(parts):
+            position = size * part // parts
+            source.seek(position)
+            window = b""
+            while True:
+                chunk = source.read(1 << 20)
+                window += chunk
+                match = pattern.search(window)
+                if match or not chunk:
+                    break
+            if match:
+                starts.append(position + match.start())
+    starts = sorted(set(starts))
+    if len(starts) < 2:
+        return [None]
+    ends = starts[1:] + [size]
+    return [(starts[0], start, end) for start, end in zip(starts, ends)]
+
+
+def _iterparse(file_path, byte_range=None):
+    """
+    Incrementally parses a SUMO XML output file without building the whole tree.
+
+    Yields ("start", element) and ("end", element) pairs. Once a direct child of
+    the root element has ended, the root is cleared so that the consumed subtree
+    can be garbage collected. Callers should extract what they need from an
+    element before advancing the generator.
+
+    Args:
+        file_path (str): Path to the .xml or .xml.gz file.
+        byte_range (tuple): Only parse this range of records, see _split_xml.
+
+    Yields:
+        tuple: (event, xml.etree.ElementTree.Element)
+    """
+    with _open_xml(file_path, byte_range) as source:
+        context = ET.iterparse(source, events=("start", "end"))
+        _, root = next(context)
+        depth = 0
+        for event, element in context:
+            if event == "start":
+                depth += 1
+                yield event, element
+            else:
+                depth -= 1
+                yield event, element
+                if depth == 0:
+                    root.clear()
+
+
+def _concat_batches(batches):
+    """Concatenates DataFrame batches into one DataFrame with a fresh index."""
+    batches = list(batches)
+    if not batches:
+        return pd.DataFrame()
+    # Dictionaries only grow, so the last batch of a file holds every category
+    # in code order. Batches parsed in other processes add their own categories.
+    last_batch = batches[-1]
+    for col_name in last_batch.select_dtypes("category").columns:
+        categories = last_batch[col_name].cat.categories
+        for batch in batches[:-1]:
+            if isinstance(batch[col_name].dtype, pd.CategoricalDtype):
+                extra = batch[col_name].cat.categories.difference(
+                    categories, sort=False
+                )
+                categories = categories.append(extra)
+        for batch in batches:
+            column = batch[col_name]
+            if isinstance(
+                column.dtype, pd.CategoricalDtype
+            ) and not column.cat.categories.equals(categories):
+                batch[col_name] = column.cat.set_categories(categories)
+    return pd.concat(batches, ignore_index=True)
+
+
+def _join_net(batch_df, net_df, on):
+    """
+    Left-joins network columns onto a batch by integer positions.
+
+    Equivalent to batch_df.merge(net_df, on=on, how="left") for a net_df that is
+    unique on the key, but the key is matched once per category instead of
+    once per row.
+
+    Args:
+        batch_df (pd.DataFrame): A parsed batch with a categorical key column.
+        net_df (pd.DataFrame): The network columns, unique on the key.
+        on (str): The key column, eg. Lane or Edge.
+
+    Returns:
+        pd.DataFrame: The batch with the network columns appended.
+    """
+    key = batch_df[on]
+    if not isinstance(key.dtype, pd.CategoricalDtype):
+        return batch_df.merge(net_df, on=on, how="left")
+    # Row of net_df per category, -1 for categories missing from the network
+    lookup = pd.Index(net_df[on]).get_indexer(key.cat.categories)
+    rows = np.append(lookup, -1)[key.cat.codes.to_numpy()]
+    missing = rows < 0
+    joined = {}
+    for col_name in net_df.columns:
+        if col_name == on:
+            continue
+        column = net_df[col_name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = np.where(missing, -1, column.cat.codes.to_numpy()[rows])
+            joined[col_name] = pd.Categorical.from_codes(
+                codes, dtype=column.dtype
+            )
         else:
-            data[col_name] = None  # Attribute not present
-    return data
+            values = pd.Series(column.to_numpy()[rows])
+            joined[col_name] = values.mask(missing).to_numpy()
+    return batch_df.assign(**joined)
 
 
 # Convert net to csv
@@ -446,76 +1386,52 @@ def _parse_net_xml(net_path):
     """
     Parses a SUMO network XML file (.net.xml) and extracts edge and lane information.
 
+    The network is read through its compiled arrays, see utils.network.load_network.
+
     Args:
         net_path (str): Path to the SUMO network XML file.
 
     Returns:
-        pd.DataFrame: A DataFrame containing network edges, lanes, names, and coordinates.
-    """
-    net = sumolib.net.readNet(net_path)
-    tree = ET.parse(net_path)
-    root = tree.getroot()
-
-    all_lanes_data = []
-
-    for edge in root.iter("edge"):
-        edge_type = edge.get("type")
-
-        # Exclude internal edges
-        if edge_type != "internal" and edge_type is not None:
-            edge_id = edge.get("id")
-            name = edge.get("name") if edge.get("name") is not None else "Unnamed road"
-            shape_str = edge.get("shape")
-
-            lon, lat = None, None
-            if shape_str:
-                points = shape_str.split()
-                if (
-                    len(points) >= 1
-                ):  # Use the first point as a reasonable approximation if only one
-                    # Use midpoint for better representation
-                    center_point_str = points[len(points) // 2]
-                    try:
-                        x, y = map(float, center_point_str.split(","))
-                        lon, lat = net.convertXY2LonLat(x, y)
-                    except ValueError:
-                        # Handle cases where point format is unexpected
-                        pass
-
-            for lane in edge.iter("lane"):
-                lane_id = lane.get("id")
-                all_lanes_data.append(
-                    {
-                        "Edge": edge_id,
-                        "Name": name,
-                        "Longitude": lon,
-                        "Latitude": lat,
-                        "Lane": lane_id,
-                    }
-                )
-
-    net_df = pd.DataFrame(all_lanes_data)
+        pd.DataFrame: A DataFrame containing network edges, lanes, names, and coordinates,
+                      with the strings as categoricals.
+    """
+    network = un.load_network(net_path)
+    # Exclude internal edges and edges without a type
+    typed = (network["edge_type"] != "") & (network["edge_type"] != "internal")
+    lane_edge = np.asarray(network["lane_edge"])
+    lanes = np.flatnonzero(typed[lane_edge])
+    edges = lane_edge[lanes]
+    names = network["edge_name"][edges]
+    net_df = pd.DataFrame(
+        {
+            "Edge": network["edge_id"][edges].astype(object),
+            "Name": np.where(names == "", "Unnamed road", names).astype(object),
+            "Longitude": network["edge_lon"][edges],
+            "Latitude": network["edge_lat"][edges],
+            "Lane": network["lane_id"][lanes].astype(object),
+        }
+    )
+    for col_name in ["Edge", "Name", "Lane"]:
+        net_df[col_name] = net_df[col_name].astype("category")
     return net_df
 
 
 # Aggregate the full xml output
-def _parse_full_output_xml(file_path, net_df):
+def _iter_full_output_xml(
+    file_path, net_df, batch_size=uc.XML_BATCH_SIZE, dictionaries=None
+):
     """
-    Parses a SUMO full output XML file and extracts vehicle and lane data.
+    Streams a SUMO full output XML file in batches of vehicle and lane data.
 
     Args:
         file_path (str): Path to the SUMO full output XML file.
         net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of parsed elements held in memory.
+        dictionaries (dict): The scenario's shared dictionaries, see _ColumnarBatch.
 
-    Returns:
+    Yields:
         tuple: A tuple containing two pandas DataFrames (lane_output_df, vehicle_output_df).
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    all_veh_data = []
-    all_lane_data = []
-
     # Define attribute mappings for vehicles and lanes
     vehicle_attributes = {
         "Vehicle": ("id", str),
@@ -544,126 +1460,209 @@ def _parse_full_output_xml(file_path, net_df):
         "Average speed": ("meanspeed", float),
     }
 
-    for data_point in root.iter("data"):
-        timestep = float(data_point.get("timestep"))
-
-        for vehicle in data_point.iter("vehicle"):
-            veh_info = _get_attributes(vehicle, vehicle_attributes)
-            veh_info["Simulation timestep"] = timestep
-            veh_info["Mobility flow"] = 1  # Constant for vehicle count
-            all_veh_data.append(veh_info)
-
-        for edge in data_point.iter("edge"):
-            edge_id = edge.get("id")
-            edge_traveltime = float(edge.get("traveltime"))
-
-            for lane in edge.iter("lane"):
-                lane_info = _get_attributes(lane, lane_attributes)
-                lane_info["Simulation timestep"] = timestep
-                lane_info["Edge"] = edge_id
-                lane_info["Edge travel time"] = edge_traveltime
-                all_lane_data.append(lane_info)
+    vehicles = _ColumnarBatch(
+        vehicle_attributes,
+        extra_columns={"Simulation timestep": float},
+        constants={"Mobility flow": 1},  # Constant for vehicle count
+        dictionaries=dictionaries,
+    )
+    lanes = _ColumnarBatch(
+        lane_attributes,
+        extra_columns={
+            "Simulation timestep": float,
+            "Edge": str,
+            "Edge travel time": float,
+        },
+        dictionaries=dictionaries,
+    )
 
-    lane_output_df = pd.DataFrame(all_lane_data)
-    vehicle_output_df = pd.DataFrame(all_veh_data)
+    def flush():
+        lane_output_df = _flush(lanes)
+        vehicle_output_df = _flush(vehicles)
+        if not lane_output_df.empty:
+            lane_output_df = _join_net(lane_output_df, net_df, "Lane")
+        return lane_output_df, vehicle_output_df
+
+    timestep = None
+    edge_id, edge_traveltime = None, None
+
+    for event, element in _iterparse(file_path):
+        if event == "start":
+            if element.tag == "data":
+                timestep = float(element.get("timestep"))
+            elif element.tag == "edge":
+                edge_id = element.get("id")
+                edge_traveltime = float(element.get("traveltime"))
+            continue
+
+        if element.tag == "vehicle":
+            vehicles.append(element, timestep)
+            element.clear()
+        elif element.tag == "lane" and edge_id is not None:
+            lanes.append(element, timestep, edge_id, edge_traveltime)
+            element.clear()
+        elif element.tag == "edge":
+            edge_id, edge_traveltime = None, None
+            element.clear()
+
+        if len(vehicles) + len(lanes) >= batch_size:
+            yield flush()
+
+    if len(vehicles) or len(lanes):
+        yield flush()
+
+
+def _parse_full_output_xml(file_path, net_df, batch_size=uc.XML_BATCH_SIZE):
+    """
+    Parses a SUMO full output XML file and extracts vehicle and lane data.
 
-    if not lane_output_df.empty:
-        lane_output_df = lane_output_df.merge(net_df, on="Lane", how="left")
+    Args:
+        file_path (str): Path to the SUMO full output XML file.
+        net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of parsed elements held in memory.
 
+    Returns:
+        tuple: A tuple containing two pandas DataFrames (lane_output_df, vehicle_output_df).
+    """
+    batches = list(_iter_full_output_xml(file_path, net_df, batch_size=batch_size))
+    lane_output_df = _concat_batches(lane_df for lane_df, _ in batches)
+    vehicle_output_df = _concat_batches(vehicle_df for _, vehicle_df in batches)
     return lane_output_df, vehicle_output_df
 
 
 # Aggregate the lane noise output
-def _parse_lane_noise_xml(file_path, net_df):
+def _iter_lane_noise_xml(
+    file_path, net_df, batch_size=uc.XML_BATCH_SIZE, dictionaries=None
+):
     """
-    Parses a SUMO lane noise output XML file and extracts noise data per lane.
+    Streams a SUMO lane noise output XML file in batches of noise data per lane.
 
     Args:
         file_path (str): Path to the SUMO lane noise XML file.
         net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of rows per batch.
+        dictionaries (dict): The scenario's shared dictionaries, see _ColumnarBatch.
 
-    Returns:
-        pd.DataFrame: A DataFrame containing lane noise data.
+    Yields:
+        pd.DataFrame: A batch of lane noise data.
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    all_noise_data = []
     noise_attributes = {
         "Lane": ("id", str),
         "Noise": ("noise", float),
     }
 
-    for interval in root.iter("interval"):
-        timestep = float(interval.get("end"))
-        for lane in interval.iter("lane"):
-            lane_noise_info = _get_attributes(lane, noise_attributes)
-            lane_noise_info["Simulation timestep"] = timestep
-            all_noise_data.append(lane_noise_info)
+    lanes = _ColumnarBatch(
+        noise_attributes,
+        extra_columns={"Simulation timestep": float},
+        dictionaries=dictionaries,
+    )
+    timestep = None
+    for event, element in _iterparse(file_path):
+        if event == "start":
+            if element.tag == "interval":
+                timestep = float(element.get("end"))
+        elif element.tag == "lane":
+            lanes.append(element, timestep)
+            element.clear()
+            if len(lanes) >= batch_size:
+                yield _join_net(_flush(lanes), net_df, "Lane")
+    if len(lanes):
+        yield _join_net(_flush(lanes), net_df, "Lane")
+
+
+def _parse_lane_noise_xml(file_path, net_df, batch_size=uc.XML_BATCH_SIZE):
+    """
+    Parses a SUMO lane noise output XML file and extracts noise data per lane.
+
+    Args:
+        file_path (str): Path to the SUMO lane noise XML file.
+        net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of rows parsed at once.
 
-    results_df = pd.DataFrame(all_noise_data)
-    if not results_df.empty:
-        results_df = results_df.merge(net_df, on="Lane", how="left")
-    return results_df
+    Returns:
+        pd.DataFrame: A DataFrame containing lane noise data.
+    """
+    return _concat_batches(
+        _iter_lane_noise_xml(file_path, net_df, batch_size=batch_size)
+    )
 
 
 # Aggregate the edge noise output
-def _parse_edge_noise_xml(file_path, net_df):
+def _iter_edge_noise_xml(
+    file_path, net_df, batch_size=uc.XML_BATCH_SIZE, dictionaries=None
+):
     """
-    Parses a SUMO edge noise output XML file and extracts noise data per edge.
+    Streams a SUMO edge noise output XML file in batches of noise data per edge.
 
     Args:
         file_path (str): Path to the SUMO edge noise XML file.
         net_df (pd.DataFrame): DataFrame from parse_net_xml containing edge info.
+        batch_size (int): The maximum number of rows per batch.
+        dictionaries (dict): The scenario's shared dictionaries, see _ColumnarBatch.
 
-    Returns:
-        pd.DataFrame: A DataFrame containing edge noise data.
+    Yields:
+        pd.DataFrame: A batch of edge noise data.
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    all_noise_data = []
     noise_attributes = {
         "Edge": ("id", str),
         "Noise": ("noise", float),
     }
+    # Merge with a subset of net_df relevant for edges
+    edge_df = net_df[["Edge", "Longitude", "Latitude", "Name"]].drop_duplicates(
+        subset=["Edge"]
+    )
 
-    for interval in root.iter("interval"):
-        timestep = float(interval.get("end"))
-        for edge in interval.iter("edge"):
-            edge_noise_info = _get_attributes(edge, noise_attributes)
-            edge_noise_info["Simulation timestep"] = timestep
-            all_noise_data.append(edge_noise_info)
-
-    results_df = pd.DataFrame(all_noise_data)
-    if not results_df.empty:
-        # Merge with a subset of net_df relevant for edges
-        results_df = results_df.merge(
-            net_df[["Edge", "Longitude", "Latitude", "Name"]].drop_duplicates(
-                subset=["Edge"]
-            ),
-            on="Edge",
-            how="left",
-        )
-    return results_df
+    edges = _ColumnarBatch(
+        noise_attributes,
+        extra_columns={"Simulation timestep": float},
+        dictionaries=dictionaries,
+    )
+    timestep = None
+    for event, element in _iterparse(file_path):
+        if event == "start":
+            if element.tag == "interval":
+                timestep = float(element.get("end"))
+        elif element.tag == "edge":
+            edges.append(element, timestep)
+            element.clear()
+            if len(edges) >= batch_size:
+                yield _join_net(_flush(edges), edge_df, "Edge")
+    if len(edges):
+        yield _join_net(_flush(edges), edge_df, "Edge")
+
+
+def _parse_edge_noise_xml(file_path, net_df, batch_size=uc.XML_BATCH_SIZE):
+    """
+    Parses a SUMO edge noise output XML file and extracts noise data per edge.
+
+    Args:
+        file_path (str): Path to the SUMO edge noise XML file.
+        net_df (pd.DataFrame): DataFrame from parse_net_xml containing edge info.
+        batch_size (int): The maximum number of rows parsed at once.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing edge noise data.
+    """
+    return _concat_batches(
+        _iter_edge_noise_xml(file_path, net_df, batch_size=batch_size)
+    )
 
 
 # Aggregate the trip outputs
-def _parse_trip_output_xml(file_path):
+def _iter_trip_output_xml(
+    file_path, batch_size=uc.XML_BATCH_SIZE, dictionaries=None
+):
     """
-    Parses a SUMO tripinfo output XML file and extracts trip data.
+    Streams a SUMO tripinfo output XML file in batches of trip data.
 
     Args:
         file_path (str): Path to the SUMO tripinfo XML file.
+        batch_size (int): The maximum number of rows per batch.
+        dictionaries (dict): The scenario's shared dictionaries, see _ColumnarBatch.
 
-    Returns:
-        pd.DataFrame: A DataFrame containing trip data.
+    Yields:
+        pd.DataFrame: A batch of trip data.
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    all_trip_data = []
-
     tripinfo_attributes = {
         "Trip": ("id", str),
         "Lost time": ("timeLoss", float),
@@ -681,41 +1680,61 @@ def _parse_trip_output_xml(file_path):
         "Electricity": ("electricity", float),
     }
 
-    for trip in root.iter("tripinfo"):
-        trip_data = _get_attributes(trip, tripinfo_attributes)
+    trips = _ColumnarBatch(tripinfo_attributes, dictionaries=dictionaries)
+    # Emissions are nested, so they are accumulated alongside the trips
+    emissions = _ColumnarBatch(emissions_attributes, constants={"Mobility flow": 1})
+
+    def flush():
+        return pd.concat([_flush(trips), _flush(emissions)], axis=1)
 
-        # Emissions are nested, so iterate and add to trip_data
-        emissions_element = trip.find(
-            "emissions"
-        )  # Use find() as there's usually one emissions tag per tripinfo
-        if emissions_element is not None:
-            emissions_data = _get_attributes(emissions_element, emissions_attributes)
-            trip_data.update(emissions_data)
+    for event, element in _iterparse(file_path):
+        if event != "end" or element.tag != "tripinfo":
+            continue
+        trips.append(element)
+        # Use find() as there's usually one emissions tag per tripinfo
+        emissions.append(element.find("emissions"))
+        element.clear()
+        if len(trips) >= batch_size:
+            yield flush()
+    if len(trips):
+        yield flush()
 
-        trip_data["Mobility flow"] = 1
-        all_trip_data.append(trip_data)
 
-    results_df = pd.DataFrame(all_trip_data)
-    return results_df
+def _parse_trip_output_xml(file_path, batch_size=uc.XML_BATCH_SIZE):
+    """
+    Parses a SUMO tripinfo output XML file and extracts trip data.
+
+    Args:
+        file_path (str): Path to the SUMO tripinfo XML file.
+        batch_size (int): The maximum number of rows parsed at once.
+
+    Returns:
+        pd.DataFrame: A DataFrame containing trip data.
+    """
+    return _concat_batches(_iter_trip_output_xml(file_path, batch_size=batch_size))
 
 
 # Aggregate the emission output
-def _parse_emissions_xml(file_path, net_df):
+def _iter_emissions_xml(
+    file_path,
+    net_df,
+    batch_size=uc.XML_BATCH_SIZE,
+    dictionaries=None,
+    byte_range=None,
+):
     """
-    Parses a SUMO emissions output XML file and extracts vehicle emission data.
+    Streams a SUMO emissions output XML file in batches of vehicle emission data.
 
     Args:
         file_path (str): Path to the SUMO emissions XML file.
         net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of rows per batch.
+        dictionaries (dict): The scenario's shared dictionaries, see _ColumnarBatch.
+        byte_range (tuple): Only parse this range of timesteps, see _split_xml.
 
-    Returns:
-        pd.DataFrame: A DataFrame containing vehicle emission data.
+    Yields:
+        pd.DataFrame: A batch of vehicle emission data.
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    all_emission_data = []
-
     vehicle_attributes = {
         "Vehicle": ("id", str),
         "Route": ("route", str),
@@ -733,22 +1752,49 @@ def _parse_emissions_xml(file_path, net_df):
         "Noise": ("noise", float),
     }
 
-    for timestep_element in root.iter("timestep"):
-        timestep = float(timestep_element.get("time"))
-        for vehicle in timestep_element.iter("vehicle"):
-            veh_emission_info = _get_attributes(vehicle, vehicle_attributes)
-            veh_emission_info["Simulation timestep"] = timestep
-            veh_emission_info["Mobility flow"] = 1
-            all_emission_data.append(veh_emission_info)
+    vehicles = _ColumnarBatch(
+        vehicle_attributes,
+        extra_columns={"Simulation timestep": float},
+        constants={"Mobility flow": 1},
+        dictionaries=dictionaries,
+    )
+    timestep = None
+    for event, element in _iterparse(file_path, byte_range):
+        if event == "start":
+            if element.tag == "timestep":
+                timestep = float(element.get("time"))
+        elif element.tag == "vehicle":
+            vehicles.append(element, timestep)
+            element.clear()
+            if len(vehicles) >= batch_size:
+                yield _join_net(_flush(vehicles), net_df, "Lane")
+    if len(vehicles):
+        yield _join_net(_flush(vehicles), net_df, "Lane")
+
+
+def _parse_emissions_xml(file_path, net_df, batch_size=uc.XML_BATCH_SIZE):
+    """
+    Parses a SUMO emissions output XML file and extracts vehicle emission data.
+
+    Args:
+        file_path (str): Path to the SUMO emissions XML file.
+        net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of rows parsed at once.
 
-    results_df = pd.DataFrame(all_emission_data)
-    if not results_df.empty:
-        results_df = results_df.merge(net_df, on="Lane", how="left")
-    return results_df
+    Returns:
+        pd.DataFrame: A DataFrame containing vehicle emission data.
+    """
+    return _concat_batches(_iter_emissions_xml(file_path, net_df, batch_size=batch_size))
 
 
 def _modify_config(
-    scenario_folder, area_folder, config_folder, output_folder, net_file
+    scenario_folder,
+    area_folder,
+    config_folder,
+    output_folder,
+    net_file,
+    route_file=None,
+    additional_file=None,
 ):
     """
     Finds a configuration file, removes it and writes new one with specified values.
@@ -759,10 +1805,13 @@ def _modify_config(
         config_folder (str): the configuration file folder path.
         output_folder (str): the output folder path.
         net_file (str): the net file path.
+        route_file (str): the route file path, rou.xml of the area folder by default.
+        additional_file (str): the additional file path, add.xml of the scenario
+                               folder by default.
     """
-    additional_file_value = os.path.join(scenario_folder, "add.xml")
+    additional_file_value = additional_file or os.path.join(scenario_folder, "add.xml")
     net_file_value = os.path.join(net_file)
-    route_file_value = os.path.join(area_folder, "rou.xml")
+    route_file_value = route_file or os.path.join(area_folder, "rou.xml")
     tripinfo_file_value = os.path.join(output_folder, "trip_results.xml")
     emission_file_value = os.path.join(output_folder, "emission_results.xml")
     config_file = os.path.join(config_folder, "config.sumocfg")
@@ -786,48 +1835,379 @@ def _modify_config(
         f.write(config_str)
 
 
+def _write_additional_file(area_additional_file, additional_file, output_folder):
+    """
+    Writes a copy of an area's additional file that writes into an output folder.
+
+    The detector outputs of the area's file are written relative to it, so
+    simulations running at the same time would overwrite each other's outputs.
+
+    Args:
+        area_additional_file (str): the area's add.xml path.
+        additional_file (str): the path of the copy.
+        output_folder (str): the folder the outputs are written into.
+    """
+    tree = ET.parse(area_additional_file)
+    for element in tree.getroot().iter():
+        output_file = element.get("file")
+        if output_file is not None:
+            output_name = os.path.basename(output_file.replace("\\", "/"))
+            output_file = os.path.abspath(os.path.join(output_folder, output_name))
+            element.set("file", output_file)
+    tree.write(additional_file, encoding="UTF-8", xml_declaration=True)
+
+
+def _write_csv_batches(batches, output_path):
+    """
+    Writes DataFrame batches one after another into a single gzipped csv.
+
+    Only one batch is held in memory at a time. The row index keeps running
+    across batches so that the file reads back like a single DataFrame.
+
+    Args:
+        batches (iterable): DataFrames with identical columns.
+        output_path (str): Path of the .csv.gz file to write.
+    """
+    offset = 0
+    with gzip.open(output_path, "wt", newline="") as f_out:
+        for batch in batches:
+            batch.index = pd.RangeIndex(offset, offset + len(batch))
+            batch.to_csv(f_out, header=offset == 0)
+            offset += len(batch)
+
+
+def _write_batches(
+    batches, file_without_extension, dictionaries=None, dimensions=None
+):
+    """
+    Writes DataFrame batches as a dataset in the configured DATASET_FORMAT.
+
+    Parquet datasets store their strings as codes of the shared dictionaries,
+    and the edge, lane and vehicle attributes in the dimension tables, which
+    are written next to the dataset.
+    """
+    if uc.DATASET_FORMAT == "parquet":
+        us.write_parquet_batches(
+            batches, f"{file_without_extension}.parquet", dictionaries, dimensions
+        )
+        folder = os.path.dirname(file_without_extension)
+        if dictionaries is not None:
+            us.write_dictionaries(dictionaries, folder)
+        if dimensions is not None:
+            us.write_dimensions(dimensions, folder)
+    else:
+        _write_csv_batches(batches, f"{file_without_extension}.csv.gz")
+
+
+def _output_kind(output_name):
+    """Returns which SUMO output a file holds from its name, or None."""
+    # if "lane_noise" in output_name:
+    #     return "lane_noise"
+    if "edge_noise" in output_name:
+        return "edge_noise"
+    if "trip" in output_name:
+        return "trip"
+    if "emission" in output_name:
+        return "emission"
+    return None
+
+
+def _iter_output_xml(
+    kind, filename, net_df, batch_size, dictionaries=None, byte_range=None
+):
+    """Streams the batches of a SUMO output file of the given kind."""
+    if kind == "edge_noise":
+        return _iter_edge_noise_xml(filename, net_df, batch_size, dictionaries)
+    if kind == "trip":
+        return _iter_trip_output_xml(filename, batch_size, dictionaries)
+    return _iter_emissions_xml(filename, net_df, batch_size, dictionaries, byte_range)
+
+
+def _ingest_part(kind, filename, net_df, batch_size, byte_range, part_path):
+    """
+    Parses a SUMO output file, or a range of it, into a temporary parquet file.
+
+    Runs in a worker process of aggregate_outputs. Strings are stored with the
+    part's own dictionaries and re-coded with the shared ones when merged.
+
+    Returns:
+        list: The emission cube parts of the parsed batches.
+    """
+    cube_parts = []
+    batches = _iter_output_xml(
+        kind, filename, net_df, batch_size, byte_range=byte_range
+    )
+    if kind == "emission":
+        batches = _with_cube_parts(batches, cube_parts)
+    us.write_parquet_batches(batches, part_path)
+    return cube_parts
+
+
+def _iter_parts(part_paths, batch_size):
+    """Reads the batches of temporary parquet parts back in order."""
+    for part_path in part_paths:
+        if not os.path.isfile(part_path):
+            continue  # Nothing was parsed
+        for record_batch in pq.ParquetFile(part_path).iter_batches(batch_size):
+            yield record_batch.to_pandas()
+
+
+def _ingest_in_pool(
+    outputs,
+    net_df,
+    batch_size,
+    dictionaries,
+    dimensions,
+    workers,
+    cube_parts,
+    part_paths,
+):
+    """
+    Parses SUMO output files concurrently and writes their datasets in file order.
+
+    Large uncompressed emission files are split into timestep ranges. Every
+    file or range is parsed into a temporary parquet part by a worker process,
+    and the parts of a file are merged into its dataset with the shared
+    dictionaries as soon as they are all parsed.
+
+    Args:
+        outputs (list): (kind, filename, file_without_extension) per output file.
+        net_df (pd.DataFrame): DataFrame from parse_net_xml containing lane info.
+        batch_size (int): The maximum number of parsed elements held in memory.
+        dictionaries (dict): The scenario's shared dictionaries.
+        dimensions (dict): The scenario's dimension tables.
+        workers (int): The number of processes.
+        cube_parts (list): Collects the emission cube parts.
+        part_paths (list): Collects the temporary part paths for clean up.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        submitted = []
+        for kind, filename, file_without_extension in outputs:
+            byte_ranges = [None]
+            if kind == "emission":
+                byte_ranges = _split_xml(
+                    filename, "timestep", workers, uc.XML_SPLIT_MIN_BYTES
+                )
+            futures = []
+            for part, byte_range in enumerate(byte_ranges):
+                part_path = f"{file_without_extension}.part{part}.parquet"
+                part_paths.append(part_path)
+                futures.append(
+                    pool.submit(
+                        _ingest_part,
+                        kind,
+                        filename,
+                        net_df,
+                        batch_size,
+                        byte_range,
+                        part_path,
+                    )
+                )
+            submitted.append((filename, file_without_extension, futures))
+        for filename, file_without_extension, futures in submitted:
+            for future in futures:
+                cube_parts.extend(future.result())
+            file_part_paths = [
+                f"{file_without_extension}.part{part}.parquet"
+                for part in range(len(futures))
+            ]
+            _write_batches(
+                _iter_parts(file_part_paths, batch_size),
+                file_without_extension,
+                dictionaries,
+                dimensions,
+            )
+            for part_path in file_part_paths:
+                if os.path.isfile(part_path):
+                    os.remove(part_path)
+            os.remove(filename)
+
+
 def aggregate_outputs(
     net_path="simulation/scenarios/kamppi/baseline_net.xml",
     full_output_folder="simulation/scenarios/kamppi/regular_summer_weekday/optimized_equal",
+    batch_size=uc.XML_BATCH_SIZE,
+    workers=uc.INGEST_WORKERS,
 ):
-    # Convert the output files of raw xml to gzipped csv
+    """
+    Converts the raw SUMO XML outputs of a scenario into parquet or gzipped csv datasets.
+
+    The XML files are parsed incrementally, so peak memory is bounded by
+    batch_size rather than the size of the output files. The emission output
+    is also aggregated into the emission cube on the way. Vehicle, edge, lane,
+    route and name strings share one set of dictionaries per scenario folder,
+    and the edge, lane and vehicle attributes are stored once in its dimension
+    tables instead of on every row. The KPIs of the Summary tab are written
+    into a small sidecar, see store.scenario_kpis.
+    The raw XML files are removed once converted.
+
+    With more than one worker, the output files are parsed concurrently in a
+    process pool, and large uncompressed emission files are split into
+    timestep ranges that are parsed concurrently too. The parts are merged in
+    file order.
+
+    Args:
+        net_path (str): Path to the SUMO network XML file.
+        full_output_folder (str): The folder holding the simulation outputs.
+        batch_size (int): The maximum number of parsed elements held in memory.
+        workers (int): The number of processes, None for one per core.
+    """
     net_df = _parse_net_xml(net_path)
-    xml_output_files = glob.glob(f"{full_output_folder}/*.xml*")
-    for filename in xml_output_files:
-        file_without_extension = filename.split(".")[0]
-        with open(filename, "rb") as f_in:
-            with gzip.open(f"{filename}.gz", "wb") as f_out:
-                shutil.copyfileobj(f_in, f_out)
-                os.remove(f_in)
-                # if "lane_noise" in f_out:
-                #     lane_noise = parse_lane_noise_xml(f_out, net_df)
-                #     lane_noise.to_csv(
-                #         f"{file_without_extension}.csv.gz",
-                #         compression="gzip",
-                #     )
-                if "edge_noise" in filename:
-                    edge_noise = _parse_edge_noise_xml(f_out, net_df)
-                    # print(edge_noise.head())
-                    edge_noise.to_csv(
-                        f"{file_without_extension}.csv.gz",
-                        compression="gzip",
-                    )
-                elif "trip" in filename:
-                    trip_info = _parse_trip_output_xml(f_out)
-                    trip_info.to_csv(
-                        f"{file_without_extension}.csv.gz",
-                        compression="gzip",
-                    )
-                elif "emission" in filename:
-                    emissions = _parse_emissions_xml(f_out, net_df)
-                    emissions.to_csv(
-                        f"{file_without_extension}.csv.gz",
-                        compression="zip",
-                    )
-                os.remove(f_out)
+    dictionaries = us.read_dictionaries(full_output_folder)
+    dimensions = us.read_dimensions(full_output_folder)
+    outputs = []
+    for filename in glob.glob(os.path.join(full_output_folder, "*.xml*")):
+        file_without_extension = filename[: filename.rindex(".xml")]
+        kind = _output_kind(os.path.basename(file_without_extension))
+        if kind is not None:
+            outputs.append((kind, filename, file_without_extension))
+
+    workers = workers or os.cpu_count()
+    cube_parts = []
+    if workers == 1:
+        for kind, filename, file_without_extension in outputs:
+            batches = _iter_output_xml(kind, filename, net_df, batch_size, dictionaries)
+            if kind == "emission":
+                batches = _with_cube_parts(batches, cube_parts)
+            _write_batches(
+                batches, file_without_extension, dictionaries, dimensions
+            )
+            os.remove(filename)
+    else:
+        part_paths = []
+        try:
+            _ingest_in_pool(
+                outputs,
+                net_df,
+                batch_size,
+                dictionaries,
+                dimensions,
+                workers,
+                cube_parts,
+                part_paths,
+            )
+        finally:
+            for part_path in part_paths:
+                if os.path.isfile(part_path):
+                    os.remove(part_path)
+    cube = None
+    if cube_parts:
+        cube = _merge_cube_parts(cube_parts)
+        _write_batches(
+            [cube],
+            os.path.join(full_output_folder, uc.CUBE_DATASET),
+            dictionaries,
+            dimensions,
+        )
+    us.write_kpis(us.scenario_kpis(full_output_folder, cube), full_output_folder)
 
 
 # Simulate
+def run_scenario(
+    area="kamppi",
+    demand="regular",
+    season="summer",
+    time="weekday",
+    situation="baseline",
+    optimization=0,
+    seed=123,
+    label="default",
+    backend=uc.SIMULATION_BACKEND,
+    step_batch=uc.SIMULATION_STEP_BATCH,
+    routing_workers=uc.ROUTING_WORKERS,
+):
+    """
+    Runs the SUMO simulation of one scenario and converts its outputs into datasets.
+
+    Every scenario gets its own route file, additional file and configuration
+    under the input folder of its output folder, and its own TraCI connection,
+    so several scenarios can be simulated at the same time.
+
+    Args:
+        area (str): the area that is simulated.
+        demand (str): the amount of mobility that is simulated.
+        season (str): the season that is simulated.
+        time (str): the time of week that is simulated, weekday or weekend.
+        situation (str): baseline or optimized.
+        optimization (int): the optimization slider value.
+        seed (int): the seed of the random demand.
+        label (str): the label of the TraCI connection.
+        backend (str): libsumo or traci, see utils.backends.
+        step_batch (float): the most simulated seconds advanced per call.
+        routing_workers (int): the processes that compute the routes, see
+                               utils.routing.
+
+    Returns:
+        str: The scenario folder the datasets were written into.
+    """
+    # Sanity check: sim will fail without SUMO_HOME
+    if "SUMO_HOME" in os.environ:
+        tools = os.path.join(os.environ["SUMO_HOME"], "tools")
+        sys.path.append(tools)
+    else:
+        sys.exit("Please declare environment variable 'SUMO_HOME'")
+
+    # Where the baseline road network and add.xml reside
+    area_folder = os.path.join(uc.SCENARIO_ROOT, area.lower())
+    baseline_net = os.path.join(area_folder, "baseline_net.xml")
+    area_additional_file = os.path.join(area_folder, "add.xml")
+    if not os.path.isfile(baseline_net) or not os.path.isfile(area_additional_file):
+        raise KeyError(
+            f"The network file and additional file do not exist at: {area_folder}!"
+        )
+    output_folder = us.scenario_folder(
+        area=area,
+        demand=demand,
+        season=season,
+        time=time,
+        situation=situation,
+        optimization=optimization,
+    )
+    input_folder = os.path.join(output_folder, "input")
+    os.makedirs(input_folder, exist_ok=True)
+    route_file = os.path.join(input_folder, uc.ROUTE_FILE)
+    additional_file = os.path.join(input_folder, "add.xml")
+
+    # Create OD matrix for a new simulation
+    _write_route_file(
+        rou_file_path=route_file,
+        net_file_path=baseline_net,
+        demand=demand,
+        season=season,
+        day=time,
+        seed=seed,
+        routing_workers=routing_workers,
+    )
+    _write_additional_file(area_additional_file, additional_file, output_folder)
+    # SUMO resolves the paths of a configuration relative to the configuration
+    _modify_config(
+        scenario_folder=input_folder,
+        area_folder=area_folder,
+        config_folder=input_folder,
+        output_folder=os.path.abspath(output_folder),
+        net_file=os.path.abspath(baseline_net),
+        route_file=os.path.abspath(route_file),
+        additional_file=os.path.abspath(additional_file),
+    )
+    config_file = os.path.join(input_folder, "config.sumocfg")
+    ## Start the correct loop: no optimization for baseline, RL for optimized
+    # With RL loop: TODO
+    connection, _ = ub.start_simulation(
+        [uc.SUMO_BINARY, "-c", config_file], backend=backend, label=label
+    )
+    try:
+        # Let's go!
+        ub.step_simulation(connection, step_batch=step_batch)
+    finally:
+        connection.close()
+    sys.stdout.flush()
+    # The sweep already runs one scenario per process
+    aggregate_outputs(
+        net_path=baseline_net, full_output_folder=output_folder, workers=1
+    )
+    return output_folder
+
+
 def run_simulation(
     area="kamppi",
     season="summer",
@@ -837,7 +2217,9 @@ def run_simulation(
     seed=123,
 ):
     """
-    Runs a SUMO simulation, zips the XML outputs and converts them into csv.
+    Runs the baseline and optimized SUMO simulations of a scenario.
+
+    Scenarios whose datasets already exist are not simulated again.
 
     Args:
         area (str): the area that is simulated.
@@ -845,99 +2227,29 @@ def run_simulation(
         demand (str): the amount of mobility that is simulated.
         day (str): the time of week that is simulated, weekday or weekend.
         optimization (str): the optimization weights from the interface
+        seed (int): the seed of the random demand.
     """
+    slider_values = {
+        value: slider for slider, value in uc.OPTIMIZATION_SLIDER_VALUES.items()
+    }
     for situation in ["baseline", "optimized"]:
-        # Directory paths for outputs
-        baseline_output_folder = os.path.join(
-            ".",
-            "simulation",
-            "scenarios",
-            str(area),
-            f"{demand}_{season}_{day}_{situation}",
-        )
-        os.makedirs(baseline_output_folder, exist_ok=True)
-        optim_output_folder = os.path.join(
-            ".",
-            "simulation",
-            "scenarios",
-            str(area),
-            f"{demand}_{season}_{day}_{situation}_{optimization}",
+        output_folder = us.scenario_folder(
+            area=area,
+            demand=demand,
+            season=season,
+            time=day,
+            situation=situation,
+            optimization=slider_values[optimization.lower()],
         )
-        os.makedirs(optim_output_folder, exist_ok=True)
         # If the outputs already exist, do not run the simulation loop
-        if len(dir(optim_output_folder)) != 0 and len(dir(baseline_output_folder)) != 0:
-            return
-        # Run a new sim to create the outputs
-        else:
-            # Sanity check: sim will fail without SUMO_HOME
-            if "SUMO_HOME" in os.environ:
-                tools = os.path.join(os.environ["SUMO_HOME"], "tools")
-                sys.path.append(tools)
-            else:
-                sys.exit("Please declare environment variable 'SUMO_HOME'")
-
-            ## File paths
-            # Where the baseline road network, routes and add.xml resides
-            area_folder = os.path.join(".", "simulation", "scenarios", str(area))
-            os.makedirs(area_folder, exist_ok=True)
-            # Baseline net and additional file exist there
-            baseline_net = os.path.join(area_folder, "baseline_net.xml")
-            additional_file = os.path.join(config_folder, "add.xml")
-            if not os.path.isfile(baseline_net) and not os.path.isfile(additional_file):
-                raise KeyError(
-                    f"The network file and additional file do not exist at: {area_folder}!"
-                )
-            # Where the .config should reside (only the latest version is preserved, as new one is written for each sim)
-            config_folder = os.path.join(
-                ".",
-                "simulation",
-            )
-            os.makedirs(config_folder, exist_ok=True)
-            # Where the optimized network and outputs should reside (specific for all scenarios, new ones written in each sim run)
-            scenario_folder = os.path.join(
-                ".",
-                "simulation",
-                str(area),
-                str(demand),
-                str(season),
-                str(day),
-                str(situation),
-                str(optimization),
-            )
-            os.makedirs(scenario_folder, exist_ok=True)
-
-            # Create OD matrix for a new simulation
-            _write_route_file(
-                rou_file_path=os.path.join(area_folder, "rou.xml"),
-                net_file_path=baseline_net,
-                demand=demand,
-                season=season,
-                day=day,
-                seed=seed,
-            )
-            ## Start the correct loop: no optimization for baseline, RL for optimized
-            # Fine-tune the add and config as needed
-            _modify_config(
-                scenario_folder=scenario_folder,
-                area_folder=area_folder,
-                config_folder=config_folder,
-                output_folder=optim_output_folder,
-                net_file=baseline_net,
-            )
-            config_file = os.path.join(config_folder, "config.sumocfg")
-            traci.start(["sumo", "-c", config_file])
-            # Let's go!
-            while traci.simulation.getTime() < 3600:
-                traci.simulationStep()
-            sys.stdout.flush()
-            traci.close()
-            aggregate_outputs()
-            # With RL loop: TODO
-            # modify_config(
-            #     scenario_folder=scenario_folder,
-            #     area_folder=area_folder,
-            #     config_folder=config_folder,
-            #     output_folder=optim_output_folder,
-            #     net_file=baseline_net
-            # )
-            return
+        if os.path.isfile(us.dataset_path(output_folder, "emission_results")):
+            continue
+        run_scenario(
+            area=area,
+            demand=demand,
+            season=season,
+            time=day,
+            situation=situation,
+            optimization=slider_values[optimization.lower()],
+            seed=seed,
+        )
@@ -0,0 +1,257 @@
+# utils/network.py
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pyproj
+import scipy.sparse as sp
+import sumolib
+from scipy.sparse.csgraph import connected_components
+import utils.constants as uc
+
+
+def edge_graph(net, vclass="passenger"):
+    """
+    Builds the edge-to-edge adjacency of a road network as a CSR matrix.
+
+    Edge i is connected to edge j if a vehicle of the class can continue from
+    i onto j through a lane connection it may use.
+
+    Args:
+        net (sumolib.net.Net): The road network.
+        vclass (str): Only keep the edges this vehicle class may use, all edges
+                      if None.
+
+    Returns:
+        tuple: The edge ids as an array and the adjacency as a
+               scipy.sparse.csr_matrix.
+    """
+    edges = [
+        edge for edge in net.getEdges() if vclass is None or edge.allows(vclass)
+    ]
+    index = {edge.getID(): i for i, edge in enumerate(edges)}
+    rows, cols = [], []
+    for i, edge in enumerate(edges):
+        for next_edge in edge.getAllowedOutgoing(vclass):
+            j = index.get(next_edge.getID())
+            if j is not None:
+                rows.append(i)
+                cols.append(j)
+    adjacency = sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+        shape=(len(edges), len(edges)),
+    )
+    edge_ids = np.array([edge.getID() for edge in edges], dtype=object)
+    return edge_ids, adjacency
+
+
+def edge_travel_times(net, edge_ids):
+    """
+    Returns the free-flow travel time of edges.
+
+    Args:
+        net (sumolib.net.Net): The road network.
+        edge_ids (np.ndarray): The edge ids, from edge_graph.
+
+    Returns:
+        np.ndarray: The length of every edge divided by its speed limit, in
+                    seconds.
+    """
+    edges = [net.getEdge(edge_id) for edge_id in edge_ids]
+    return np.array(
+        [edge.getLength() / edge.getSpeed() for edge in edges], dtype=np.float64
+    )
+
+
+def reachable_groups(adjacency):
+    """
+    Groups the edges into strongly connected components.
+
+    Every edge of a component can be reached from every other edge of it.
+
+    Args:
+        adjacency (scipy.sparse.csr_matrix): The edge adjacency from edge_graph.
+
+    Returns:
+        tuple: The edges sorted by component, the start offset of every
+               component in that order plus the total, and the component of
+               every edge.
+    """
+    _, labels = connected_components(adjacency, directed=True, connection="strong")
+    members = np.argsort(labels, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(labels))))
+    return members, offsets, labels
+
+
+def sample_od_pairs(adjacency, size, rng=np.random):
+    """
+    Samples origin and destination edges that can reach each other.
+
+    Origins are drawn uniformly from the edges of components with more than
+    one edge, destinations uniformly from the origin's component, so no path
+    search is needed per trip.
+
+    Args:
+        adjacency (scipy.sparse.csr_matrix): The edge adjacency from edge_graph.
+        size (int): The number of pairs.
+        rng (np.random.RandomState): The random state, the global one by default.
+
+    Returns:
+        tuple: The origin and destination edge indices as arrays.
+    """
+    members, offsets, labels = reachable_groups(adjacency)
+    sizes = np.diff(offsets)
+    candidates = np.flatnonzero(sizes[labels] > 1)
+    if len(candidates) == 0:
+        raise ValueError("The network has no edges that can reach each other")
+    origins = candidates[rng.randint(0, len(candidates), size)]
+    components = labels[origins]
+    # A uniform position within the origin's component
+    positions = (rng.random_sample(size) * sizes[components]).astype(np.int64)
+    destinations = members[offsets[components] + positions]
+    return origins, destinations
+
+
+def file_hash(path, chunk_size=16 * 1024**2):
+    """Returns the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def xy_to_lonlat(network, x, y):
+    """
+    Projects network coordinates to longitudes and latitudes in one call.
+
+    Args:
+        network (dict): The arrays from load_network, only location_offset and
+                        projection are used.
+        x (np.ndarray): The x coordinates.
+        y (np.ndarray): The y coordinates.
+
+    Returns:
+        tuple: The longitudes and latitudes as arrays.
+    """
+    x_offset, y_offset = network["location_offset"]
+    projection = pyproj.Proj(projparams=str(network["projection"]))
+    lon, lat = projection(
+        np.asarray(x, dtype=np.float64) - x_offset,
+        np.asarray(y, dtype=np.float64) - y_offset,
+        inverse=True,
+    )
+    return np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+
+
+def compile_network(net_path, vclass=uc.NETWORK_VCLASS):
+    """
+    Reads a SUMO net file once into plain arrays.
+
+    Edges are the non-internal edges in file order, lanes reference their edge
+    by position, and the edge graph of the vehicle class is stored in CSR form
+    over the positions in graph_edge.
+
+    Args:
+        net_path (str): Path to the SUMO network XML file.
+        vclass (str): The vehicle class of the edge graph.
+
+    Returns:
+        dict: The arrays of the network by name.
+    """
+    net = sumolib.net.readNet(net_path)
+    edges = net.getEdges(withInternal=False)
+    edge_index = {edge.getID(): i for i, edge in enumerate(edges)}
+    # The middle point of the edge's own shape, if it has one
+    middle = np.full((len(edges), 2), np.nan)
+    for i, edge in enumerate(edges):
+        shape = edge.getRawShape()
+        if shape:
+            middle[i] = shape[len(shape) // 2][:2]
+    location = {
+        "location_offset": np.array(net.getLocationOffset(), dtype=np.float64),
+        "projection": np.array(net.getGeoProj().srs, dtype=str),
+    }
+    lon, lat = xy_to_lonlat(location, middle[:, 0], middle[:, 1])
+    lanes = [lane for edge in edges for lane in edge.getLanes()]
+    graph_ids, adjacency = edge_graph(net, vclass=vclass)
+    return {
+        **location,
+        "edge_id": np.array([edge.getID() for edge in edges], dtype=str),
+        "edge_name": np.array([edge.getName() for edge in edges], dtype=str),
+        "edge_type": np.array([edge.getType() for edge in edges], dtype=str),
+        "edge_x": middle[:, 0],
+        "edge_y": middle[:, 1],
+        "edge_lon": lon,
+        "edge_lat": lat,
+        "lane_id": np.array([lane.getID() for lane in lanes], dtype=str),
+        "lane_edge": np.array(
+            [edge_index[lane.getEdge().getID()] for lane in lanes], dtype=np.int32
+        ),
+        "graph_edge": np.array(
+            [edge_index[edge_id] for edge_id in graph_ids], dtype=np.int32
+        ),
+        "graph_indptr": adjacency.indptr.astype(np.int32),
+        "graph_indices": adjacency.indices.astype(np.int32),
+        "graph_travel_time": edge_travel_times(net, graph_ids),
+    }
+
+
+def load_network(net_path, cache_root=uc.NETWORK_CACHE, vclass=uc.NETWORK_VCLASS):
+    """
+    Loads the compiled arrays of a net file, compiling them on first use.
+
+    The arrays are kept as .npy files in a folder named after the file's
+    content hash and vehicle class, and are memory-mapped on load, so a changed
+    net file gets a new folder and an unchanged one is never parsed again.
+
+    Args:
+        net_path (str): Path to the SUMO network XML file.
+        cache_root (str): The folder of the compiled networks.
+        vclass (str): The vehicle class of the edge graph.
+
+    Returns:
+        dict: The read-only arrays of compile_network by name.
+    """
+    folder = os.path.join(cache_root, f"{file_hash(net_path)}_{vclass}")
+    if not os.path.isdir(folder):
+        os.makedirs(cache_root, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=cache_root)
+        for name, values in compile_network(net_path, vclass).items():
+            np.save(os.path.join(temporary, f"{name}.npy"), values)
+        try:
+            os.rename(temporary, folder)
+        except OSError:
+            # Another process compiled the same network first
+            shutil.rmtree(temporary)
+    return {
+        name[: -len(".npy")]: np.load(os.path.join(folder, name), mmap_mode="r")
+        for name in os.listdir(folder)
+    }
+
+
+def network_graph(network):
+    """
+    Returns the edge graph of a compiled network.
+
+    Args:
+        network (dict): The arrays from load_network.
+
+    Returns:
+        tuple: The edge ids of the graph as an array, the adjacency as a
+               scipy.sparse.csr_matrix like edge_graph and the travel time of
+               every edge like edge_travel_times.
+    """
+    indices = np.asarray(network["graph_indices"])
+    edges = len(network["graph_edge"])
+    adjacency = sp.csr_matrix(
+        (
+            np.ones(len(indices), dtype=np.int8),
+            indices,
+            np.asarray(network["graph_indptr"]),
+        ),
+        shape=(edges, edges),
+    )
+    edge_ids = network["edge_id"][network["graph_edge"]].astype(object)
+    return edge_ids, adjacency, np.asarray(network["graph_travel_time"])
@@ -0,0 +1,156 @@
+# utils/raster.py
+import base64
+import hashlib
+import numpy as np
+import pandas as pd
+import plotly.colors
+import utils.constants as uc
+import utils.cache as ucache
+
+# Rendered heatmap frames, shared by all callbacks of the process
+frame_cache = ucache.RenderCache()
+
+_EARTH_RADIUS = 6378137.0
+
+
+def web_mercator(lon, lat):
+    """
+    Projects longitudes and latitudes to Web Mercator metres, the projection of
+    the map tiles, so images rendered in it line up with the map.
+
+    Returns:
+        tuple: The x and y coordinates as arrays.
+    """
+    x = np.radians(np.asarray(lon, dtype=np.float64)) * _EARTH_RADIUS
+    y = _EARTH_RADIUS * np.log(
+        np.tan(np.pi / 4 + np.radians(np.asarray(lat, dtype=np.float64)) / 2)
+    )
+    return x, y
+
+
+def _fingerprint(*parts):
+    """Returns a hex digest of arrays and plain values."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def render_frame(x, y, values, x_range, y_range, span, width, height, spread):
+    """
+    Rasterizes point values into a transparent PNG image.
+
+    The values falling into a pixel are summed, every point is spread over a
+    disc of the given radius, and the pixels are coloured linearly over span.
+
+    Args:
+        x (np.ndarray): The Web Mercator x of every point.
+        y (np.ndarray): The Web Mercator y of every point.
+        values (np.ndarray): The value of every point.
+        x_range (tuple): The west and east edge of the image.
+        y_range (tuple): The south and north edge of the image.
+        span (tuple): The values of the first and last colour.
+        width (int): The image width in pixels.
+        height (int): The image height in pixels.
+        spread (int): The radius of every point in pixels.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    # datashader compiles its kernels on import, so it is only loaded when used
+    import datashader as ds
+    import datashader.transfer_functions as tf
+
+    canvas = ds.Canvas(
+        plot_width=width, plot_height=height, x_range=x_range, y_range=y_range
+    )
+    points = pd.DataFrame({"x": x, "y": y, "value": values})
+    aggregate = canvas.points(points, "x", "y", agg=ds.sum("value"))
+    aggregate = aggregate.where(aggregate > 0)
+    if spread > 0:
+        aggregate = tf.spread(aggregate, px=spread, shape="circle", how="max")
+    image = tf.shade(
+        aggregate, cmap=plotly.colors.sequential.Plasma, how="linear", span=span
+    )
+    return image.to_bytesio("png").getvalue()
+
+
+def rasterize_frames(
+    network,
+    variable,
+    bounds,
+    span,
+    width=uc.HEATMAP_RASTER_WIDTH,
+    height=uc.HEATMAP_RASTER_HEIGHT,
+    spread=uc.HEATMAP_RASTER_SPREAD,
+):
+    """
+    Renders a heatmap image of every timestep on the server.
+
+    The size of the images depends on width and height only, not on the
+    number of rows. Rendered frames are kept in frame_cache, keyed by a
+    fingerprint of the frame's points and the rendering parameters.
+
+    Args:
+        network (pd.DataFrame): Longitude, Latitude, Timestep and the variable
+                                per edge and timestep.
+        variable (str): The variable to render.
+        bounds (dict): The west, east, south and north edge of the images, in
+                       degrees, see map_bounds.
+        span (tuple): The values of the first and last colour.
+        width (int): The image width in pixels.
+        height (int): The image height in pixels.
+        spread (int): The radius of every edge in pixels.
+
+    Returns:
+        tuple: A list of (timestep, PNG data URI) in timestep order, and the
+               corners of the images as [lon, lat] pairs clockwise from the
+               north-west corner.
+    """
+    (west, east), (south, north) = web_mercator(
+        [bounds["west"], bounds["east"]], [bounds["south"], bounds["north"]]
+    )
+    located = network["Longitude"].notna() & network["Latitude"].notna()
+    network = network[located]
+    x, y = web_mercator(network["Longitude"], network["Latitude"])
+    values = network[variable].to_numpy(dtype=np.float64)
+    timesteps = network["Timestep"]
+    if not isinstance(timesteps.dtype, pd.CategoricalDtype):
+        timesteps = timesteps.astype("category")
+    codes = timesteps.cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    present, starts = np.unique(codes[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    parameters = (variable, west, east, south, north, span, width, height, spread)
+    frames = []
+    for code, start, end in zip(present, starts, ends):
+        if code < 0:
+            continue
+        rows = order[start:end]
+
+        def render(rows=rows):
+            image = render_frame(
+                x[rows],
+                y[rows],
+                values[rows],
+                (west, east),
+                (south, north),
+                span,
+                width,
+                height,
+                spread,
+            )
+            return "data:image/png;base64," + base64.b64encode(image).decode()
+
+        key = _fingerprint(*parameters, x[rows], y[rows], values[rows])
+        frames.append((timesteps.cat.categories[code], frame_cache.get(key, render)))
+    coordinates = [
+        [bounds["west"], bounds["north"]],
+        [bounds["east"], bounds["north"]],
+        [bounds["east"], bounds["south"]],
+        [bounds["west"], bounds["south"]],
+    ]
+    return frames, coordinates
@@ -0,0 +1,130 @@
+# utils/routing.py
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from scipy.sparse.csgraph import dijkstra
+import utils.constants as uc
+import utils.network as un
+
+# The graph and edge ids of a routing worker, set once when the worker starts
+_graph = None
+_edge_ids = None
+
+
+def weighted_graph(adjacency, travel_times):
+    """
+    Weights the edge adjacency with travel times.
+
+    Continuing from edge i onto edge j costs the travel time of j, so the cost
+    of a path is the time to drive it after leaving the origin edge.
+
+    Args:
+        adjacency (scipy.sparse.csr_matrix): The edge adjacency from edge_graph.
+        travel_times (np.ndarray): The travel time of every edge.
+
+    Returns:
+        scipy.sparse.csr_matrix: The weighted adjacency.
+    """
+    graph = adjacency.tocsr().astype(np.float64)
+    graph.data = travel_times[graph.indices]
+    return graph
+
+
+def _init_worker(graph, edge_ids):
+    global _graph, _edge_ids
+    _graph = graph
+    _edge_ids = edge_ids
+
+
+def _path(predecessors, origin, destination):
+    """Returns the edges from origin to destination in a shortest-path tree."""
+    path = [destination]
+    while path[-1] != origin:
+        previous = predecessors[path[-1]]
+        if previous < 0:
+            return None
+        path.append(previous)
+    return path[::-1]
+
+
+def _route_origins(origins, destinations, graph=None, edge_ids=None):
+    """
+    Routes the trips of some origins, computing one shortest-path tree per
+    origin for all of its destinations.
+
+    Args:
+        origins (np.ndarray): Distinct origin edge indices.
+        destinations (list): The destination edge indices of every origin.
+        graph (scipy.sparse.csr_matrix): The weighted adjacency, the worker's
+                                         by default.
+        edge_ids (np.ndarray): The edge ids, the worker's by default.
+
+    Returns:
+        list: The route of every trip as space-separated edge ids, in origin
+              and then destination order, None if it cannot be driven.
+    """
+    graph = _graph if graph is None else graph
+    edge_ids = _edge_ids if edge_ids is None else edge_ids
+    _, predecessors = dijkstra(graph, indices=origins, return_predecessors=True)
+    routes = []
+    for tree, origin, targets in zip(predecessors, origins, destinations):
+        for destination in targets:
+            path = _path(tree, origin, destination)
+            routes.append(None if path is None else " ".join(edge_ids[path]))
+    return routes
+
+
+def route_trips(
+    network,
+    trips,
+    workers=uc.ROUTING_WORKERS,
+    origins_per_task=uc.ROUTING_ORIGINS_PER_TASK,
+):
+    """
+    Computes the fastest route of every trip before the simulation.
+
+    Trips are grouped by origin edge, so every shortest-path tree is computed
+    once however many trips share its origin. The groups are routed in a
+    process pool whose workers get the read-only graph once when they start.
+
+    Args:
+        network (dict): The compiled road network, from load_network. Routes
+                        use the vehicle class of its edge graph.
+        trips (pd.DataFrame): Trips with From and To edge ids, from
+                              generate_trips.
+        workers (int): The number of worker processes, None for one per core
+                       and 1 to route in this process.
+        origins_per_task (int): The number of origins routed per task.
+
+    Returns:
+        pd.DataFrame: The trips with a Route column of space-separated edge
+                      ids, None for trips that cannot be routed.
+    """
+    edge_ids, adjacency, travel_times = un.network_graph(network)
+    graph = weighted_graph(adjacency, travel_times)
+    index = pd.Index(edge_ids)
+    origins = index.get_indexer(trips["From"])
+    destinations = index.get_indexer(trips["To"])
+    routable = np.flatnonzero((origins >= 0) & (destinations >= 0))
+    order = routable[np.argsort(origins[routable], kind="stable")]
+    unique, starts = np.unique(origins[order], return_index=True)
+    groups = np.split(destinations[order], starts[1:])
+    tasks = [
+        (unique[i : i + origins_per_task], groups[i : i + origins_per_task])
+        for i in range(0, len(unique), origins_per_task)
+    ]
+    if workers == 1 or len(tasks) <= 1:
+        results = [
+            _route_origins(task_origins, task_destinations, graph, edge_ids)
+            for task_origins, task_destinations in tasks
+        ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(graph, edge_ids),
+        ) as pool:
+            results = list(pool.map(_route_origins, *zip(*tasks)))
+    routes = np.full(len(trips), None, dtype=object)
+    routes[order] = [route for result in results for route in result]
+    return trips.assign(Route=routes)
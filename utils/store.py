@@ -0,0 +1,809 @@
+# utils/store.py
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import utils.constants as uc
+
+# The dimension table and key column of every dimension attribute
+_DIMENSION_OF = {
+    attribute: (dimension_name, key)
+    for dimension_name, (key, attributes) in uc.DIMENSIONS.items()
+    for attribute in attributes
+}
+
+
+def scenario_folder(
+    area="kamppi",
+    demand="regular",
+    season="summer",
+    time="weekday",
+    situation="baseline",
+    optimization=0,
+    root=uc.SCENARIO_ROOT,
+):
+    """
+    Returns the folder of a scenario's datasets.
+
+    The scenario tree is partitioned by area, then demand, season and time, then
+    situation (and optimization weights for optimized situations).
+
+    Args:
+        area (str): the simulated area.
+        demand (str): the simulated amount of mobility.
+        season (str): the simulated season.
+        time (str): the simulated time of week, weekday or weekend.
+        situation (str): baseline or optimized.
+        optimization (int): the optimization slider value.
+        root (str): the root folder of the scenario tree.
+
+    Returns:
+        str: The scenario folder path.
+    """
+    if situation.lower() == "optimized":
+        situation_folder = (
+            f"{situation.lower()}_{uc.OPTIMIZATION_SLIDER_VALUES[optimization]}"
+        )
+    else:
+        situation_folder = f"{situation.lower()}"
+    return os.path.join(
+        root,
+        f"{area.lower()}",
+        f"{demand.lower()}_{season.lower()}_{time.lower()}",
+        situation_folder,
+    )
+
+
+def dataset_path(folder, dataset_name):
+    """
+    Returns the path of a stored dataset, preferring the columnar format.
+
+    Args:
+        folder (str): the scenario folder.
+        dataset_name (str): the dataset name, eg. emission_results.
+
+    Returns:
+        str: The parquet path if it exists, otherwise the gzipped csv path.
+    """
+    parquet_path = os.path.join(folder, f"{dataset_name}.parquet")
+    if os.path.isfile(parquet_path):
+        return parquet_path
+    return os.path.join(folder, f"{dataset_name}.csv.gz")
+
+
+def folder_version(*folders):
+    """
+    Returns a digest of the files in scenario folders.
+
+    The digest changes whenever a file is added, removed or rewritten, so it
+    versions everything drawn from the folders' datasets.
+
+    Args:
+        folders (str): The scenario folders, missing ones are skipped.
+
+    Returns:
+        str: The hex digest of every file's name, size and modification time.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+            if entry.is_file():
+                stat = entry.stat()
+                digest.update(
+                    f"{folder}/{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode()
+                )
+    return digest.hexdigest()
+
+
+def dictionaries_path(folder):
+    """Returns the path of a scenario folder's shared dictionaries."""
+    return os.path.join(folder, f"{uc.DICTIONARIES_DATASET}.parquet")
+
+
+def read_dictionaries(folder):
+    """
+    Reads the shared dictionaries of a scenario folder.
+
+    Args:
+        folder (str): the scenario folder.
+
+    Returns:
+        dict: Dictionary names mapped to {value: code} dicts in code order. Empty
+              if the folder has no dictionaries yet.
+    """
+    path = dictionaries_path(folder)
+    if not os.path.isfile(path):
+        return {}
+    table = pq.read_table(path).to_pandas()
+    return {
+        name: {value: code for code, value in enumerate(values["Value"])}
+        for name, values in table.groupby("Dictionary", observed=True, sort=False)
+    }
+
+
+def write_dictionaries(dictionaries, folder):
+    """
+    Writes the shared dictionaries of a scenario folder.
+
+    The dictionaries only ever grow, so codes stored by earlier datasets of the
+    folder stay valid.
+
+    Args:
+        dictionaries (dict): Dictionary names mapped to {value: code} dicts.
+        folder (str): the scenario folder.
+    """
+    names, values = [], []
+    for name, dictionary in dictionaries.items():
+        names.extend([name] * len(dictionary))
+        values.extend(dictionary)
+    table = pa.table(
+        {
+            "Dictionary": pa.array(names, type=pa.string()).dictionary_encode(),
+            "Value": pa.array(values, type=pa.string()),
+        }
+    )
+    pq.write_table(table, dictionaries_path(folder), compression=uc.PARQUET_COMPRESSION)
+
+
+def dimension_path(folder, dimension_name):
+    """Returns the path of a scenario folder's dimension table."""
+    return os.path.join(
+        folder, f"{uc.DIMENSION_DATASET_PREFIX}{dimension_name}.parquet"
+    )
+
+
+def read_dimensions(folder):
+    """
+    Reads the dimension tables of a scenario folder.
+
+    Row i of a dimension table holds the attributes of the key with shared
+    dictionary code i. Attributes coded with a shared dictionary are stored as
+    codes, -1 for unknown, and the others as floats, NaN for unknown.
+
+    Args:
+        folder (str): the scenario folder.
+
+    Returns:
+        dict: Dimension names mapped to {attribute: np.ndarray} dicts. Empty if
+              the folder has no dimension tables yet.
+    """
+    dimensions = {}
+    for dimension_name in uc.DIMENSIONS:
+        path = dimension_path(folder, dimension_name)
+        if os.path.isfile(path):
+            table = pq.read_table(path)
+            dimensions[dimension_name] = {
+                col_name: np.array(table[col_name]) for col_name in table.column_names
+            }
+    return dimensions
+
+
+def write_dimensions(dimensions, folder):
+    """
+    Writes the dimension tables of a scenario folder.
+
+    Args:
+        dimensions (dict): Dimension names mapped to {attribute: np.ndarray} dicts.
+        folder (str): the scenario folder.
+    """
+    for dimension_name, attributes in dimensions.items():
+        if attributes:
+            pq.write_table(
+                pa.table(attributes),
+                dimension_path(folder, dimension_name),
+                compression=uc.PARQUET_COMPRESSION,
+            )
+
+
+def _is_missing(values):
+    """Returns where dimension values are unknown."""
+    if np.issubdtype(values.dtype, np.floating):
+        return np.isnan(values)
+    return values < 0
+
+
+def _take(values, keys):
+    """Looks up dimension values by key code, unknown for unknown keys."""
+    missing = np.nan if np.issubdtype(values.dtype, np.floating) else -1
+    padded = np.append(values, np.array([missing], dtype=values.dtype))
+    return padded[np.where((keys >= 0) & (keys < len(values)), keys, len(values))]
+
+
+def _dimension_values(column, col_name, dictionaries):
+    """Returns a column as dimension values, or None if it cannot be one."""
+    if col_name in uc.DICTIONARY_COLUMNS:
+        if _dictionary_name(col_name, column.dtype, dictionaries) is None:
+            return None
+        dictionary = dictionaries.setdefault(uc.DICTIONARY_COLUMNS[col_name], {})
+        return _encode(column, dictionary)
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return column.to_numpy(dtype=np.float64)
+    return None
+
+
+def _update_dimensions(batch, dictionaries, dimensions):
+    """
+    Adds the dimension attributes of a batch to the dimension tables.
+
+    Args:
+        batch (pd.DataFrame): A dataset batch.
+        dictionaries (dict): The scenario's shared dictionaries.
+        dimensions (dict): The scenario's dimension tables, see read_dimensions.
+
+    Returns:
+        list: The columns of the batch the dimension tables now hold.
+
+    Raises:
+        ValueError: If an attribute has several values for one key.
+    """
+    factored = []
+    for dimension_name, (key, attributes) in uc.DIMENSIONS.items():
+        if key not in batch.columns:
+            continue
+        keys = _dimension_values(batch[key], key, dictionaries)
+        if keys is None or keys.dtype != np.int32:
+            continue
+        size = len(dictionaries[uc.DICTIONARY_COLUMNS[key]])
+        known = keys >= 0
+        keys = keys[known]
+        table = dimensions.setdefault(dimension_name, {})
+        for attribute in attributes:
+            if attribute not in batch.columns:
+                continue
+            values = _dimension_values(batch[attribute], attribute, dictionaries)
+            if values is None:
+                continue
+            values = values[known]
+            stored = table.get(attribute, values[:0])
+            if len(stored) < size:
+                stored = np.concatenate(
+                    (stored, _take(stored, np.full(size - len(stored), -1)))
+                )
+            previous = stored[keys]
+            stored[keys] = values
+            after = stored[keys]
+            consistent = (after == values) | (_is_missing(after) & _is_missing(values))
+            unchanged = _is_missing(previous) | (previous == after)
+            if not (consistent.all() and unchanged.all()):
+                raise ValueError(f"{attribute} has several values for one {key}")
+            table[attribute] = stored
+            factored.append(attribute)
+    return factored
+
+
+def _dictionary_name(col_name, dtype, dictionaries):
+    """Returns the shared dictionary a column is coded with, or None."""
+    if dictionaries is None or col_name not in uc.DICTIONARY_COLUMNS:
+        return None
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+        return uc.DICTIONARY_COLUMNS[col_name]
+    return None
+
+
+def _encode(column, dictionary):
+    """
+    Encodes a string or categorical column against a shared dictionary.
+
+    Values missing from the dictionary are appended to it.
+
+    Returns:
+        np.ndarray: int32 codes, -1 for missing values.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes, categories = column.cat.codes.to_numpy(), column.cat.categories
+    else:
+        codes, categories = pd.factorize(column)
+    lookup = np.array(
+        [dictionary.setdefault(value, len(dictionary)) for value in categories]
+        + [-1],
+        dtype=np.int32,
+    )
+    return lookup[codes]
+
+
+def _decode(codes, values):
+    """
+    Decodes shared dictionary codes into a categorical of the used values only.
+
+    Args:
+        codes (np.ndarray): Integer codes, -1 for missing values.
+        values (np.ndarray): The dictionary values in code order.
+
+    Returns:
+        pd.Categorical: The column with its categories sorted like csv strings.
+    """
+    used = np.unique(codes[codes >= 0])
+    categories = values[used]
+    order = np.argsort(categories, kind="stable")
+    # The last slot maps missing values (-1) onto -1
+    remap = np.full(len(values) + 1, -1, dtype=np.int32)
+    remap[used[order]] = np.arange(len(used), dtype=np.int32)
+    return pd.Categorical.from_codes(remap[codes], categories=categories[order])
+
+
+def _arrow_schema(df, dictionaries=None):
+    """
+    Builds a stable Arrow schema for a dataset from its first batch.
+
+    Columns coded with a shared dictionary are stored as int32 codes and name
+    their dictionary in the field metadata. Other string and categorical
+    columns are dictionary-encoded with int32 indices so that every batch of a
+    file shares the same schema whatever its categories.
+    """
+    fields = []
+    for col_name, dtype in df.dtypes.items():
+        dictionary_name = _dictionary_name(col_name, dtype, dictionaries)
+        if dictionary_name is not None:
+            fields.append(
+                pa.field(
+                    col_name, pa.int32(), metadata={"dictionary": dictionary_name}
+                )
+            )
+        elif isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+            fields.append(pa.field(col_name, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(col_name, pa.from_numpy_dtype(dtype)))
+    return pa.schema(fields)
+
+
+def write_parquet_batches(batches, output_path, dictionaries=None, dimensions=None):
+    """
+    Writes DataFrame batches one after another into a single parquet file.
+
+    Each batch becomes a row group, so only one batch is held in memory at a time.
+    With dimension tables, the attributes of DIMENSIONS are moved out of the
+    rows into the tables, and the file only keeps the integer keys they are
+    joined back through when read.
+
+    Args:
+        batches (iterable): DataFrames with identical columns.
+        output_path (str): Path of the .parquet file to write.
+        dictionaries (dict): The scenario's shared dictionaries. The columns of
+                             DICTIONARY_COLUMNS are stored as their codes, and
+                             new values are added to the dictionaries. The
+                             caller writes the dictionaries afterwards.
+        dimensions (dict): The scenario's dimension tables, see read_dimensions.
+                           Needs the dictionaries. New keys are added to the
+                           tables, and the caller writes them afterwards.
+    """
+    writer = None
+    try:
+        for batch in batches:
+            columns = list(batch.columns)
+            if dimensions is not None and dictionaries is not None:
+                batch = batch.drop(
+                    columns=_update_dimensions(batch, dictionaries, dimensions)
+                )
+            if writer is None:
+                schema = _arrow_schema(batch, dictionaries)
+                if len(batch.columns) < len(columns):
+                    # The columns of the dataset, including the joined ones
+                    schema = schema.with_metadata({"columns": json.dumps(columns)})
+                writer = pq.ParquetWriter(
+                    output_path, schema, compression=uc.PARQUET_COMPRESSION
+                )
+            # Parquet dictionaries are unordered, ordering is restored on read
+            batch = batch.apply(
+                lambda column: column.cat.as_unordered()
+                if isinstance(column.dtype, pd.CategoricalDtype)
+                else column
+            )
+            coded = [field for field in schema if field.metadata]
+            table = pa.Table.from_pandas(
+                batch.drop(columns=[field.name for field in coded]),
+                schema=pa.schema([field for field in schema if not field.metadata]),
+                preserve_index=False,
+            )
+            for field in coded:
+                dictionary_name = field.metadata[b"dictionary"].decode()
+                codes = _encode(
+                    batch[field.name], dictionaries.setdefault(dictionary_name, {})
+                )
+                table = table.add_column(
+                    schema.get_field_index(field.name),
+                    field,
+                    pa.array(codes, mask=codes < 0),
+                )
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _stored_key(col_name, stored):
+    """Returns the stored key column a dimension attribute is joined through."""
+    _, key = _DIMENSION_OF[col_name]
+    return key if key in stored else _stored_key(key, stored)
+
+
+def _join_dimension(col_name, table, dimensions):
+    """
+    Looks up a dimension attribute for every row of a table through its keys.
+
+    Returns:
+        np.ndarray: The attribute codes or values of the rows.
+    """
+    if col_name in table.column_names:
+        return table[col_name].fill_null(-1).to_numpy()
+    dimension_name, key = _DIMENSION_OF[col_name]
+    keys = _join_dimension(key, table, dimensions)
+    return _take(dimensions[dimension_name][col_name], keys)
+
+
+def read_dataset(path, columns=None):
+    """
+    Reads a stored dataset, loading only the requested columns.
+
+    Parquet datasets are read with projection pushdown, so the other columns
+    are never decoded. Columns stored as shared dictionary codes are decoded
+    with the dictionaries of the dataset's folder, and the requested
+    attributes held by its dimension tables are joined by key. Gzipped csv
+    datasets are supported as a fallback.
+
+    Args:
+        path (str): Path of the .parquet or .csv.gz dataset.
+        columns (list): The columns to load, in order. Columns missing from the
+                        dataset are skipped. All columns are loaded if None.
+
+    Returns:
+        pd.DataFrame: The dataset with string columns as categoricals.
+    """
+    if str(path).endswith(".parquet"):
+        schema = pq.read_schema(path)
+        names = schema.names
+        if schema.metadata and b"columns" in schema.metadata:
+            names = json.loads(schema.metadata[b"columns"])
+        if columns is None:
+            columns = names
+        columns = [col_name for col_name in columns if col_name in names]
+        joined = [col_name for col_name in columns if col_name not in schema.names]
+        keys = [_stored_key(col_name, schema.names) for col_name in joined]
+        table = pq.read_table(
+            path,
+            columns=[col_name for col_name in columns if col_name in schema.names]
+            + [key for key in dict.fromkeys(keys) if key not in columns],
+        )
+        coded = {
+            field.name: field.metadata[b"dictionary"].decode()
+            for field in table.schema
+            if field.metadata and b"dictionary" in field.metadata
+        }
+        data = table.drop_columns(list(coded)).to_pandas()
+        # Sort the categories like the csv strings would be sorted when grouped
+        for col_name in data.select_dtypes("category").columns:
+            data[col_name] = data[col_name].cat.reorder_categories(
+                data[col_name].cat.categories.sort_values()
+            )
+        folder = os.path.dirname(str(path))
+        if coded or joined:
+            dictionaries = read_dictionaries(folder)
+        if coded:
+            for col_name, dictionary_name in coded.items():
+                values = np.array(list(dictionaries[dictionary_name]), dtype=object)
+                codes = table[col_name].fill_null(-1).to_numpy()
+                data.insert(
+                    table.schema.get_field_index(col_name),
+                    col_name,
+                    _decode(codes, values),
+                )
+        if joined:
+            dimensions = read_dimensions(folder)
+            for col_name in joined:
+                values = _join_dimension(col_name, table, dimensions)
+                if col_name in uc.DICTIONARY_COLUMNS:
+                    dictionary = dictionaries[uc.DICTIONARY_COLUMNS[col_name]]
+                    values = _decode(values, np.array(list(dictionary), dtype=object))
+                data[col_name] = values
+    else:
+        usecols = None
+        if columns is not None:
+            usecols = lambda col_name: col_name in columns or col_name == "Unnamed: 0"
+        data = pd.read_csv(path, index_col=0, usecols=usecols)
+        data = data.infer_objects()
+        if columns is not None:
+            columns = [col_name for col_name in columns if col_name in data.columns]
+    if columns is not None:
+        data = data[columns]
+    if "Mobility mode" in data.columns:
+        mobility_modes = data["Mobility mode"]
+        if isinstance(mobility_modes.dtype, pd.CategoricalDtype):
+            # Parquet categories are already sorted
+            mobility_modes = mobility_modes.cat.as_ordered()
+        else:
+            mobility_modes = pd.Categorical(
+                np.asarray(mobility_modes, dtype=object), ordered=True
+            )
+        data = data.assign(**{"Mobility mode": mobility_modes})
+    return data
+
+
+def _source_version(path):
+    """Returns the size and modification time of a file as a string."""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def mapped_path(path, dataset_name, folder=uc.MAPPED_DATASETS):
+    """
+    Returns the path of the memory-mapped copy of a stored dataset.
+
+    Args:
+        path (str): Path of the stored dataset.
+        dataset_name (str): The name the dataset is loaded as, eg. emission_cube
+                            for a cube built from an emission dataset.
+        folder (str): The folder of the memory-mapped copies.
+    """
+    digest = hashlib.blake2b(
+        repr((os.path.abspath(path), dataset_name)).encode(), digest_size=16
+    )
+    return os.path.join(folder, f"{digest.hexdigest()}.arrow")
+
+
+def write_mapped(data, path, source_version=""):
+    """
+    Writes a DataFrame as an uncompressed Arrow IPC (Feather v2) file.
+
+    Every column is stored the way pandas holds it: numbers as they are, NaN
+    included, and categoricals as their codes and categories, missing values
+    as nulls. So the columns read back by read_mapped are views of the file's
+    pages, apart from categoricals with missing values.
+
+    Args:
+        data (pd.DataFrame): The dataset, with string columns as categoricals.
+        path (str): Path of the .arrow file, replaced atomically.
+        source_version (str): The version of the dataset it was decoded from.
+    """
+    arrays = []
+    for col_name, column in data.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy()
+            arrays.append(
+                pa.DictionaryArray.from_arrays(
+                    pa.array(codes, mask=codes < 0),
+                    pa.array(column.cat.categories.to_numpy(dtype=object)),
+                    ordered=column.cat.ordered,
+                )
+            )
+        else:
+            arrays.append(pa.array(column.to_numpy()))
+    table = pa.Table.from_arrays(
+        arrays,
+        names=[str(col_name) for col_name in data.columns],
+        metadata={"source": source_version},
+    )
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    os.close(handle)
+    try:
+        with pa.OSFile(temporary, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def read_mapped(path, source_version=None):
+    """
+    Opens a dataset written by write_mapped without copying it.
+
+    The file is memory-mapped, so the columns are read-only views of pages the
+    operating system shares between every process that opens the file, and
+    nothing is read from the disk until a computation touches a column.
+
+    Args:
+        path (str): Path of the .arrow file.
+        source_version (str): The expected version of the dataset it was
+                              decoded from, not checked if None.
+
+    Returns:
+        pd.DataFrame: The dataset, None if the file is missing or was decoded
+                      from another version.
+    """
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    if source_version is not None:
+        metadata = reader.schema.metadata or {}
+        if metadata.get(b"source", b"").decode() != source_version:
+            return None
+    return reader.read_all().to_pandas(split_blocks=True)
+
+
+def map_dataset(path, dataset_name, load, folder=uc.MAPPED_DATASETS):
+    """
+    Returns a stored dataset as a memory-mapped DataFrame.
+
+    The first process to ask for a dataset decodes it with load and writes the
+    memory-mapped copy, and every later one only maps the copy. The copy is
+    decoded again once the stored dataset changes.
+
+    Args:
+        path (str): Path of the stored dataset.
+        dataset_name (str): The name the dataset is loaded as.
+        load (callable): Decodes the dataset given the path.
+        folder (str): The folder of the memory-mapped copies.
+
+    Returns:
+        pd.DataFrame: The dataset, its columns backed by the memory-mapped copy.
+    """
+    copy_path = mapped_path(path, dataset_name, folder)
+    source_version = _source_version(path)
+    data = read_mapped(copy_path, source_version)
+    if data is not None:
+        return data
+    data = load(path)
+    try:
+        write_mapped(data, copy_path, source_version)
+    except PermissionError:
+        # Windows cannot replace a file another process has mapped
+        return data
+    mapped = read_mapped(copy_path)
+    return data if mapped is None else mapped
+
+
+def kpis_path(folder):
+    """Returns the path of a scenario folder's KPI sidecar."""
+    return os.path.join(folder, f"{uc.KPI_DATASET}.json")
+
+
+def read_kpis(folder):
+    """
+    Reads the KPI sidecar of a scenario folder.
+
+    Args:
+        folder (str): the scenario folder.
+
+    Returns:
+        dict: The KPIs from scenario_kpis, None if the folder has no sidecar.
+    """
+    try:
+        with open(kpis_path(folder), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_kpis(kpis, folder):
+    """
+    Writes the KPI sidecar of a scenario folder.
+
+    Args:
+        kpis (dict): The KPIs from scenario_kpis.
+        folder (str): the scenario folder.
+    """
+    temporary = f"{kpis_path(folder)}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(kpis, f, indent=1)
+    os.replace(temporary, kpis_path(folder))
+
+
+def _stored_dataset(folder, dataset_name):
+    """Returns the path of a dataset of a folder, None if it has not been written."""
+    path = dataset_path(folder, dataset_name)
+    return path if os.path.isfile(path) else None
+
+
+def scenario_kpis(folder, cube=None):
+    """
+    Summarizes the trips and emissions of a scenario.
+
+    The emission totals are summed from the emission cube, which includes the
+    rows of internal junction lanes, or from the emission dataset of scenarios
+    without one, so both give the totals of every emission row.
+
+    Args:
+        folder (str): the scenario folder.
+        cube (pd.DataFrame): The scenario's emission cube, read from the folder
+                             by default.
+
+    Returns:
+        dict: Under trips, the number of trips, the mobility flow and the mean
+              travel and lost time of every mobility mode, and under emissions
+              the total of every pollutant of KPI_POLLUTANTS.
+    """
+    trips = []
+    trip_path = _stored_dataset(folder, uc.KPI_TRIP_DATASET)
+    if trip_path is not None:
+        trip_dataset = read_dataset(
+            trip_path,
+            columns=["Mobility mode", "Travel time", "Lost time", "Mobility flow"],
+        )
+        trip_kpis = (
+            trip_dataset.groupby(["Mobility mode"], observed=False)
+            .agg(
+                **{
+                    "Trips": ("Travel time", "size"),
+                    "Mobility flow": ("Mobility flow", "sum"),
+                    "Travel time": ("Travel time", "mean"),
+                    "Lost time": ("Lost time", "mean"),
+                }
+            )
+            .reset_index()
+        )
+        # NaN means of modes without trips are written as nulls
+        trips = [
+            {
+                col: None if pd.isna(value) else value
+                for col, value in zip(trip_kpis.columns, row)
+            }
+            for row in trip_kpis.astype(object).itertuples(index=False)
+        ]
+    emissions = {}
+    if cube is None:
+        source = _stored_dataset(folder, uc.CUBE_DATASET) or _stored_dataset(
+            folder, uc.FROM_VAR_TO_DATA_COLS["Carbon dioxide"][0]
+        )
+        if source is not None:
+            cube = read_dataset(source, columns=uc.KPI_POLLUTANTS)
+    if cube is not None:
+        emissions = {
+            pollutant: float(cube[pollutant].sum())
+            for pollutant in uc.KPI_POLLUTANTS
+            if pollutant in cube.columns
+        }
+    return {"trips": trips, "emissions": emissions}
+
+
+def migrate_scenarios(root=uc.SCENARIO_ROOT, remove_csv=False):
+    """
+    Converts the gzipped csv datasets of a scenario tree into parquet.
+
+    String columns are coded with the shared dictionaries of each scenario
+    folder, and the attributes of DIMENSIONS go into its dimension tables.
+    Datasets that already have an up-to-date parquet file are skipped. Scenario
+    folders without a KPI sidecar get one.
+
+    Args:
+        root (str): the root folder of the scenario tree.
+        remove_csv (bool): whether to remove the csv files once converted.
+
+    Returns:
+        list: The paths of the written parquet files and KPI sidecars.
+    """
+    written = []
+    csv_paths = glob.glob(os.path.join(root, "**", "*.csv.gz"), recursive=True)
+    for csv_path in sorted(csv_paths):
+        parquet_path = csv_path[: -len(".csv.gz")] + ".parquet"
+        if not (
+            os.path.isfile(parquet_path)
+            and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)
+        ):
+            folder = os.path.dirname(csv_path)
+            dictionaries = read_dictionaries(folder)
+            dimensions = read_dimensions(folder)
+            write_parquet_batches(
+                [read_dataset(csv_path)], parquet_path, dictionaries, dimensions
+            )
+            write_dictionaries(dictionaries, folder)
+            write_dimensions(dimensions, folder)
+            written.append(parquet_path)
+        if remove_csv:
+            os.remove(csv_path)
+    # Scenarios aggregated before the KPI sidecars existed
+    folders = {
+        os.path.dirname(path)
+        for path in glob.glob(
+            os.path.join(root, "**", f"{uc.KPI_TRIP_DATASET}.*"), recursive=True
+        )
+    }
+    for folder in sorted(folders):
+        if read_kpis(folder) is None:
+            write_kpis(scenario_kpis(folder), folder)
+            written.append(kpis_path(folder))
+    return written
+
+
+if __name__ == "__main__":
+    for parquet_path in migrate_scenarios():
+        print(f"Wrote {parquet_path}")
@@ -0,0 +1,216 @@
+# utils/sweep.py
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+import pandas as pd
+import utils.constants as uc
+import utils.helpers as uh
+import utils.store as us
+
+SWEEP_LOG_COLUMNS = [
+    "Area",
+    "Demand",
+    "Season",
+    "Time",
+    "Situation",
+    "Optimization",
+    "Status",
+    "Seconds",
+    "Error",
+]
+
+
+def read_scenarios(path=uc.ALL_SCENARIOS):
+    """
+    Reads the scenario combinations to simulate.
+
+    Args:
+        path (str): the csv listing Area, Demand, Season, Time, Situation and
+                    Optimization per scenario.
+
+    Returns:
+        list: One dict of run_scenario arguments per scenario, in file order.
+    """
+    slider_values = {
+        value: slider for slider, value in uc.OPTIMIZATION_SLIDER_VALUES.items()
+    }
+    scenarios = []
+    for row in pd.read_csv(path, dtype=str).fillna("").itertuples(index=False):
+        scenarios.append(
+            {
+                "area": row.Area.lower(),
+                "demand": row.Demand.lower(),
+                "season": row.Season.lower(),
+                "time": row.Time.lower(),
+                "situation": row.Situation.lower(),
+                "optimization": slider_values.get(row.Optimization.lower(), 0),
+            }
+        )
+    return scenarios
+
+
+def _scenario_label(scenario):
+    """Returns a unique label of a scenario, also used for its TraCI connection."""
+    folder = us.scenario_folder(**scenario)
+    return os.path.relpath(folder, uc.SCENARIO_ROOT).replace(os.sep, "_")
+
+
+def _log_row(scenario, status, seconds, error=""):
+    return [
+        scenario["area"],
+        scenario["demand"],
+        scenario["season"],
+        scenario["time"],
+        scenario["situation"],
+        scenario["optimization"],
+        status,
+        round(seconds, 1),
+        error,
+    ]
+
+
+def _finished_labels(log_path):
+    """Returns the labels of the scenarios the sweep log records as finished."""
+    if not os.path.isfile(log_path):
+        return set()
+    log = pd.read_csv(log_path, dtype={"Optimization": int}, keep_default_na=False)
+    # Later rows override earlier ones, so a scenario rerun after a failure counts
+    log = log.drop_duplicates(
+        subset=SWEEP_LOG_COLUMNS[: SWEEP_LOG_COLUMNS.index("Status")], keep="last"
+    )
+    return {
+        _scenario_label(
+            {
+                "area": row.Area,
+                "demand": row.Demand,
+                "season": row.Season,
+                "time": row.Time,
+                "situation": row.Situation,
+                "optimization": row.Optimization,
+            }
+        )
+        for row in log.itertuples(index=False)
+        if row.Status == "done"
+    }
+
+
+def _run_one(scenario, seed, backend):
+    """
+    Runs one scenario in a worker process.
+
+    Returns:
+        tuple: The status, done or failed, the wall time and the error message.
+    """
+    start = time.perf_counter()
+    try:
+        # The sweep already runs a scenario per core, so routing stays in process
+        uh.run_scenario(
+            **scenario,
+            seed=seed,
+            label=_scenario_label(scenario),
+            backend=backend,
+            routing_workers=1,
+        )
+    except BaseException as error:  # SystemExit from a missing SUMO_HOME too
+        message = f"{type(error).__name__}: {error}"
+        return "failed", time.perf_counter() - start, message
+    return "done", time.perf_counter() - start, ""
+
+
+def _print_progress(finished, total, scenario, status, seconds, elapsed):
+    """Prints one line per finished scenario with an estimate of the time left."""
+    remaining = elapsed / finished * (total - finished)
+    print(
+        f"[{finished}/{total}] {_scenario_label(scenario)}: {status} "
+        f"in {seconds:.0f}s, {remaining / 60:.0f} min left",
+        flush=True,
+    )
+
+
+def run_sweep(
+    scenarios=None,
+    workers=uc.SWEEP_WORKERS,
+    resume=True,
+    seed=123,
+    log_path=uc.SWEEP_LOG,
+    progress=_print_progress,
+    backend=uc.SIMULATION_BACKEND,
+):
+    """
+    Simulates many scenarios in parallel, one SUMO instance per worker process.
+
+    Every finished scenario is appended to the sweep log, whether it succeeded
+    or failed. A failed scenario does not stop the sweep, and with resume the
+    scenarios the log records as done are skipped, so running the sweep again
+    only simulates the failed and missing ones.
+
+    Args:
+        scenarios (list): run_scenario arguments per scenario, the scenarios of
+                          all_scenarios.csv by default.
+        workers (int): the maximum number of simulations at once, None for one
+                       per core.
+        resume (bool): whether to skip the scenarios already done.
+        seed (int): the seed of the random demand of every scenario.
+        log_path (str): the sweep log csv.
+        progress (callable): called with (finished, total, scenario, status,
+                             seconds, elapsed) after each scenario, or None.
+        backend (str): libsumo or traci, see utils.backends.
+
+    Returns:
+        pd.DataFrame: The log rows of the scenarios simulated by this sweep.
+    """
+    if scenarios is None:
+        scenarios = read_scenarios()
+    if resume:
+        finished = _finished_labels(log_path)
+        scenarios = [
+            scenario
+            for scenario in scenarios
+            if _scenario_label(scenario) not in finished
+        ]
+    rows = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_run_one, scenario, seed, backend): scenario for scenario in scenarios
+        }
+        for future in concurrent.futures.as_completed(futures):
+            scenario = futures[future]
+            status, seconds, error = future.result()
+            row = _log_row(scenario, status, seconds, error)
+            pd.DataFrame([row], columns=SWEEP_LOG_COLUMNS).to_csv(
+                log_path, mode="a", header=not os.path.isfile(log_path), index=False
+            )
+            rows.append(row)
+            if progress is not None:
+                progress(
+                    len(rows),
+                    len(scenarios),
+                    scenario,
+                    status,
+                    seconds,
+                    time.perf_counter() - start,
+                )
+    return pd.DataFrame(rows, columns=SWEEP_LOG_COLUMNS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate every scenario.")
+    parser.add_argument("--workers", type=int, default=uc.SWEEP_WORKERS)
+    parser.add_argument("--no-resume", dest="resume", action="store_false")
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument(
+        "--backend", default=uc.SIMULATION_BACKEND, choices=["traci", "libsumo"]
+    )
+    args = parser.parse_args()
+    log = run_sweep(
+        workers=args.workers,
+        resume=args.resume,
+        seed=args.seed,
+        backend=args.backend,
+    )
+    failed = log[log["Status"] == "failed"]
+    print(f"{len(log) - len(failed)} scenarios done, {len(failed)} failed")
+    sys.exit(1 if len(failed) else 0)
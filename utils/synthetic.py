@@ -0,0 +1,462 @@
+# utils/synthetic.py
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+import utils.constants as uc
+import utils.demand as ud
+import utils.helpers as uh
+import utils.network as un
+import utils.routing as ur
+import utils.store as us
+
+# Speed limit of the streets of the area, in m/s
+_SPEED_LIMIT = 50 / 3.6
+# Per second emissions of a petrol car, in mg, are _CO2_IDLE + _CO2_PER_SPEED *
+# speed, and the other pollutants are shares of them. The values follow the
+# SUMO trip outputs of the Kamppi baseline.
+_CO2_IDLE = 1100.0
+_CO2_PER_SPEED = 95.0
+_POLLUTANT_SHARES = {
+    "CO": 0.0585,
+    "HC": 0.0142,
+    "NOx": 0.0066,
+    "PMx": 7.45e-5,
+}
+_FUEL_PER_CO2 = 1 / 3.1
+# Brake and tyre particles of an electric car in mg/s, and its consumption in Wh/s
+_EV_PMX_IDLE = 0.06
+_EV_PMX_PER_SPEED = 0.008
+_EV_ELECTRICITY = (0.28, 0.02, 0.0015)
+_EMISSION_CLASSES = {"fuel": "HBEFA4/PC_petrol_ltECE", "electric": "HBEFA4/PC_BEV"}
+
+
+def _nearest_edges(network, edges):
+    """
+    Restricts the edge graph of a compiled network to its central edges.
+
+    Args:
+        network (dict): The compiled road network, from load_network.
+        edges (int): The number of graph edges closest to the middle of the
+                     network to keep, all edges if None.
+
+    Returns:
+        dict: The network with the edge graph of the kept edges only.
+    """
+    graph_edge = np.asarray(network["graph_edge"])
+    if edges is None or edges >= len(graph_edge):
+        return network
+    x = np.asarray(network["edge_x"])[graph_edge]
+    y = np.asarray(network["edge_y"])[graph_edge]
+    distance = np.hypot(x - np.nanmedian(x), y - np.nanmedian(y))
+    keep = np.sort(np.argsort(np.nan_to_num(distance, nan=np.inf))[:edges])
+    _, adjacency, travel_times = un.network_graph(network)
+    adjacency = adjacency[keep][:, keep].tocsr()
+    return {
+        **network,
+        "graph_edge": graph_edge[keep],
+        "graph_indptr": adjacency.indptr.astype(np.int32),
+        "graph_indices": adjacency.indices.astype(np.int32),
+        "graph_travel_time": travel_times[keep],
+    }
+
+
+def _movements(trips, network, seconds, rng):
+    """
+    Moves every vehicle along its route, one row per vehicle and second.
+
+    A vehicle drives every edge at a share of the free-flow speed and stops at
+    the end of some edges, eg. at traffic lights. Rows after the last second
+    are dropped.
+
+    Returns:
+        tuple: The rows as a DataFrame in second and vehicle order, and the
+               arrival second and free-flow travel time of every trip, the
+               arrival after the last second for unfinished trips.
+    """
+    edge_ids, _, travel_times = un.network_graph(network)
+    routes = trips["Route"].str.split(" ")
+    legs_per_trip = routes.str.len().to_numpy()
+    leg_trip = np.repeat(np.arange(len(trips)), legs_per_trip)
+    leg_edge = pd.Index(edge_ids).get_indexer(np.concatenate(routes.to_list()))
+    free_flow = travel_times[leg_edge]
+    speed_share = rng.uniform(*uc.SYNTHETIC_SPEED_SHARE, size=len(trips))[leg_trip]
+    moving = np.maximum(1, np.ceil(free_flow / speed_share)).astype(np.int64)
+    stops = rng.random_sample(len(leg_edge)) < uc.SYNTHETIC_STOP_SHARE
+    waiting = np.where(
+        stops, rng.randint(*uc.SYNTHETIC_STOP_SECONDS, size=len(leg_edge)), 0
+    )
+    durations = moving + waiting
+    ends = np.cumsum(durations)
+    # The first second of every leg counted from the departure of its trip
+    trip_starts = np.concatenate(([0], ends[np.cumsum(legs_per_trip)[:-1] - 1]))
+    leg_offsets = ends - durations - trip_starts[leg_trip]
+    departures = trips["Depart"].to_numpy()
+    leg_starts = departures[leg_trip] + leg_offsets
+
+    row_leg = np.repeat(np.arange(len(leg_edge)), durations)
+    within = np.arange(len(row_leg)) - np.repeat(ends - durations, durations)
+    timesteps = leg_starts[row_leg] + within
+    kept = timesteps < seconds
+    row_leg, within, timesteps = row_leg[kept], within[kept], timesteps[kept]
+    stopped = within >= moving[row_leg]
+    speed = np.where(
+        stopped,
+        0.0,
+        _SPEED_LIMIT * speed_share[row_leg] * rng.uniform(0.85, 1.15, len(row_leg)),
+    )
+    rows = pd.DataFrame(
+        {
+            "Timestep": timesteps,
+            "Trip": leg_trip[row_leg],
+            "Edge": network["graph_edge"][leg_edge[row_leg]],
+            "Speed": speed,
+            "Waiting": np.where(stopped, within - moving[row_leg] + 1, 0),
+            "Position": np.minimum(within, moving[row_leg]) * speed,
+        }
+    ).sort_values(["Timestep", "Trip"], kind="stable", ignore_index=True)
+    arrivals = departures + ends[np.cumsum(legs_per_trip) - 1] - trip_starts
+    trip_free_flow = np.bincount(leg_trip, weights=free_flow, minlength=len(trips))
+    return rows, arrivals, trip_free_flow
+
+
+def _emissions(rows, electric, rng):
+    """Adds the per second emissions, consumption and noise of every row."""
+    speed = rows["Speed"].to_numpy()
+    fuel = ~electric[rows["Trip"].to_numpy()]
+    noise = rng.lognormal(0, 0.15, len(rows))
+    co2 = np.where(fuel, (_CO2_IDLE + _CO2_PER_SPEED * speed) * noise, 0.0)
+    pollutants = {
+        pollutant: co2 * share for pollutant, share in _POLLUTANT_SHARES.items()
+    }
+    pollutants["PMx"] = np.where(
+        fuel, pollutants["PMx"], (_EV_PMX_IDLE + _EV_PMX_PER_SPEED * speed) * noise
+    )
+    idle, linear, square = _EV_ELECTRICITY
+    electricity = np.where(fuel, 0.0, idle + linear * speed + square * speed**2)
+    sound = 50 + 15 * np.log10(1 + speed) + rng.normal(0, 1, len(rows))
+    return rows.assign(
+        CO2=co2,
+        **pollutants,
+        Fuel=co2 * _FUEL_PER_CO2,
+        Electricity=electricity,
+        Noise=np.where(fuel, sound, sound - 3),
+    )
+
+
+def _write_emissions(rows, trips, network, file_path):
+    """Writes the rows as a SUMO emission output."""
+    lane_edge = np.asarray(network["lane_edge"])
+    # The rightmost lane of every edge
+    first_lane = np.full(len(network["edge_id"]), -1)
+    first_lane[lane_edge[::-1]] = np.arange(len(lane_edge))[::-1]
+    lanes = network["lane_id"][first_lane[rows["Edge"].to_numpy()]].tolist()
+    x = network["edge_x"][rows["Edge"].to_numpy()].tolist()
+    y = network["edge_y"][rows["Edge"].to_numpy()].tolist()
+    types = trips["Type"].to_numpy()[rows["Trip"].to_numpy()].tolist()
+    timesteps = rows["Timestep"].to_numpy()
+    bounds = np.flatnonzero(np.diff(timesteps)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(rows)]))
+    columns = [
+        rows[col].tolist()
+        for col in [
+            "Trip",
+            "CO2",
+            "CO",
+            "HC",
+            "NOx",
+            "PMx",
+            "Fuel",
+            "Electricity",
+            "Noise",
+            "Waiting",
+            "Position",
+            "Speed",
+        ]
+    ]
+    with open(file_path, "w", encoding="UTF-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<emission-export>\n')
+        for start, end in zip(starts, ends):
+            f.write(f'    <timestep time="{timesteps[start]:.2f}">\n')
+            f.write(
+                "".join(
+                    f'        <vehicle id="test_trip_{trip}" '
+                    f'eclass="{_EMISSION_CLASSES[types[i]]}" CO2="{co2:.2f}" '
+                    f'CO="{co:.2f}" HC="{hc:.2f}" NOx="{nox:.2f}" PMx="{pmx:.4f}" '
+                    f'fuel="{fuel:.2f}" electricity="{electricity:.2f}" '
+                    f'noise="{noise:.2f}" route="!test_trip_{trip}" '
+                    f'type="{types[i]}" waiting="{waiting:.2f}" lane="{lanes[i]}" '
+                    f'pos="{position:.2f}" speed="{speed:.2f}" angle="0.00" '
+                    f'x="{x[i]:.2f}" y="{y[i]:.2f}"/>\n'
+                    for i, (
+                        trip,
+                        co2,
+                        co,
+                        hc,
+                        nox,
+                        pmx,
+                        fuel,
+                        electricity,
+                        noise,
+                        waiting,
+                        position,
+                        speed,
+                    ) in zip(
+                        range(start, end),
+                        zip(*(column[start:end] for column in columns)),
+                    )
+                )
+            )
+            f.write("    </timestep>\n")
+        f.write("</emission-export>\n")
+
+
+def _write_edge_noise(rows, network, file_path):
+    """
+    Writes the noise of the occupied edges of every second as a SUMO edge
+    noise output, the noise of an edge being the energetic sum of its vehicles.
+    """
+    edges = rows["Edge"].to_numpy()
+    keys = rows["Timestep"].to_numpy() * len(network["edge_id"]) + edges
+    unique, inverse = np.unique(keys, return_inverse=True)
+    energy = np.bincount(inverse, weights=10 ** (rows["Noise"].to_numpy() / 10))
+    noise = (10 * np.log10(energy)).tolist()
+    timesteps = (unique // len(network["edge_id"])).tolist()
+    edge_ids = network["edge_id"][unique % len(network["edge_id"])].tolist()
+    with open(file_path, "w", encoding="UTF-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<meandata>\n')
+        previous = None
+        for timestep, edge_id, level in zip(timesteps, edge_ids, noise):
+            if timestep != previous:
+                if previous is not None:
+                    f.write("    </interval>\n")
+                f.write(
+                    f'    <interval begin="{timestep:.2f}" end="{timestep + 1:.2f}" '
+                    'id="edge-noise">\n'
+                )
+                previous = timestep
+            f.write(f'        <edge id="{edge_id}" noise="{level:.2f}"/>\n')
+        if previous is not None:
+            f.write("    </interval>\n")
+        f.write("</meandata>\n")
+
+
+def _write_trips(rows, trips, arrivals, free_flow, seconds, file_path):
+    """Writes the trips that arrived before the last second as a SUMO tripinfo output."""
+    totals = {
+        pollutant: np.bincount(
+            rows["Trip"].to_numpy(),
+            weights=rows[pollutant].to_numpy(),
+            minlength=len(trips),
+        )
+        for pollutant in ["CO", "CO2", "HC", "PMx", "NOx", "Fuel", "Electricity"]
+    }
+    durations = arrivals - trips["Depart"].to_numpy()
+    time_loss = np.maximum(0.0, durations - free_flow)
+    with open(file_path, "w", encoding="UTF-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<tripinfos>\n')
+        for trip in np.flatnonzero(arrivals <= seconds):
+            f.write(
+                f'    <tripinfo id="test_trip_{trip}" '
+                f'depart="{trips["Depart"].iat[trip]:.2f}" '
+                f'arrival="{arrivals[trip]:.2f}" duration="{durations[trip]:.2f}" '
+                f'timeLoss="{time_loss[trip]:.2f}" vType="{trips["Type"].iat[trip]}">\n'
+                f'        <emissions CO_abs="{totals["CO"][trip]:.2f}" '
+                f'CO2_abs="{totals["CO2"][trip]:.2f}" HC_abs="{totals["HC"][trip]:.2f}" '
+                f'PMx_abs="{totals["PMx"][trip]:.2f}" '
+                f'NOx_abs="{totals["NOx"][trip]:.2f}" '
+                f'fuel_abs="{totals["Fuel"][trip]:.2f}" '
+                f'electricity_abs="{totals["Electricity"][trip]:.2f}"/>\n'
+                "    </tripinfo>\n"
+            )
+        f.write("</tripinfos>\n")
+
+
+def write_synthetic_outputs(
+    net_path,
+    output_folder,
+    vehicles=uc.SYNTHETIC_VEHICLES,
+    seconds=uc.SYNTHETIC_SECONDS,
+    edges=None,
+    demand="regular",
+    season="summer",
+    time="weekday",
+    seed=123,
+):
+    """
+    Writes made-up SUMO emission, edge noise and trip outputs of a road network.
+
+    The vehicles depart following the demand profile of the scenario and drive
+    the fastest route between random edges that can reach each other, at a
+    share of the speed limit and with stops along the way. Their emissions are
+    scaled to the SUMO outputs of the Kamppi baseline.
+
+    Args:
+        net_path (str): Path to the SUMO network XML file.
+        output_folder (str): The folder to write emission_results.xml,
+                             edge_noise_results.xml and trip_results.xml into.
+        vehicles (int): The number of trips.
+        seconds (int): The simulated seconds.
+        edges (int): Only drive on this many edges around the middle of the
+                     network, all edges if None.
+        demand (str): the amount of mobility, for the departure profile.
+        season (str): the season, for the departure profile.
+        time (str): the time of week, weekday or weekend.
+        seed (int): the seed of the random state.
+
+    Returns:
+        int: The number of emission rows written.
+    """
+    network = _nearest_edges(un.load_network(net_path), edges)
+    end = max(1, seconds * uc.TRIP_INSERTION_END // uc.SIMULATION_END)
+    trips = ud.generate_trips(
+        network, demand, season, time, seed=seed, end=end, trips=vehicles
+    )
+    trips = ur.route_trips(network, trips, workers=1)
+    trips = trips[trips["Route"].notna()].reset_index(drop=True)
+    rng = np.random.RandomState(seed)
+    rows, arrivals, free_flow = _movements(trips, network, seconds, rng)
+    rows = _emissions(rows, (trips["Type"] == "electric").to_numpy(), rng)
+    os.makedirs(output_folder, exist_ok=True)
+    _write_emissions(
+        rows, trips, network, os.path.join(output_folder, "emission_results.xml")
+    )
+    _write_edge_noise(
+        rows, network, os.path.join(output_folder, "edge_noise_results.xml")
+    )
+    _write_trips(
+        rows,
+        trips,
+        arrivals,
+        free_flow,
+        seconds,
+        os.path.join(output_folder, "trip_results.xml"),
+    )
+    return len(rows)
+
+
+def synthesize_scenario(
+    area="kamppi",
+    demand="regular",
+    season="summer",
+    time="weekday",
+    situation="baseline",
+    optimization=0,
+    vehicles=uc.SYNTHETIC_VEHICLES,
+    seconds=uc.SYNTHETIC_SECONDS,
+    edges=None,
+    seed=123,
+    root=uc.SCENARIO_ROOT,
+    net_path=None,
+    overwrite=False,
+    workers=uc.INGEST_WORKERS,
+):
+    """
+    Makes up the datasets of a scenario without running SUMO.
+
+    The outputs of write_synthetic_outputs are converted by aggregate_outputs
+    into the scenario folder, so get_data reads them like simulated ones. The
+    default scenario is not one the repository ships, so its datasets are
+    never replaced by accident.
+
+    Args:
+        area, demand, season, time, situation, optimization: The scenario, see
+            store.scenario_folder.
+        vehicles (int): The number of trips.
+        seconds (int): The simulated seconds.
+        edges (int): The number of edges driven on, all edges if None.
+        seed (int): the seed of the random state.
+        root (str): the root folder of the scenario tree.
+        net_path (str): Path to the SUMO network XML file, the area's
+                        baseline_net.xml under SCENARIO_ROOT by default.
+        overwrite (bool): Whether to replace the datasets of the scenario,
+                          including simulated or shipped ones.
+        workers (int): The processes aggregate_outputs parses with.
+
+    Returns:
+        str: The scenario folder the datasets were written into.
+
+    Raises:
+        FileExistsError: If the scenario already has datasets and overwrite is
+                         False.
+    """
+    if net_path is None:
+        net_path = os.path.join(uc.SCENARIO_ROOT, area.lower(), "baseline_net.xml")
+    folder = us.scenario_folder(
+        area=area,
+        demand=demand,
+        season=season,
+        time=time,
+        situation=situation,
+        optimization=optimization,
+        root=root,
+    )
+    existing = [
+        path
+        for pattern in ["*.parquet", "*.csv.gz", f"{uc.KPI_DATASET}.json"]
+        for path in glob.glob(os.path.join(folder, pattern))
+    ]
+    if existing and not overwrite:
+        raise FileExistsError(f"The scenario already has datasets at: {folder}")
+    # The shared dictionaries and dimension tables are started over too
+    for path in existing:
+        os.remove(path)
+    write_synthetic_outputs(
+        net_path,
+        folder,
+        vehicles=vehicles,
+        seconds=seconds,
+        edges=edges,
+        demand=demand,
+        season=season,
+        time=time,
+        seed=seed,
+    )
+    uh.aggregate_outputs(net_path=net_path, full_output_folder=folder, workers=workers)
+    return folder
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make up scenario datasets.")
+    parser.add_argument("--area", default="kamppi")
+    parser.add_argument("--demand", default="regular")
+    parser.add_argument("--season", default="summer")
+    parser.add_argument("--time", default="weekday")
+    parser.add_argument(
+        "--situations", nargs="+", default=["baseline", "optimized"]
+    )
+    parser.add_argument("--optimization", type=int, default=0)
+    parser.add_argument("--vehicles", type=int, default=uc.SYNTHETIC_VEHICLES)
+    parser.add_argument("--seconds", type=int, default=uc.SYNTHETIC_SECONDS)
+    parser.add_argument("--edges", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=123)
+    parser.add_argument("--root", default=uc.SCENARIO_ROOT)
+    parser.add_argument("--net-path", default=None)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Replace the datasets of the scenario, even shipped or simulated ones.",
+    )
+    args = parser.parse_args()
+    for i, situation in enumerate(args.situations):
+        folder = synthesize_scenario(
+            area=args.area,
+            demand=args.demand,
+            season=args.season,
+            time=args.time,
+            situation=situation,
+            optimization=args.optimization,
+            vehicles=args.vehicles,
+            seconds=args.seconds,
+            edges=args.edges,
+            # The situations differ like two simulation runs
+            seed=args.seed + i,
+            root=args.root,
+            net_path=args.net_path,
+            overwrite=args.overwrite,
+        )
+        print(f"Wrote {folder}")
+    sys.exit(0)